@@ -22,6 +22,24 @@ if READ_DOT_ENV_FILE:
 OPENAI_API_KEY = env.str("OPENAI_API_KEY")
 OPENAI_BASE_URL = env.str("OPENAI_BASE_URL")
 LLM_MODEL = env.str("LLM_MODEL")
+# Connection pool size and timeouts (in seconds) of the shared LLM clients
+LLM_POOL_SIZE = env.int("LLM_POOL_SIZE", default=20)
+LLM_TIMEOUT = env.float("LLM_TIMEOUT", default=60.0)
+LLM_CONNECT_TIMEOUT = env.float("LLM_CONNECT_TIMEOUT", default=5.0)
+LLM_MAX_RETRIES = env.int("LLM_MAX_RETRIES", default=2)
+# Concurrent requests per LLM endpoint when twins respond to a post in a batch
+LLM_CONCURRENCY_PER_ENDPOINT = env.int("LLM_CONCURRENCY_PER_ENDPOINT", default=8)
+# Rate limiting of LLM requests, see pds_app/ratelimit.py. LLM_RATE_LIMITS maps
+# base URLs (or "default") to {"rpm": ..., "tpm": ...} budgets, e.g. as JSON
+LLM_RATE_LIMITER = env("LLM_RATE_LIMITER", default=None)
+LLM_RATE_LIMITS = env.json("LLM_RATE_LIMITS", default={})
+# Seconds a request waits for capacity before the task is rescheduled
+LLM_RATE_LIMIT_MAX_WAIT = env.float("LLM_RATE_LIMIT_MAX_WAIT", default=30.0)
+# Attempts at a digital twin response after transient LLM failures, retried
+# with exponential backoff (in seconds) and full jitter
+LLM_RESPONSE_MAX_ATTEMPTS = env.int("LLM_RESPONSE_MAX_ATTEMPTS", default=5)
+LLM_RETRY_BACKOFF = env.int("LLM_RETRY_BACKOFF", default=10)
+LLM_RETRY_BACKOFF_MAX = env.int("LLM_RETRY_BACKOFF_MAX", default=600)
 
 # GENERAL
 # ------------------------------------------------------------------------------
@@ -152,6 +170,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Resolves the experiment of the URL and the user's profile once per request
+    "public_discourse_sandbox.pds_app.middleware.ExperimentContextMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "public_discourse_sandbox.contrib.mfa.middleware.AllUserRequire2FAMiddleware",
@@ -330,6 +350,14 @@ CELERY_BEAT_SCHEDULE = {
         "task": "public_discourse_sandbox.pds_app.tasks.process_email_notifications",
         "schedule": timedelta(seconds=10),  # run every 10 seconds
     },
+    "screen-new-posts": {
+        "task": "public_discourse_sandbox.pds_app.tasks.screen_new_posts",
+        "schedule": timedelta(seconds=10),
+    },
+    "schedule-digital-twin-posts": {
+        "task": "public_discourse_sandbox.pds_app.tasks.schedule_digital_twin_posts",
+        "schedule": timedelta(hours=1),
+    },
 }
 # django-allauth
 # ------------------------------------------------------------------------------
@@ -388,6 +416,41 @@ SPECTACULAR_SETTINGS = {
 }
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Materialized home timelines (see pds_app/timeline.py). Leave unset to build the
+# home feed from the follow graph on every request.
+TIMELINE_STORE = env("TIMELINE_STORE", default=None)
+TIMELINE_MAX_LENGTH = env.int("TIMELINE_MAX_LENGTH", default=800)
+# Trending hashtags (see pds_app/trending.py): the window and bucket size of
+# the counts and how often the top hashtags are recomputed, in seconds. Set
+# TRENDING_STORE to e.g. "public_discourse_sandbox.pds_app.trending.RedisTrendingStore"
+# to keep incremental counters instead of aggregating from the database.
+TRENDING_STORE = env("TRENDING_STORE", default=None)
+TRENDING_WINDOW = env.int("TRENDING_WINDOW", default=60 * 60 * 24)
+TRENDING_BUCKET = env.int("TRENDING_BUCKET", default=60 * 60)
+TRENDING_REFRESH = env.int("TRENDING_REFRESH", default=60)
+# Profanity scores cached per process and in the shared cache (see pds_app/utils.py)
+PROFANITY_CACHE_SIZE = env.int("PROFANITY_CACHE_SIZE", default=10000)
+PROFANITY_CACHE_TIMEOUT = env.int("PROFANITY_CACHE_TIMEOUT", default=60 * 60 * 24)
+# LLM response cache of experiments with the "llm_response_cache" option (see
+# pds_app/response_cache.py). TTL in seconds and size can be set per experiment.
+LLM_RESPONSE_CACHE_STORE = env(
+    "LLM_RESPONSE_CACHE_STORE",
+    default="public_discourse_sandbox.pds_app.response_cache.RedisResponseStore",
+)
+LLM_RESPONSE_CACHE_TTL = env.int("LLM_RESPONSE_CACHE_TTL", default=60 * 60 * 24 * 7)
+LLM_RESPONSE_CACHE_SIZE = env.int("LLM_RESPONSE_CACHE_SIZE", default=10000)
+# Seconds the ids of the active digital twins of an experiment are cached for
+# random twin selection (see pds_app/twin_selection.py). Twin saves and
+# deletes invalidate them, this bounds staleness from bulk updates.
+ACTIVE_TWIN_IDS_CACHE_TIMEOUT = env.int("ACTIVE_TWIN_IDS_CACHE_TIMEOUT", default=300)
+# Twins per generate_digital_twin_posts task dispatched by the
+# schedule_digital_twin_posts periodic task
+TWIN_POST_BATCH_SIZE = env.int("TWIN_POST_BATCH_SIZE", default=10)
+# Experiments kept in each process's cache of experiment lookups by identifier,
+# and seconds their snapshots stay in the shared cache (see
+# pds_app/experiment_cache.py). Experiment saves invalidate them.
+EXPERIMENT_CACHE_SIZE = env.int("EXPERIMENT_CACHE_SIZE", default=256)
+EXPERIMENT_CACHE_TIMEOUT = env.int("EXPERIMENT_CACHE_TIMEOUT", default=3600)
 
 NOTIFICATION_SYSTEM_TARGETS = {
     # Twilio Required settings, if you're not planning on using Twilio these can be set
@@ -7,7 +7,10 @@ from .models import ExperimentInvitation
 from .models import Hashtag
 from .models import Notification
 from .models import Post
+from .models import PostTag
+from .models import ResponseFailure
 from .models import SocialNetwork
+from .models import Tag
 from .models import UserProfile
 from .models import Vote
 
@@ -138,6 +141,23 @@ class DigitalTwinAdmin(admin.ModelAdmin):
     raw_id_fields = ("user_profile",)
 
 
+@admin.register(ResponseFailure)
+class ResponseFailureAdmin(admin.ModelAdmin):
+    list_display = (
+        "digital_twin",
+        "post",
+        "is_transient",
+        "attempts",
+        "created_date",
+    )
+    search_fields = ("error", "digital_twin__user_profile__username")
+    list_filter = ("is_transient", "created_date")
+    readonly_fields = ("created_date", "last_modified")
+    raw_id_fields = ("post", "digital_twin")
+    date_hierarchy = "created_date"
+    ordering = ("-created_date",)
+
+
 @admin.register(Hashtag)
 class HashtagAdmin(admin.ModelAdmin):
     list_display = ("tag", "post", "created_date")
@@ -149,6 +169,24 @@ class HashtagAdmin(admin.ModelAdmin):
     ordering = ("-created_date",)
 
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ("name", "created_date")
+    search_fields = ("name",)
+    readonly_fields = ("created_date", "last_modified")
+    ordering = ("name",)
+
+
+@admin.register(PostTag)
+class PostTagAdmin(admin.ModelAdmin):
+    list_display = ("tag", "post", "created_date")
+    search_fields = ("tag__name", "post__content")
+    readonly_fields = ("created_date", "last_modified")
+    raw_id_fields = ("post", "tag")
+    date_hierarchy = "created_date"
+    ordering = ("-created_date",)
+
+
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ("user_profile", "event", "is_read", "created_date")
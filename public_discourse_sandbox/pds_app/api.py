@@ -1,19 +1,22 @@
 import json
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from public_discourse_sandbox.pds_app.serializers import UserProfileSerializer
 
+from .counters import reconcile_replied_posts
 from .decorators import check_banned
 from .models import Experiment
 from .models import Notification
 from .models import Post
 from .models import UserProfile
 from .models import Vote
+from .search import search_user_profiles
+from .trending import invalidate_trending
+from .trending import uncount_post
 from .utils import send_notification_to_user
 
 
@@ -46,12 +49,10 @@ def create_comment(request, experiment_identifier):
                 parent_post=parent_post,
                 experiment=experiment,
                 depth=parent_post.depth + 1,
-                # is_flagged will be automatically set in the save method via profanity check
+                # is_flagged is set in the save method when the experiment screens
+                # before publishing, otherwise by the screen_new_posts task
             )
 
-            parent_post.num_comments += 1
-            parent_post.save()
-
             if parent_post.user_profile.username != user_profile.username:
                 # Create a notification for the parent post author
                 post_url = f"{request.build_absolute_uri().rsplit("/",2)[0]}/post/{parent_post.id}"
@@ -93,49 +94,27 @@ def create_comment(request, experiment_identifier):
 
 
 @login_required
-def get_post_replies(request, post_id):
+def get_post_replies(request, post_id, experiment_identifier=None):
     """
-    Return a fully nested reply tree for a post, using each reply's `depth`
-    to build the hierarchy. Excludes deleted posts and posts from "Banned" users.
-    If a parent is excluded, its whole subtree is excluded as well.
+    Return a fully nested reply tree for a post, loaded in a single query along
+    the thread's materialized path. Excludes deleted posts and posts from
+    "Banned" users. If a parent is excluded, its whole subtree is excluded as well.
     """
     try:
-        from django.db.models import Q
-
         # Ensure root exists and isn't deleted
-        root = Post.objects.only("id", "is_deleted", "depth").get(id=post_id)
+        root = Post.objects.only("id", "is_deleted", "thread_root", "path").get(
+            id=post_id,
+        )
         if root.is_deleted:
             return JsonResponse({"status": "success", "replies": []})
 
-        # Base filters enforced at *every* level
-        base_filters = Q(is_deleted=False) & Q(parent_post__is_deleted=False)
-
-        # Collect descendants iteratively (BFS) starting from direct children.
-        # We do this to avoid requiring a "thread_root" or tree extension.
-        level = list(
-            Post.objects.filter(base_filters, parent_post_id=root.id)
+        # The whole thread below the root, each reply right after its parent
+        all_replies = (
+            root.get_thread()
             .select_related("user_profile", "user_profile__user")
-            .exclude(user_profile__user__groups__name="Banned"),
+            .exclude(user_profile__user__groups__name="Banned")
         )
 
-        all_replies = level[:]
-
-        while level:
-            parent_ids = [r.id for r in level]
-            level = list(
-                Post.objects.filter(base_filters, parent_post_id__in=parent_ids)
-                .select_related("user_profile", "user_profile__user")
-                .exclude(user_profile__user__groups__name="Banned")
-                .order_by("-created_date"),
-            )
-            all_replies.extend(level)
-
-        if not all_replies:
-            return JsonResponse({"status": "success", "replies": []})
-
-        all_replies.sort(key=lambda r: (getattr(r, "depth", 0), r.created_date))
-        all_replies.sort(key=lambda r: r.created_date, reverse=True)
-
         is_moderator = request.user.groups.filter(name="Moderators").exists()
 
         def serialize(reply):
@@ -157,32 +136,28 @@ def get_post_replies(request, post_id):
                 "replies": [],
             }
 
-        # Build nodes in depth order so parents exist before children
+        # Path order guarantees parents are built before their children, and
+        # that children under each parent are ordered by created_date
         node_by_id = {}
         top_level = []
 
         for r in all_replies:
-            node = serialize(r)
-            node_by_id[r.id] = node
-
             # Attach to parent; if parent is the root post, put in top_level
             if r.parent_post_id == root.id:
-                top_level.append(node)
+                siblings = top_level
             else:
                 parent_node = node_by_id.get(r.parent_post_id)
                 # If the parent was filtered out (deleted/banned), drop this subtree
-                if parent_node is not None:
-                    parent_node["replies"].append(node)
+                if parent_node is None:
+                    continue
+                siblings = parent_node["replies"]
 
-        # Ensure children under each parent are ordered by created_date (already stable,
-        # but enforce explicitly if needed)
-        def sort_children(n):
-            n["replies"].sort(key=lambda ch: ch["created_date"])
-            for ch in n["replies"]:
-                sort_children(ch)
+            node = serialize(r)
+            node_by_id[r.id] = node
+            siblings.append(node)
 
-        for n in top_level:
-            sort_children(n)
+        # Direct replies are shown newest first
+        top_level.reverse()
 
         return JsonResponse({"status": "success", "replies": top_level})
 
@@ -217,8 +192,11 @@ def delete_post(request, post_id):
         if (
             user_profile and user_profile.is_experiment_moderator()
         ) or post.user_profile.user == request.user:
-            post.is_deleted = True
-            post.save()
+            if not post.is_deleted:
+                # The post_save signal uncounts it as a reply or share
+                post.is_deleted = True
+                post.save(update_fields=["is_deleted", "last_modified"])
+                uncount_post(post)
             return JsonResponse(
                 {"status": "success", "message": "Post deleted successfully"},
             )
@@ -272,6 +250,9 @@ def ban_user(request, user_profile_id):
         # Ban the user
         target_profile.is_banned = True
         target_profile.save()
+        # Their replies and reposts no longer count
+        reconcile_replied_posts(target_profile)
+        invalidate_trending(target_profile.experiment_id)
 
         return JsonResponse(
             {"status": "success", "message": "User banned successfully"},
@@ -313,6 +294,8 @@ def unban_user(request, user_profile_id):
         # Unban the user
         target_profile.is_banned = False
         target_profile.save()
+        reconcile_replied_posts(target_profile)
+        invalidate_trending(target_profile.experiment_id)
 
         return JsonResponse(
             {"status": "success", "message": "User unbanned successfully"},
@@ -395,8 +378,7 @@ def handle_like(request, post_id):
         if existing_vote:
             # Unlike: delete the vote and decrement count
             existing_vote.delete()
-            post.num_upvotes -= 1
-            post.save()
+            post.refresh_from_db(fields=["num_upvotes"])
             return JsonResponse(
                 {
                     "status": "success",
@@ -407,8 +389,7 @@ def handle_like(request, post_id):
             )
         # Like: create new vote and increment count
         Vote.objects.create(user_profile=user_profile, post=post, is_upvote=True)
-        post.num_upvotes += 1
-        post.save()
+        post.refresh_from_db(fields=["num_upvotes"])
         # Create a notification for the post author
         if user_profile.username != post.user_profile.username:
             Notification.objects.create(
@@ -519,9 +500,8 @@ def repost(request, post_id):
             repost_source=original_post,
         )
 
-        # Increment the share count on the original post
-        original_post.num_shares += 1
-        original_post.save(update_fields=["num_shares"])
+        # The share count on the original post is incremented by a signal handler
+        original_post.refresh_from_db(fields=["num_shares"])
         # Create a notification for the original post author
         Notification.objects.create(
             user_profile=original_post.user_profile,
@@ -563,17 +543,26 @@ def search_user(request, experiment_identifier):
         )
 
     try:
-        query = request.GET.get("q")
+        query = request.GET.get("q", "")
         experiment = Experiment.objects.get(identifier=experiment_identifier)
 
-        user_profile = UserProfile.objects.filter(
-            Q(display_name__icontains=query) | Q(username__icontains=query),
-            experiment=experiment,
+        # Paginate with one extra row to tell whether there is a next page
+        page_size = min(int(request.GET.get("page_size", 20)), 100)
+        page = max(int(request.GET.get("page", 1)), 1)
+        start = (page - 1) * page_size
+        user_profiles = list(
+            search_user_profiles(experiment, query)[start : start + page_size + 1]
         )
 
-        serializer = UserProfileSerializer(user_profile, many=True)
+        serializer = UserProfileSerializer(user_profiles[:page_size], many=True)
 
-        return JsonResponse({"data": serializer.data})
+        return JsonResponse(
+            {
+                "data": serializer.data,
+                "page": page,
+                "has_next": len(user_profiles) > page_size,
+            },
+        )
     except Experiment.DoesNotExist:
         return JsonResponse({"error": "experiment not found"}, status=404)
     except UserProfile.DoesNotExist:
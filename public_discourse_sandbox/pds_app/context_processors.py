@@ -1,15 +1,13 @@
-from django.core.cache import cache
 from django.db import models
-from django.db.models import Count
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.urls.exceptions import Resolver404
 
 from public_discourse_sandbox.pds_app.models import Experiment
 
+from .middleware import get_request_experiment
+from .middleware import get_request_profile
+from .middleware import get_url_experiment_identifier
 from .models import DigitalTwin
-from .models import Hashtag
 from .models import Notification
+from .trending import get_trending_hashtags
 
 
 def active_bots(request):
@@ -21,35 +19,18 @@ def active_bots(request):
     if not request.user.is_authenticated:
         return {"active_bots": []}
 
-    # Get the current experiment from the URL or session
-    experiment_identifier = None
-    try:
-        if hasattr(request, "resolver_match") and request.resolver_match:
-            experiment_identifier = request.resolver_match.kwargs.get(
-                "experiment_identifier",
-            )
-    except (AttributeError, Resolver404):
-        pass
-
-    if not experiment_identifier:
+    # The experiment of the URL and the user's profile in it, shared with the
+    # view and the other context processors
+    experiment = get_request_experiment(request)
+    if not get_request_profile(request, experiment):
         return {"active_bots": []}
 
-    try:
-        experiment = Experiment.objects.get(identifier=experiment_identifier)
-        user_profile = request.user.userprofile_set.filter(
-            experiment=experiment,
-        ).first()
-        if not user_profile:
-            return {"active_bots": []}
-
-        return {
-            "active_bots": DigitalTwin.objects.filter(
-                is_active=True,
-                user_profile__experiment=experiment,
-            ),
-        }
-    except Experiment.DoesNotExist:
-        return {"active_bots": []}
+    return {
+        "active_bots": DigitalTwin.objects.filter(
+            is_active=True,
+            user_profile__experiment=experiment,
+        ),
+    }
 
 
 def user_experiments(request):
@@ -70,14 +51,7 @@ def user_experiments(request):
     )
 
     # Get the current experiment identifier from the URL
-    current_experiment_identifier = None
-    try:
-        if hasattr(request, "resolver_match") and request.resolver_match:
-            current_experiment_identifier = request.resolver_match.kwargs.get(
-                "experiment_identifier",
-            )
-    except (AttributeError, Resolver404):
-        pass
+    current_experiment_identifier = get_url_experiment_identifier(request)
 
     return {
         "user_experiments": experiments,
@@ -93,122 +67,35 @@ def is_moderator(request):
     if not request.user.is_authenticated:
         return {"is_moderator": False}
 
-    # Get the current experiment from the URL or session
-    experiment_identifier = None
-    try:
-        if hasattr(request, "resolver_match") and request.resolver_match:
-            experiment_identifier = request.resolver_match.kwargs.get(
-                "experiment_identifier",
-            )
-    except (AttributeError, Resolver404):
-        pass
-
-    if not experiment_identifier:
+    user_profile = get_request_profile(request, get_request_experiment(request))
+    if not user_profile:
         return {"is_moderator": False}
 
-    try:
-        experiment = Experiment.objects.get(identifier=experiment_identifier)
-        user_profile = request.user.userprofile_set.filter(
-            experiment=experiment,
-        ).first()
-
-        if not user_profile:
-            return {"is_moderator": False}
-
-        return {"is_moderator": user_profile.is_experiment_moderator()}
-    except Experiment.DoesNotExist:
-        return {"is_moderator": False}
+    return {"is_moderator": user_profile.is_experiment_moderator()}
 
 
 def trending_hashtags(request):
     """
     Context processor that adds trending hashtags to the template context.
     Only adds trending hashtags if the user is authenticated and has a current experiment.
-    Returns the top 5 trending hashtags for the current experiment.
-
-    Caching Mechanism:
-    - Results are cached using Django's cache framework
-    - Cache key format: 'trending_hashtags_{experiment_identifier}'
-    - Cache is invalidated when a new hashtag is saved via the post_save signal
-    - Cache persists until a new hashtag is added to the experiment
-
-    Query Logic:
-    - Filters hashtags by the current experiment
-    - Groups by tag to get unique hashtags
-    - Counts distinct occurrences of each hashtag
-    - Orders by count in descending order
-    - Returns top 5 hashtags with their counts
+    Returns the top 5 hashtags of the current experiment over the trending
+    window, recomputed at most every TRENDING_REFRESH seconds (see trending.py).
     """
     if not request.user.is_authenticated:
         return {"trending_hashtags": []}
 
-    # Get the current experiment from the URL or session
-    experiment_identifier = None
-    try:
-        if hasattr(request, "resolver_match") and request.resolver_match:
-            experiment_identifier = request.resolver_match.kwargs.get(
-                "experiment_identifier",
-            )
-    except (AttributeError, Resolver404):
-        pass
-
-    if not experiment_identifier:
+    experiment = get_request_experiment(request)
+    if not experiment:
         return {"trending_hashtags": []}
 
-    # Create a cache key specific to this experiment
-    cache_key = f"trending_hashtags_{experiment_identifier}"
-
-    # Try to get cached results
-    cached_results = cache.get(cache_key)
-    if cached_results is not None:
-        return {"trending_hashtags": cached_results}
-
     try:
-        experiment = Experiment.objects.get(identifier=experiment_identifier)
-        trending_hashtags = (
-            Hashtag.objects.filter(post__experiment=experiment)
-            .values("tag")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")[:5]
-        )
-
-        # Convert to a list of dictionaries with tag and count
-        trending_hashtags = [
-            {"tag": item["tag"], "count": item["count"]} for item in trending_hashtags
-        ]
-
-        # Cache the results indefinitely (until invalidated by signal)
-        cache.set(cache_key, trending_hashtags)
-
-        return {"trending_hashtags": trending_hashtags}
-    except Experiment.DoesNotExist:
-        return {"trending_hashtags": []}
+        return {"trending_hashtags": get_trending_hashtags(experiment.id)}
     except Exception as e:
         # Log the error and return empty list
         print(f"Error in trending_hashtags context processor: {e!s}")
         return {"trending_hashtags": []}
 
 
-@receiver(post_save, sender=Hashtag)
-def invalidate_trending_hashtags_cache(sender, instance, **kwargs):
-    """
-    Signal handler that invalidates the trending hashtags cache when a new hashtag is saved.
-
-    Cache Invalidation:
-    - Triggered by the post_save signal from the Hashtag model
-    - Gets the experiment from the post associated with the hashtag
-    - Deletes the cache entry for that experiment's trending hashtags
-    - This ensures the cache is always up-to-date with the latest hashtag data
-
-    Note: The cache is only invalidated for the specific experiment where the hashtag was added.
-    """
-    # Get the experiment from the post associated with the hashtag
-    if hasattr(instance, "post") and instance.post:
-        experiment = instance.post.experiment
-        cache_key = f"trending_hashtags_{experiment.identifier}"
-        cache.delete(cache_key)
-
-
 def unread_notifications(request):
     """
     Context processor that adds the count of unread notifications to the template context.
@@ -222,28 +109,11 @@ def unread_notifications(request):
     if not request.user.is_authenticated:
         return {"unread_notifications_count": 0}
 
-    # Get the current experiment from the URL or session
-    experiment_identifier = None
-    try:
-        if hasattr(request, "resolver_match") and request.resolver_match:
-            experiment_identifier = request.resolver_match.kwargs.get(
-                "experiment_identifier",
-            )
-    except (AttributeError, Resolver404):
-        pass
-
-    if not experiment_identifier:
+    user_profile = get_request_profile(request, get_request_experiment(request))
+    if not user_profile:
         return {"unread_notifications_count": 0}
 
     try:
-        experiment = Experiment.objects.get(identifier=experiment_identifier)
-        user_profile = request.user.userprofile_set.filter(
-            experiment=experiment,
-        ).first()
-
-        if not user_profile:
-            return {"unread_notifications_count": 0}
-
         # Count unread notifications for this user profile
         unread_count = Notification.objects.filter(
             user_profile=user_profile,
@@ -251,8 +121,6 @@ def unread_notifications(request):
         ).count()
 
         return {"unread_notifications_count": unread_count}
-    except Experiment.DoesNotExist:
-        return {"unread_notifications_count": 0}
     except Exception as e:
         # Log the error and return 0
         print(f"Error in unread_notifications context processor: {e!s}")
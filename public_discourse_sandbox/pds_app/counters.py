@@ -0,0 +1,163 @@
+"""
+Engagement counters on Post and UserProfile.
+
+Counters are changed with a single UPDATE using F() expressions, so
+concurrent likes, replies and follows can't overwrite each other and the
+row is never re-saved as a whole (which would re-run profanity checking and
+hashtag parsing on posts). They are kept up to date by the signal handlers in
+signals.py; reconcile_post_counters and reconcile_profile_counters recompute
+them from Vote, Post and SocialNetwork in case they drift.
+
+num_comments and num_shares only count visible replies and reposts, those
+that are not deleted and not from banned users, the rows of Post.objects and
+the same rules as Post.get_comment_count. Creating, deleting, soft deleting
+and restoring a post update its parent's counters (see signals.py), and
+banning or unbanning a user recomputes the counters of the posts they replied
+to or reposted with reconcile_replied_posts.
+"""
+
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .models import Post
+from .models import SocialNetwork
+from .models import UserProfile
+from .models import Vote
+
+
+def increment_counter(model, pk, field, delta=1):
+    """
+    Atomically add delta to a counter field of a row.
+    The in-memory instance is not updated, use refresh_from_db(fields=[field])
+    when the new value is needed.
+
+    Args:
+        model: Post or UserProfile
+        pk: Primary key of the row to update
+        field: Name of the counter field, e.g. "num_upvotes"
+        delta: Amount to add, negative to decrement
+    """
+    if pk is None:
+        return
+    model._base_manager.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def is_author_banned(post):
+    """
+    Whether the author of a post is banned, so it never counts as a reply or
+    repost.
+    """
+    return bool(post.user_profile_id and post.user_profile.is_banned)
+
+
+def is_visible(post):
+    """
+    Whether a post counts as a reply or repost of its parent, i.e. it is one
+    of the rows of Post.objects.
+    """
+    return not post.is_deleted and not is_author_banned(post)
+
+
+def count_reply_and_repost(post, delta=1):
+    """
+    Add delta to num_comments of the parent post and num_shares of the
+    source post of a post. Callers check that the post counts, see
+    is_visible().
+
+    Args:
+        post: A reply, repost or quote
+        delta: 1 when the post becomes visible, -1 when it stops being visible
+    """
+    increment_counter(Post, post.parent_post_id, "num_comments", delta)
+    increment_counter(Post, post.repost_source_id, "num_shares", delta)
+
+
+def _count(queryset, field):
+    """
+    Subquery counting the rows of queryset grouped by field, for use in update().
+    """
+    counts = (
+        queryset.order_by().values(field).annotate(count=Count("pk")).values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def reconcile_post_counters(posts):
+    """
+    Recompute num_upvotes, num_downvotes, num_comments and num_shares of posts.
+    Comments and shares only count posts that are visible (not deleted and not
+    from banned users), the same rules as Post.get_comment_count.
+
+    Returns:
+        The number of posts updated
+    """
+    return posts.update(
+        num_upvotes=_count(
+            Vote.objects.filter(post=OuterRef("pk"), is_upvote=True), "post"
+        ),
+        num_downvotes=_count(
+            Vote.objects.filter(post=OuterRef("pk"), is_upvote=False), "post"
+        ),
+        num_comments=_count(
+            Post.objects.filter(parent_post=OuterRef("pk")), "parent_post"
+        ),
+        num_shares=_count(
+            Post.objects.filter(repost_source=OuterRef("pk")), "repost_source"
+        ),
+    )
+
+
+def reconcile_replied_posts(user_profile):
+    """
+    Recompute the counters of the posts a user profile replied to or
+    reposted, after banning or unbanning it changed which of its posts are
+    visible.
+
+    Returns:
+        The number of posts updated
+    """
+    authored = Post.all_objects.filter(user_profile=user_profile)
+    return reconcile_post_counters(
+        Post.all_objects.filter(
+            Q(id__in=authored.values("parent_post"))
+            | Q(id__in=authored.values("repost_source")),
+        ),
+    )
+
+
+def reconcile_profile_counters(profiles):
+    """
+    Recompute num_followers and num_following of user profiles.
+
+    Returns:
+        The number of profiles updated
+    """
+    return profiles.update(
+        num_followers=_count(
+            SocialNetwork.objects.filter(target_node=OuterRef("pk")), "target_node"
+        ),
+        num_following=_count(
+            SocialNetwork.objects.filter(source_node=OuterRef("pk")), "source_node"
+        ),
+    )
+
+
+def reconcile_counters(experiment=None):
+    """
+    Recompute all engagement counters, optionally only within one experiment.
+
+    Returns:
+        A (posts updated, profiles updated) tuple
+    """
+    posts = Post.all_objects.all()
+    profiles = UserProfile.objects.all()
+    if experiment:
+        posts = posts.filter(experiment=experiment)
+        profiles = profiles.filter(experiment=experiment)
+    return reconcile_post_counters(posts), reconcile_profile_counters(profiles)
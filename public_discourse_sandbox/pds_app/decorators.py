@@ -1,7 +1,11 @@
 from django.core.exceptions import PermissionDenied
+from django.http import Http404
 from django.http import JsonResponse
 from functools import wraps
 
+from .middleware import get_request_experiment
+from .middleware import get_request_profile
+
 
 def check_banned(view_func):
     """
@@ -57,14 +61,12 @@ def check_banned(view_func):
                     )
                 raise PermissionDenied("No experiment selected")
         else:
-            from .models import Experiment
-
-            experiment = Experiment.objects.get(identifier=experiment_identifier)
+            experiment = get_request_experiment(request, experiment_identifier)
+            if not experiment:
+                raise Http404("Experiment not found")
 
-        # Get the user's profile for this experiment
-        user_profile = request.user.userprofile_set.filter(
-            experiment=experiment
-        ).first()
+        # Get the user's profile for this experiment, shared with the view
+        user_profile = get_request_profile(request, experiment)
         if not user_profile:
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                 return JsonResponse(
@@ -1,16 +1,30 @@
+import asyncio
+import json
 import logging
 import random
 import time
 import uuid
 from typing import Any
 
-import openai
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
+from public_discourse_sandbox.pds_app.llm import LLMError
+from public_discourse_sandbox.pds_app.llm import PermanentLLMError
+from public_discourse_sandbox.pds_app.llm import build_async_llm_client
+from public_discourse_sandbox.pds_app.llm import classify_llm_error
+from public_discourse_sandbox.pds_app.llm import get_llm_client
+from public_discourse_sandbox.pds_app.memory import WorkingMemory
 from public_discourse_sandbox.pds_app.models import DigitalTwin
 from public_discourse_sandbox.pds_app.models import Post
 from public_discourse_sandbox.pds_app.models import Notification
+from public_discourse_sandbox.pds_app.ratelimit import LLMRateLimit
+from public_discourse_sandbox.pds_app.ratelimit import RateLimitExceeded
+from public_discourse_sandbox.pds_app.ratelimit import estimate_tokens
+from public_discourse_sandbox.pds_app.response_cache import get_response_cache
+from public_discourse_sandbox.pds_app.trending import count_posts
+from public_discourse_sandbox.pds_app.twin_profile import get_twin_profile
 from public_discourse_sandbox.pds_app.utils import send_notification_to_user
 
 """
@@ -19,33 +33,64 @@ DTService Execution Flow:
 
 respond_to_post(twin, post)
 └── generate_comment(twin, content, post)
-    ├── analyze_context(post)
+    ├── analyze_context(post, twin)
     │   ├── create basic context (post_content, post_id, user, timestamp)
-    │   ├── _analyze_sentiment(post.content)
-    │   └── _extract_keywords(post.content)
+    │   └── analyze_post_content(post, content, twin)
+    │       └── _analyze_content(content, twin) (once per post, then cached)
     │
     └── generate_llm_response(post, context, twin)
         ├── template("RESPOND", prompt, twin)
-        │   └── get_twin_config(twin)
+        │   └── twin_profile(twin) (memoized, see twin_profile.py)
         │
         └── execute(template)
             ├── _add_to_working_memory(template)
-            │   ├── _truncate_memory()
             │   └── _ensure_objective()
             │
-            └── OpenAI API Call
+            └── Streamed OpenAI API Call (LLMRateLimit per endpoint),
+                closed once the response exceeds POST_LENGTH_LIMIT
                 └── Create Post Comment
 
+respond_to_post_batch(twins, post)
+├── analyze_context(post, twins[0]) (shared by all twins)
+├── _generate_comments_concurrently(twins, post, context)
+│   └── agenerate_llm_response(post, context, twin, client) per twin
+│       └── aexecute(template, twin, client) (semaphore per llm_url)
+│
+└── Post.bulk_create_posts(comments) + bulk notifications
+
 Working Memory System:
 --------------------
-- Maintains conversation state
-- Max token length: 512
-- Truncates automatically when limit reached
+- Maintains conversation state in a WorkingMemory (see memory.py)
+- Max token length: 512, not counting the pinned persona
+- Drops the oldest segments automatically when the limit is reached
+- Kept per twin across tasks with the "persist_twin_memory" experiment option
 """
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Sentiment and keywords of a post are computed once and shared by all twins
+ANALYSIS_CACHE_PREFIX = "pds:post-analysis:"
+ANALYSIS_CACHE_TIMEOUT = 60 * 60 * 24
+ANALYSIS_LOCK_SECONDS = 30
+# How long twins wait for another twin's analysis, and how often they check
+ANALYSIS_WAIT_SECONDS = 5
+ANALYSIS_POLL_SECONDS = 0.1
+NEUTRAL_ANALYSIS = {"sentiment": "neutral", "keywords": []}
+
+# Twitter-like character limit of posts
+POST_LENGTH_LIMIT = 280
+
+
+def response_max_tokens(experiment, max_chars=POST_LENGTH_LIMIT) -> int:
+    """
+    Returns the max_tokens of a completion meant to be at most max_chars long:
+    the experiment's "max_response_tokens" option if set, otherwise about two
+    characters per token, so the response is cut by the streaming character
+    limit rather than mid-sentence by the token limit.
+    """
+    return experiment.get_option("max_response_tokens") or max_chars // 2 + 16
+
 
 class DTService:
     """
@@ -55,161 +100,452 @@ class DTService:
 
     def __init__(self):
         logger.info("DTListener initialized")
-        self.working_memory = ""
-        self.token_counter = 0
         self.max_token_length = 512  # Default value, adjust as needed
+        self.memory = WorkingMemory(max_tokens=self.max_token_length)
         self.current_twin = None  # Add this line to store current twin
+        # Twins whose responses were deferred by rate limiting in the last batch
+        self.deferred_twins = []
+        self.retry_after = 0
+        # (twin, LLMError) pairs of the responses that failed in the last batch
+        self.failures = []
+        # Response cache of the experiment, if enabled (see response_cache.py)
+        self.response_cache = None
+        # Compiled twin profiles by twin id, see twin_profile()
+        self.profiles = {}
+        # max_tokens of the completions, see response_max_tokens()
+        self.max_tokens = None
+        # Recent top-level posts by experiment id, see recent_posts()
+        self.recent_activity = {}
 
     def _add_to_working_memory(self, input_data: str) -> None:
         """
         Maintains a rolling memory of conversation context for the LLM.
-        Part of the memory management system that ensures context stays within token limits.
+        The memory drops its oldest segments once it exceeds max_token_length.
 
         Flow: Called by execute() before each LLM interaction
         """
-        self.working_memory += f" {input_data}"
-        self.token_counter += len(input_data.split())
-
-        self._truncate_memory()
         self._ensure_objective()
-
-    def _truncate_memory(self):
-        """
-        Ensures working memory stays within token limits by removing oldest tokens when exceeded.
-        Keeps the most recent max_token_length tokens.
-
-        Flow: Called by _add_to_working_memory() when new content is added
-        """
-        if self.token_counter > self.max_token_length:
-            tokens = self.working_memory.split()[-self.max_token_length :]
-            self.working_memory, self.token_counter = (
-                " ".join(tokens),
-                self.max_token_length,
-            )
+        self.memory.append(input_data)
 
     def _ensure_objective(self):
         """
-        Ensures the digital twin's objective/persona is present in the working memory context.
-        Prepends the twin's objective to working memory if it's not already present,
-        ensuring the LLM maintains consistent character voice throughout the conversation.
-        Updates token counter when objective is added.
+        Ensures the digital twin's objective/persona is pinned at the start of
+        the working memory, ensuring the LLM maintains consistent character
+        voice throughout the conversation. The persona is kept apart from the
+        rolling segments, so it is never truncated.
 
         Flow: Called by _add_to_working_memory() as part of memory management system
 
-        Memory Structure:
-            - If objective not present: "{objective} {existing_memory}"
-            - If objective present: leaves memory unchanged
-
         Note: Requires self.current_twin to be set. Silently returns if no twin is set,
         as this can happen during initialization or between responses.
         """
         if not self.current_twin:
             return  # Skip if no twin is set
 
-        objective = self.get_twin_config(self.current_twin)["AgentCode"]["objective"]
-        if objective not in self.working_memory:
-            self.working_memory = f"{objective} {self.working_memory}"
-            self.token_counter += len(objective.split())
+        self.memory.pin(self.twin_profile(self.current_twin).objective)
+
+    def load_memory(self, twin: DigitalTwin, experiment) -> None:
+        """
+        Starts from the twin's persisted working memory if the experiment has
+        the "persist_twin_memory" option, otherwise from an empty memory.
+        Uses the memory field loaded with the twin, without a query.
+        """
+        data = twin.memory if experiment.get_option("persist_twin_memory") else None
+        self.memory = WorkingMemory.from_dict(data, max_tokens=self.max_token_length)
+
+    def dump_memory(self, twin: DigitalTwin, experiment) -> bool:
+        """
+        Copies the working memory to twin.memory if the experiment has the
+        "persist_twin_memory" option. The caller saves the twin.
+
+        Returns:
+            Whether twin.memory was updated
+        """
+        if not experiment.get_option("persist_twin_memory"):
+            return False
+        twin.memory = self.memory.to_dict()
+        return True
 
     def execute(self, template: str, twin: DigitalTwin) -> Any:
         """
         Core LLM interaction method. Sends prompts to OpenAI and manages the conversation memory.
         Acts as the central point for all AI model interactions.
+        Raises TransientLLMError or PermanentLLMError if the API call fails.
 
         Flow: Called by generate_llm_response() to get AI responses
         """
-        start_time = time.time()
         self._add_to_working_memory(template)
 
         # Use OpenAI directly instead of self.llm.prompt
         try:
-            if twin.api_token:
-                api_key = twin.api_token
-            else:
-                api_key = settings.OPENAI_API_KEY
-
-            if twin.llm_url:
-                base_url = twin.llm_url
-            else:
-                base_url = settings.OPENAI_BASE_URL
-
-            if twin.llm_model:
-                llm_model = twin.llm_model
-            else:
-                llm_model = settings.LLM_MODEL
-
-            client = openai.OpenAI(
-                base_url=base_url,
-                api_key=api_key,
-            )
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": self.working_memory},
-                ],
-            )
-            output = response.choices[0].message.content
+            base_url, api_key, llm_model = self.twin_profile(twin).llm_config()
+            messages = self._working_memory_messages()
+            if self.response_cache:
+                output = self.response_cache.get(llm_model, base_url, messages)
+                if output:
+                    return output
+            client = get_llm_client(base_url, api_key)
+            tokens = estimate_tokens(messages, self.max_tokens)
+            with LLMRateLimit(base_url, api_key, tokens):
+                stream = client.chat.completions.create(
+                    model=llm_model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    stream=True,
+                )
+                output = self.read_stream(stream)
+            if self.response_cache:
+                self.response_cache.set(llm_model, base_url, messages, output)
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error in OpenAI API call: {e!s}")
-            output = "Error generating response"
-
-        elapsed_time = time.time() - start_time
+            raise classify_llm_error(e) from e
 
         return output
 
-    def _analyze_sentiment(self, text: str) -> str:
+    @staticmethod
+    def _cut_off(parts: list[str], max_chars: int) -> bool:
+        """
+        Whether the streamed parts are already longer than max_chars once cleaned.
         """
-        Uses OpenAI to determine the emotional tone of text.
-        Returns one of: positive, negative, or neutral.
+        return len("".join(parts).strip().strip('"').strip()) > max_chars
 
-        Flow: Called by analyze_context() as part of post analysis
+    def read_stream(self, stream, max_chars: int = POST_LENGTH_LIMIT) -> str:
         """
-        print(f"Analyzing sentiment for text: {text}")
+        Reads a streamed completion until it ends or its cleaned text exceeds
+        max_chars. The stream is closed then, which cancels the request, so
+        the rest of an overlong response is neither waited for nor generated.
+        """
+        parts = []
         try:
-            client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Analyze the sentiment of this text. Respond with just one word: positive, negative, or neutral.",
-                    },
-                    {"role": "user", "content": text},
-                ],
-            )
-            return response.choices[0].message.content.strip().lower()
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if self._cut_off(parts, max_chars):
+                        break
+        finally:
+            stream.close()
+        return "".join(parts)
+
+    async def aread_stream(self, stream, max_chars: int = POST_LENGTH_LIMIT) -> str:
+        """
+        Async counterpart of read_stream().
+        """
+        parts = []
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if self._cut_off(parts, max_chars):
+                        break
+        finally:
+            await stream.close()
+        return "".join(parts)
+
+    def _working_memory_messages(self) -> list[dict]:
+        """
+        Chat messages sending the working memory to the LLM.
+        """
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": self.memory.text()},
+        ]
+
+    async def aexecute(self, template: str, twin: DigitalTwin, client) -> Any:
+        """
+        Async counterpart of execute() using an openai.AsyncOpenAI client.
+
+        Flow: Called by agenerate_llm_response() for batched twin responses
+        """
+        self._add_to_working_memory(template)
+        base_url, api_key, llm_model = self.twin_profile(twin).llm_config()
+        messages = self._working_memory_messages()
+        if self.response_cache:
+            output = self.response_cache.get(llm_model, base_url, messages)
+            if output:
+                return output
+        try:
+            tokens = estimate_tokens(messages, self.max_tokens)
+            async with LLMRateLimit(base_url, api_key, tokens):
+                stream = await client.chat.completions.create(
+                    model=llm_model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    stream=True,
+                )
+                output = await self.aread_stream(stream)
+        except RateLimitExceeded:
+            raise
         except Exception as e:
-            print(f"Error analyzing sentiment: {e!s}")
-            return "neutral"
+            raise classify_llm_error(e) from e
+        if self.response_cache:
+            self.response_cache.set(llm_model, base_url, messages, output)
+        return output
 
-    def _extract_keywords(self, text: str) -> list[str]:
+    async def agenerate_llm_response(
+        self, post: Post, context: dict, twin: DigitalTwin, client
+    ) -> str:
         """
-        Uses OpenAI to identify 3-5 main topics/themes from the text.
-        Returns a list of key terms that represent the content.
+        Async counterpart of generate_llm_response(), with the same retries
+        of empty responses. The twin must have its user_profile loaded, the
+        database is not accessed from the event loop.
 
-        Flow: Called by analyze_context() after sentiment analysis
+        Flow: Called by respond_to_post_batch() for every twin concurrently
         """
-        print(f"Extracting keywords for text: {text}")
+        self.current_twin = twin
+        self.load_memory(twin, post.experiment)
+        self.max_tokens = response_max_tokens(post.experiment)
         try:
-            client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Extract 3-5 main keywords from this text. Respond with just the keywords separated by commas.",
-                    },
-                    {"role": "user", "content": text},
-                ],
+            prompt = self.build_response_prompt(post, context, twin)
+            template = self.template("RESPOND", prompt, twin)
+            for attempt in range(3):  # Try up to 3 times
+                response = await self.aexecute(template, twin, client)
+                if response:
+                    response = self.clean_response(response)
+                    self.memory.append(response)
+                    return response
+                logger.warning(
+                    f"Empty response on attempt {attempt + 1} for "
+                    f"{twin.user_profile.username}"
+                )
+            raise PermanentLLMError("LLM returned an empty response")
+        finally:
+            self.current_twin = None
+
+    async def _generate_comments_concurrently(
+        self, twins: list[DigitalTwin], post: Post, context: dict
+    ) -> list[str]:
+        """
+        Generates the responses of all twins concurrently, with at most
+        LLM_CONCURRENCY_PER_ENDPOINT requests in flight per llm_url.
+        Each twin gets its own working memory.
+
+        Returns:
+            The responses in the order of twins, or the LLMError or
+            RateLimitExceeded error where generation failed
+        """
+        limit = getattr(settings, "LLM_CONCURRENCY_PER_ENDPOINT", 8)
+        clients = {}
+        semaphores = {}
+
+        async def respond(twin):
+            base_url, api_key, _ = self.twin_profile(twin).llm_config()
+            if (base_url, api_key) not in clients:
+                clients[(base_url, api_key)] = build_async_llm_client(base_url, api_key)
+            semaphore = semaphores.setdefault(base_url, asyncio.Semaphore(limit))
+            dt_service = DTService()
+            dt_service.response_cache = self.response_cache
+            dt_service.profiles = self.profiles
+            async with semaphore:
+                try:
+                    response = await dt_service.agenerate_llm_response(
+                        post, context, twin, clients[(base_url, api_key)]
+                    )
+                except (LLMError, RateLimitExceeded) as e:
+                    return e
+            dt_service.dump_memory(twin, post.experiment)
+            return response
+
+        try:
+            return await asyncio.gather(*(respond(twin) for twin in twins))
+        finally:
+            for client in clients.values():
+                await client.close()
+
+    def respond_to_post_batch(self, twins: list[DigitalTwin], post: Post) -> list:
+        """
+        Entry point for batched digital twin responses to a post.
+        Analyzes the post once, generates all responses concurrently and
+        inserts the comments and notifications in bulk. Twins whose endpoint
+        stayed rate limited are left in self.deferred_twins, with the seconds
+        to wait before retrying them in self.retry_after. Failed responses are
+        left in self.failures for the caller to retry or record, no post is
+        created for them.
+
+        Args:
+            twins (List[DigitalTwin]): Twins that will respond, with user_profile loaded
+            post (Post): The post to respond to
+
+        Returns:
+            List[Post]: The created comments
+        """
+        self.deferred_twins = []
+        self.retry_after = 0
+        self.failures = []
+        if not twins:
+            return []
+
+        context = self.analyze_context(post, twins[0])
+        self.response_cache = get_response_cache(post.experiment)
+        for twin in twins:
+            self.twin_profile(twin)
+        contents = asyncio.run(
+            self._generate_comments_concurrently(twins, post, context)
+        )
+
+        comments = []
+        replied_twins = []
+        for twin, content in zip(twins, contents):
+            if isinstance(content, RateLimitExceeded):
+                self.deferred_twins.append(twin)
+                self.retry_after = max(self.retry_after, content.retry_after)
+                continue
+            if isinstance(content, LLMError):
+                logger.error(
+                    f"Failed to generate comment content for digital twin "
+                    f"{twin.user_profile.username}: {content!s}"
+                )
+                self.failures.append((twin, content))
+                continue
+            replied_twins.append(twin)
+            comments.append(
+                Post(
+                    user_profile=twin.user_profile,
+                    parent_post=post,
+                    content=content,
+                    experiment=post.experiment,
+                    depth=post.depth + 1,
+                ),
+            )
+
+        comments = Post.bulk_create_posts(comments)
+        count_posts(comments)
+        if post.experiment.get_option("persist_twin_memory"):
+            DigitalTwin.objects.bulk_update(replied_twins, ["memory"])
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    user_profile=post.user_profile,
+                    event="post_replied",
+                    content=f"@{comment.user_profile.username} replied to your post",
+                )
+                for comment in comments
+            ],
+        )
+        logger.info(f"Created {len(comments)} digital twin comments on post {post.id}")
+        return comments
+
+    def _analyze_content(self, text: str, twin: DigitalTwin = None) -> dict:
+        """
+        Uses the LLM to determine the emotional tone and 3-5 main keywords of
+        text in a single call. Uses the twin's LLM endpoint and model if given.
+        Returns a dict with "sentiment" (positive, negative or neutral) and
+        "keywords" (list of key terms), or None if the call failed or its
+        response couldn't be parsed.
+
+        Flow: Called by analyze_post_content() when the analysis isn't cached
+        """
+        if twin:
+            base_url, api_key, llm_model = self.twin_profile(twin).llm_config()
+        else:
+            base_url, api_key, llm_model = (
+                settings.OPENAI_BASE_URL,
+                settings.OPENAI_API_KEY,
+                settings.LLM_MODEL,
             )
-            keywords = response.choices[0].message.content.strip().split(",")
-            return [k.strip() for k in keywords if k.strip()]
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "Analyze the sentiment of this text and extract 3-5 main "
+                    "keywords from it. Respond with just a JSON object like "
+                    '{"sentiment": "positive", "keywords": ["a", "b", "c"]}, '
+                    "where sentiment is one of positive, negative, or neutral."
+                ),
+            },
+            {"role": "user", "content": text},
+        ]
+        try:
+            client = get_llm_client(base_url, api_key)
+            with LLMRateLimit(base_url, api_key, estimate_tokens(messages)):
+                response = client.chat.completions.create(
+                    model=llm_model,
+                    messages=messages,
+                )
+            return self._parse_analysis(response.choices[0].message.content)
         except Exception as e:
-            print(f"Error extracting keywords: {e!s}")
-            return []
+            logger.error(f"Error analyzing content: {e!s}")
+            return None
 
-    def analyze_context(self, post: Post) -> dict:
+    @staticmethod
+    def _parse_analysis(output: str) -> dict:
+        """
+        Parses the JSON object returned by the content analysis call,
+        tolerating text or code fences around it. Returns None if there is no
+        JSON object.
+        """
+        analysis = dict(NEUTRAL_ANALYSIS)
+        try:
+            data = json.loads(output[output.index("{") : output.rindex("}") + 1])
+        except (ValueError, TypeError, AttributeError):
+            logger.warning(f"Could not parse content analysis: {output!r}")
+            return None
+        if not isinstance(data, dict):
+            logger.warning(f"Could not parse content analysis: {output!r}")
+            return None
+
+        sentiment = str(data.get("sentiment", "")).strip().lower()
+        if sentiment in ("positive", "negative", "neutral"):
+            analysis["sentiment"] = sentiment
+        keywords = data.get("keywords") or []
+        if isinstance(keywords, str):
+            keywords = keywords.split(",")
+        analysis["keywords"] = [str(k).strip() for k in keywords if str(k).strip()]
+        return analysis
+
+    @staticmethod
+    def _wait_for_analysis(key: str, lock_key: str) -> dict:
+        """
+        Polls the cache for the analysis another twin is computing. Returns
+        neutral defaults once it failed, i.e. the lock is gone without a
+        result, or after ANALYSIS_WAIT_SECONDS.
+        """
+        deadline = time.monotonic() + ANALYSIS_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(ANALYSIS_POLL_SECONDS)
+            analysis = cache.get(key)
+            if analysis is not None:
+                return analysis
+            if cache.get(lock_key) is None:
+                break
+        logger.info(f"No shared analysis available under {key}, using defaults")
+        return dict(NEUTRAL_ANALYSIS)
+
+    def analyze_post_content(
+        self, post: Post, text: str, twin: DigitalTwin = None
+    ) -> dict:
+        """
+        Returns the sentiment and keywords of a post, computing them only once
+        per post. Twins responding to the same post share the cached analysis:
+        the first one takes a lock and computes it, the others poll the cache
+        for up to ANALYSIS_WAIT_SECONDS and use neutral defaults if it doesn't
+        show up, so a post gets at most one analysis call at a time.
+
+        Only successful analyses are cached: if the call fails, e.g. on a rate
+        limit or an outage, neutral defaults are used for this reply and the
+        next twin tries again.
+
+        Flow: Called by analyze_context()
+        """
+        key = f"{ANALYSIS_CACHE_PREFIX}{post.id}"
+        analysis = cache.get(key)
+        if analysis is not None:
+            return analysis
+
+        lock_key = f"{key}:lock"
+        if not cache.add(lock_key, True, ANALYSIS_LOCK_SECONDS):
+            return self._wait_for_analysis(key, lock_key)
+        try:
+            analysis = self._analyze_content(text, twin)
+        finally:
+            cache.delete(lock_key)
+        if analysis is None:
+            return dict(NEUTRAL_ANALYSIS)
+        cache.set(key, analysis, ANALYSIS_CACHE_TIMEOUT)
+        return analysis
+
+    def analyze_context(self, post: Post, twin: DigitalTwin = None) -> dict:
         """
         Creates a comprehensive context dictionary for a post.
         Combines basic post metadata with AI-derived insights (sentiment and keywords).
@@ -233,54 +569,43 @@ class DTService:
                 if post.created_date
                 else None,
             }
-            print(f"Basic context created: {context}")
+            logger.debug(f"Basic context created: {context}")
 
             # Try to add sentiment and keywords if API is working
             try:
-                context["sentiment"] = self._analyze_sentiment(post_content)
-                context["keywords"] = self._extract_keywords(post_content)
+                context.update(self.analyze_post_content(post, post_content, twin))
             except Exception as api_error:
-                print(f"API-related error in context analysis: {api_error!s}")
+                logger.warning(f"API-related error in context analysis: {api_error!s}")
                 context["sentiment"] = "neutral"
                 context["keywords"] = []
 
-            print(f"Context analysis complete: {context}")
+            logger.debug(f"Context analysis complete: {context}")
             return context
         except Exception as e:
-            print(f"Error analyzing context: {e!s}")
+            logger.exception(f"Error analyzing context: {e!s}")
             return {
                 "post_content": post_content,
                 "error": str(e),
             }
 
+    def twin_profile(self, twin: DigitalTwin):
+        """
+        Returns the compiled profile of a twin, looked up once per service
+        instance. Profiles of twins used from the event loop must be loaded
+        beforehand, see respond_to_post_batch().
+
+        Flow: Called by template() and _ensure_objective()
+        """
+        if twin.id not in self.profiles:
+            self.profiles[twin.id] = get_twin_profile(twin)
+        return self.profiles[twin.id]
+
     def get_twin_config(self, twin: DigitalTwin) -> dict:
         """
         Builds configuration dictionary for a digital twin's behavior.
         Defines the twin's identity, objectives, and control flow for responses.
-
-        Flow: Called by template() to get twin-specific response parameters
         """
-        return {
-            "AgentCode": {
-                "name": twin.user_profile.username,
-                "objective": f"You are {twin.user_profile.username}. {twin.persona}",
-                "control_flow": {
-                    "BEGIN": "ANALYZE",
-                    "ANALYZE": "RESPOND",
-                    "RESPOND": "END",
-                },
-                "ANALYZE": "Analyze this post: {0}",
-                "RESPOND": "{0}",
-            },
-            "LLM": {
-                "prompt_model": "openai/gpt-3.5-turbo",
-                "action_model": "openai/gpt-3.5-turbo",
-                "api_key": settings.OPENAI_API_KEY,
-                "functions": [],
-                "system_message": twin.persona,
-                "max_retries": 3,
-            },
-        }
+        return self.twin_profile(twin).config()
 
     def template(self, phase: str, input_data: Any, twin: DigitalTwin) -> Any:
         """
@@ -289,28 +614,17 @@ class DTService:
 
         Flow: Called by generate_llm_response() to format prompts for the LLM
         """
-        # print(f"Template for {phase} with input: {input_data}")
-        if phase not in self.get_twin_config(twin)["AgentCode"]:
-            raise ValueError(f"Undefined phase: {phase}")
-        return self.get_twin_config(twin)["AgentCode"][phase].format(input_data)
+        return self.twin_profile(twin).template(phase, input_data)
 
-    def generate_llm_response(
-        self, post: Post, context: dict = None, twin: DigitalTwin = None
+    def build_response_prompt(
+        self, post: Post, context: dict, twin: DigitalTwin
     ) -> str:
         """
-        Creates contextually appropriate responses using the LLM.
-        Handles retry logic for API failures and ensures responses stay within length limits.
-        Uses twin's persona to maintain consistent character voice.
+        Builds the prompt asking a twin to respond to a post in its persona.
 
-        Flow: Called by generate_comment() after context analysis
+        Flow: Called by generate_llm_response() and agenerate_llm_response()
         """
-        print(f"Generating response for post: {post.id}")
-        try:
-            self.current_twin = twin  # Set the current twin
-            if not context:
-                context = self.analyze_context(post)
-
-            prompt = f"""As {twin.user_profile.username} with the following persona: {twin.persona}
+        return f"""As {twin.user_profile.username} with the following persona: {twin.persona}
 
             You are responding to this post:
             "{post.content}"
@@ -324,29 +638,58 @@ class DTService:
             Keep the response concise (1-2 sentences) and engaging.
             """
 
-            print(f"Sending prompt to LLM for {twin.user_profile.username}")
-            for attempt in range(3):  # Try up to 3 times
-                try:
-                    template = self.template("RESPOND", prompt, twin)
-                    response = self.execute(template, twin)
-                    if response:
-                        print(
-                            f"Generated response on attempt {attempt + 1}: {response}"
-                        )
-                        # Clean up the response
-                        response = response.strip().strip('"').strip()
-                        if len(response) > 280:  # Twitter-like character limit
-                            response = response[:277] + "..."
-                        return response
-                except Exception as api_error:
-                    print(f"API error on attempt {attempt + 1}: {api_error!s}")
-                    if attempt == 2:  # Last attempt
-                        raise
-            return None
+    @staticmethod
+    def clean_response(response: str) -> str:
+        """
+        Strips quotes and whitespace from an LLM response and enforces the
+        Twitter-like character limit.
+        """
+        response = response.strip().strip('"').strip()
+        if len(response) > POST_LENGTH_LIMIT:
+            response = response[: POST_LENGTH_LIMIT - 3] + "..."
+        return response
+
+    def generate_llm_response(
+        self, post: Post, context: dict = None, twin: DigitalTwin = None
+    ) -> str:
+        """
+        Creates contextually appropriate responses using the LLM.
+        Retries empty responses and ensures responses stay within length limits.
+        API failures are raised as LLMError, so the calling task can retry
+        transient ones with backoff.
+        Uses twin's persona to maintain consistent character voice.
 
+        Flow: Called by generate_comment() after context analysis
+        """
+        logger.info(f"Generating response for post: {post.id}")
+        try:
+            self.current_twin = twin  # Set the current twin
+            self.response_cache = get_response_cache(post.experiment)
+            self.load_memory(twin, post.experiment)
+            self.max_tokens = response_max_tokens(post.experiment)
+            if not context:
+                context = self.analyze_context(post, twin)
+
+            prompt = self.build_response_prompt(post, context, twin)
+
+            logger.debug(f"Sending prompt to LLM for {twin.user_profile.username}")
+            template = self.template("RESPOND", prompt, twin)
+            for attempt in range(3):  # Try up to 3 times
+                response = self.execute(template, twin)
+                if response:
+                    logger.debug(
+                        f"Generated response on attempt {attempt + 1}: {response}"
+                    )
+                    response = self.clean_response(response)
+                    self.memory.append(response)
+                    return response
+            raise PermanentLLMError("LLM returned an empty response")
+
+        except (LLMError, RateLimitExceeded):
+            raise
         except Exception as e:
-            print(f"Error generating response: {e!s}")
-            return None
+            logger.exception(f"Error generating response: {e!s}")
+            raise PermanentLLMError(f"Error generating response: {e!s}") from e
         finally:
             self.current_twin = None  # Clear the current twin when done
 
@@ -358,10 +701,10 @@ class DTService:
 
         Flow: Called by respond_to_post() to create twin's response
         """
-        context = self.analyze_context(post)
-        print("Generating response...")
+        context = self.analyze_context(post, twin)
+        logger.debug("Generating response...")
         response = self.generate_llm_response(post, context, twin)
-        print(f"Generated response: {response}")
+        logger.debug(f"Generated response: {response}")
 
         return response
 
@@ -369,7 +712,8 @@ class DTService:
         """
         Entry point for digital twin interactions.
         Manages the full flow from content analysis to response creation.
-        Creates and stores the final comment in the database.
+        Creates and stores the final comment in the database. If the response
+        can't be generated, LLMError is raised and no comment is created.
 
         Args:
             twin (DigitalTwin): The digital twin that will respond
@@ -386,7 +730,6 @@ class DTService:
                     logger.error(f"Post with id {post} not found")
                     return []
 
-            print(f"Responding to content: {post.content[:100]}")
             logger.info(f"""
             Attempting to respond to content:
             Content: {post.content[:100]}
@@ -404,12 +747,7 @@ class DTService:
                 post=post,
             )
 
-            if not comment_content:
-                logger.error(
-                    f"Failed to generate comment content for digital twin {twin.user_profile.username}"
-                )
-
-            # Create the comment
+            # Create the comment (hashtags are parsed once the post is saved)
             comment = Post.objects.create(
                 user_profile=twin.user_profile,
                 parent_post=post,
@@ -418,8 +756,8 @@ class DTService:
                 depth=post.depth + 1,
             )
 
-            # Save the comment again to perform hashtag parsing after the post ID exists
-            comment.save()
+            if self.dump_memory(twin, post.experiment):
+                DigitalTwin.objects.filter(pk=twin.pk).update(memory=twin.memory)
 
             Notification.objects.create(
                 user_profile=post.user_profile,
@@ -431,19 +769,48 @@ class DTService:
 
             return responses
 
+        except (LLMError, RateLimitExceeded) as e:
+            logger.error(
+                f"Failed to generate comment content for digital twin "
+                f"{twin.user_profile.username}: {e!s}"
+            )
+            raise
         except Exception as e:
             logger.error(
                 f"Error in twin {twin.user_profile.username} response: {e!s}",
                 exc_info=True,
             )
 
+    def recent_posts(self, experiment_id) -> list[Post]:
+        """
+        Returns the last 20 top-level posts of the past 24 hours of an
+        experiment, newest first, with their authors. The window is loaded
+        once per experiment and shared by should_twin_post() and
+        get_recent_post_context(), also across twins.
+
+        Args:
+            experiment_id: UUID of the experiment
+        """
+        if experiment_id not in self.recent_activity:
+            self.recent_activity[experiment_id] = list(
+                Post.objects.filter(
+                    experiment_id=experiment_id,
+                    parent_post=None,  # Only top-level posts
+                    created_date__gte=timezone.now() - timezone.timedelta(hours=24),
+                )
+                .select_related("user_profile")
+                .order_by("-created_date")[:20]
+            )
+        return self.recent_activity[experiment_id]
+
     def should_twin_post(self, twin: DigitalTwin) -> bool:
         """
         Determines if a digital twin should post based on activity patterns.
         Uses probabilistic approach based on recent post history and time since last post.
 
         Args:
-            twin (DigitalTwin): The digital twin to check
+            twin (DigitalTwin): The digital twin to check; only its last_post and
+                user profile are used
 
         Returns:
             bool: True if the twin should post, False otherwise
@@ -461,11 +828,7 @@ class DTService:
                 skip_probability += 0.3  # Lower chance if posted in last 8 hours
 
         # Factor 2: Recent post ratio
-        recent_posts = Post.objects.filter(
-            experiment=twin.user_profile.experiment,
-            parent_post=None,  # Only top-level posts
-            created_date__gte=timezone.now() - timezone.timedelta(hours=24),
-        ).order_by("-created_date")[:20]
+        recent_posts = self.recent_posts(twin.user_profile.experiment_id)
 
         if recent_posts:
             twin_post_count = sum(
@@ -499,11 +862,7 @@ class DTService:
         Returns:
             List[Dict]: List of post context dictionaries
         """
-        recent_posts = Post.objects.filter(
-            experiment=twin.user_profile.experiment,
-            parent_post=None,  # Only top-level posts
-            created_date__gte=timezone.now() - timezone.timedelta(hours=24),
-        ).order_by("-created_date")[:20]
+        recent_posts = self.recent_posts(twin.user_profile.experiment_id)
 
         post_contexts = []
         for post in recent_posts[:max_posts]:
@@ -519,11 +878,16 @@ class DTService:
 
         return post_contexts
 
-    def determine_post_length(self) -> dict:
+    def determine_post_length(self, seed=None) -> dict:
         """
         Randomly determines post length based on a probability distribution.
         Uses weighted random selection to vary post lengths naturally.
 
+        Args:
+            seed: Optional seed making the choice repeatable, so the prompt and
+                thereby its cached response are the same when an experiment
+                is replayed
+
         Returns:
             Dict: Selected length category with range and name
         """
@@ -536,14 +900,15 @@ class DTService:
         ]
 
         # Randomly select length category based on probability distribution
-        rand_val = random.random()
+        rng = random.Random(seed) if seed is not None else random
+        rand_val = rng.random()
         cumulative_prob = 0
 
         for length_cat in length_distribution:
             cumulative_prob += length_cat["probability"]
             if rand_val <= cumulative_prob:
                 min_chars, max_chars = length_cat["range"]
-                target_length = random.randint(min_chars, max_chars)
+                target_length = rng.randint(min_chars, max_chars)
 
                 # Add target_length to the returned dictionary
                 result = length_cat.copy()
@@ -581,8 +946,12 @@ class DTService:
                 for i, post in enumerate(post_contexts, 1):
                     context_text += f'{i}. @{post['author']}: "{post['content']}"\n'
 
-            # Get length parameters
-            length_params = self.determine_post_length()
+            # Get length parameters, seeded by the twin and its number of posts
+            # so the nth post of a twin gets the same prompt in every replay
+            num_posts = Post.all_objects.filter(
+                user_profile_id=twin.user_profile_id,
+            ).count()
+            length_params = self.determine_post_length(f"{twin.id}:{num_posts}")
             min_chars, max_chars = length_params["range"]
             target_length = length_params["target_length"]
 
@@ -607,45 +976,40 @@ Instructions:
 Output only the text of the post, with no additional commentary or explanation.
 """
 
-            # Use the OpenAI client with the twin's configured API details
-            if twin.api_token:
-                api_key = twin.api_token
-            else:
-                api_key = settings.OPENAI_API_KEY
-
-            if twin.llm_url:
-                base_url = twin.llm_url
-            else:
-                base_url = settings.OPENAI_BASE_URL
-
-            if twin.llm_model:
-                llm_model = twin.llm_model
-            else:
-                llm_model = settings.LLM_MODEL
-
-            client = openai.OpenAI(
-                base_url=base_url,
-                api_key=api_key,
-            )
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a digital twin participating in social media discussions. Your goal is to create authentic, natural posts that reflect your assigned persona and engage meaningfully with the community.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            )
-
-            # Extract and clean the content
-            content = response.choices[0].message.content.strip().strip('"').strip()
+            # Use the shared OpenAI client for the twin's configured API details
+            base_url, api_key, llm_model = self.twin_profile(twin).llm_config()
+            client = get_llm_client(base_url, api_key)
 
-            # If content exceeds maximum allowed length, trim it
-            if len(content) > 280:
-                content = content[:277] + "..."
+            messages = [
+                {
+                    "role": "system",
+                    "content": "You are a digital twin participating in social media discussions. Your goal is to create authentic, natural posts that reflect your assigned persona and engage meaningfully with the community.",
+                },
+                {"role": "user", "content": prompt},
+            ]
+
+            experiment = twin.user_profile.experiment
+            response_cache = get_response_cache(experiment)
+            content = None
+            if response_cache:
+                content = response_cache.get(llm_model, base_url, messages)
+            if not content:
+                # Make the API call, reading at most the platform limit
+                max_tokens = response_max_tokens(experiment, max_chars)
+                tokens = estimate_tokens(messages, max_tokens)
+                with LLMRateLimit(base_url, api_key, tokens):
+                    stream = client.chat.completions.create(
+                        model=llm_model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        stream=True,
+                    )
+                    content = self.read_stream(stream)
+                if response_cache:
+                    response_cache.set(llm_model, base_url, messages, content)
+
+            # Clean the content and trim it to the maximum allowed length
+            content = self.clean_response(content)
 
             # Log the actual content length for monitoring
             logger.info(
@@ -654,6 +1018,8 @@ Output only the text of the post, with no additional commentary or explanation.
 
             return content
 
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             logger.error(
                 f"Error in generate_original_post_content: {e!s}", exc_info=True
@@ -699,8 +1065,7 @@ Output only the text of the post, with no additional commentary or explanation.
                 )
                 return None
 
-            # Create a new post from the digital twin
-            # Important: Use create() + save() to make sure the post ID is set before the hashtag parsing runs
+            # Create a new post from the digital twin (hashtags are parsed once the post is saved)
             new_post = Post.objects.create(
                 user_profile=twin.user_profile,
                 experiment=twin.user_profile.experiment,
@@ -708,9 +1073,6 @@ Output only the text of the post, with no additional commentary or explanation.
                 depth=0,  # Top-level post
             )
 
-            # Save the post again to perform hashtag parsing after the post ID exists
-            new_post.save()
-
             # Update the last_post timestamp for the twin
             twin.last_post = timezone.now()
             twin.save(update_fields=["last_post", "last_modified"])
@@ -720,6 +1082,8 @@ Output only the text of the post, with no additional commentary or explanation.
             )
             return str(new_post.id)
 
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error creating original post: {e!s}", exc_info=True)
             return None
@@ -0,0 +1,127 @@
+"""
+Cross-request cache of experiments by identifier.
+
+Almost every request looks up its experiment by identifier, while experiments
+rarely change. Snapshots of the experiments' fields are kept in a
+process-local LRU of EXPERIMENT_CACHE_SIZE entries, backed by the shared
+cache, and versioned like the twin profiles (see twin_profile.py): every save
+of an Experiment, soft deletes included, stores a new version of its
+identifier in the shared cache (see signals.py), and a snapshot is only used
+while its version is current. Each lookup then costs one cache read instead
+of a query.
+
+Unknown and deleted identifiers are cached as well, creating or restoring the
+experiment outdates them.
+"""
+
+import copy
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Experiment
+
+VERSION_CACHE_PREFIX = "pds:experiment-version:"
+SNAPSHOT_CACHE_PREFIX = "pds:experiment:"
+
+_lock = threading.Lock()
+_snapshots = OrderedDict()
+
+
+def _version_key(identifier):
+    return f"{VERSION_CACHE_PREFIX}{identifier}"
+
+
+def _snapshot_key(identifier):
+    return f"{SNAPSHOT_CACHE_PREFIX}{identifier}"
+
+
+def _field_names():
+    return [field.attname for field in Experiment._meta.concrete_fields]
+
+
+def invalidate_experiment(identifier):
+    """
+    Marks the cached snapshot of the experiment with an identifier as
+    outdated in every process.
+    """
+    cache.set(_version_key(identifier), uuid.uuid4().hex, None)
+    cache.delete(_snapshot_key(identifier))
+
+
+def _current_version(identifier):
+    key = _version_key(identifier)
+    version = cache.get(key)
+    if version is None:
+        # Start a new version, so a snapshot taken under a version that was
+        # evicted from the cache isn't mistaken for a current one
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def _take_snapshot(identifier, version):
+    experiment = Experiment.objects.filter(identifier=identifier).first()
+    values = None
+    if experiment:
+        values = tuple(getattr(experiment, name) for name in _field_names())
+    return version, values
+
+
+def _remember(identifier, entry):
+    with _lock:
+        _snapshots[identifier] = entry
+        _snapshots.move_to_end(identifier)
+        while len(_snapshots) > settings.EXPERIMENT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+
+
+def get_cached_experiment(identifier):
+    """
+    Returns the experiment with an identifier, like
+    Experiment.objects.filter(identifier=identifier).first(), from its
+    current snapshot if there is one.
+
+    Args:
+        identifier: Experiment identifier
+
+    Returns:
+        A new Experiment instance for each call, or None if there is no such
+        experiment or it is deleted
+    """
+    version = _current_version(identifier)
+    with _lock:
+        entry = _snapshots.get(identifier)
+        if entry is not None and entry[0] == version:
+            _snapshots.move_to_end(identifier)
+        else:
+            entry = None
+    if entry is None:
+        entry = cache.get(_snapshot_key(identifier))
+        if entry is None or entry[0] != version:
+            entry = _take_snapshot(identifier, version)
+            cache.set(
+                _snapshot_key(identifier),
+                entry,
+                settings.EXPERIMENT_CACHE_TIMEOUT,
+            )
+        _remember(identifier, entry)
+    values = entry[1]
+    if values is None:
+        return None
+    # Copied so changes to e.g. the options of one instance don't leak into
+    # the snapshot
+    return Experiment.from_db(
+        DEFAULT_DB_ALIAS,
+        _field_names(),
+        copy.deepcopy(values),
+    )
+
+
+def clear_experiment_cache():
+    with _lock:
+        _snapshots.clear()
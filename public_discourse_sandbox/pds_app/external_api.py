@@ -2,15 +2,20 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.decorators import authentication_classes
 from rest_framework.decorators import permission_classes
+from rest_framework.pagination import BasePagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from .authentication import BearerAuthentication
-from .models import Experiment
+from .experiment_cache import get_cached_experiment
+from .feed import annotate_feed_state
+from .feed import encode_cursor
 from .models import Post
 from .models import UserProfile
 from .models import Vote
+from .search import search_posts
 from .serializers import ExperimentSerializer
 from .serializers import PostCommentsSerializer
 from .serializers import PostCreateSerializer
@@ -26,14 +31,71 @@ class CustomPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class FeedCursorPagination(BasePagination):
+    """
+    Keyset pagination for feeds built with get_active_posts.
+    The feed is fetched directly from the cursor position with one extra row,
+    which tells whether a next page exists without counting the whole feed.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+
+    def get_page_size(self, request):
+        return min(
+            int(request.query_params.get(self.page_size_query_param, self.page_size)),
+            self.max_page_size,
+        )
+
+    def get_cursor(self, request):
+        return request.query_params.get(self.cursor_query_param)
+
+    def paginate_feed(self, get_posts, request):
+        """
+        Fetch one page of a feed.
+
+        Args:
+            get_posts: Callable taking cursor and page_size keyword arguments,
+                e.g. a partial of get_home_feed_posts
+            request: The current request object
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        page = list(get_posts(cursor=self.get_cursor(request), page_size=page_size + 1))
+
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = encode_cursor(page[-1])
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "results": data,
+            },
+        )
+
+
 @api_view(["GET"])
 @authentication_classes([BearerAuthentication])
 @permission_classes([IsAuthenticated])
 def api_home_timeline(request, experiment_id):
     try:
-        try:
-            experiment = Experiment.objects.get(identifier=experiment_id)
-        except Experiment.DoesNotExist:
+        experiment = get_cached_experiment(experiment_id)
+        if experiment is None:
             return Response(
                 {
                     "error": "experiment does not exist",
@@ -59,16 +121,15 @@ def api_home_timeline(request, experiment_id):
                 },
                 status=status.HTTP_403_FORBIDDEN,
             )
-        page_size = min(int(request.query_params.get("page_size", 20)), 100)
-        posts = list(
-            get_home_feed_posts(
+        paginator = FeedCursorPagination()
+        page = paginator.paginate_feed(
+            lambda **kwargs: get_home_feed_posts(
                 request=request,
                 experiment=experiment,
-                page_size=page_size,
-            ),
+                **kwargs,
+            ).prefetch_related("tags"),
+            request,
         )
-        paginator = CustomPagination()
-        page = paginator.paginate_queryset(posts, request)
         serializer = PostSerializer(page, many=True)
         return paginator.get_paginated_response(serializer.data)
     except Exception as e:
@@ -113,9 +174,8 @@ def api_search_posts(request, experiment_id):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    try:
-        experiment = Experiment.objects.get(identifier=experiment_id)
-    except Experiment.DoesNotExist:
+    experiment = get_cached_experiment(experiment_id)
+    if experiment is None:
         return Response(
             {
                 "error": "experiment does not exist",
@@ -140,36 +200,21 @@ def api_search_posts(request, experiment_id):
             status=status.HTTP_403_FORBIDDEN,
         )
 
-    from django.db import models
-
-    max_results = min(int(request.query_params.get("page_size", 20)), 100)
-    posts = (
-        Post.objects.filter(
-            experiment=experiment,
-            is_deleted=False,
-            parent_post__isnull=True,
-        )
-        .filter(
-            models.Q(content__icontains=query)
-            | models.Q(hashtag__tag__icontains=query.lower()),
+    # Ranked full-text search, best match first
+    posts = annotate_feed_state(
+        search_posts(
+            experiment,
+            query,
+            Post.objects.filter(parent_post__isnull=True),
         )
         .select_related(
             "user_profile",
             "user_profile__user",
         )
-        .prefetch_related(
-            "vote_set",
-            "hashtag_set",
-        )
-        .order_by("-created_date")
+        .prefetch_related("tags"),
+        request.user,
+        user_profile,
     )
-    for post in posts:
-        post.comment_count = post.get_comment_count()
-        post.user_has_voted = Vote.objects.filter(
-            user_profile=user_profile,
-            post=post,
-            is_upvote=True,
-        ).exists()
     paginator = CustomPagination()
     page = paginator.paginate_queryset(posts, request)
     serializer = PostSerializer(page, many=True)
@@ -210,7 +255,7 @@ def api_get_post_by_id(request, post_id):
             status=status.HTTP_403_FORBIDDEN,
         )
 
-    post.comment_count = post.get_comment_count()
+    post.comment_count = post.num_comments
     post.user_has_voted = Vote.objects.filter(
         user_profile=user_profile,
         post=post,
@@ -287,9 +332,8 @@ def api_get_post_comments_by_id(request, post_id):
 @authentication_classes([BearerAuthentication])
 @permission_classes([IsAuthenticated])
 def api_create_post(request, experiment_id):
-    try:
-        experiment = Experiment.objects.get(identifier=experiment_id)
-    except Experiment.DoesNotExist:
+    experiment = get_cached_experiment(experiment_id)
+    if experiment is None:
         return Response(
             {
                 "error": "experiment does not exist",
@@ -387,8 +431,6 @@ def api_like_post(request, post_id):
     existing_vote = Vote.objects.filter(user_profile=user_profile, post=post).first()
     if existing_vote:
         existing_vote.delete()
-        post.num_upvotes -= 1
-        post.save()
         like = False
     else:
         Vote.objects.create(
@@ -396,9 +438,8 @@ def api_like_post(request, post_id):
             post=post,
             is_upvote=True,
         )
-        post.num_upvotes += 1
-        post.save()
         like = True
+    post.refresh_from_db(fields=["num_upvotes"])
     return Response(
         {
             "data": {
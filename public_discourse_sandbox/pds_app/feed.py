@@ -0,0 +1,97 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+
+from django.db.models import Exists
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Value
+
+from .models import SocialNetwork
+from .models import Vote
+
+
+def annotate_feed_state(posts, user, user_profile=None):
+    """
+    Decorate a queryset of posts with the per-viewer state rendered in feeds.
+
+    Adds the following annotations so a whole page is decorated by the same
+    query that fetches it, instead of several queries per post:
+    - comment_count: number of non-deleted replies from non-banned authors,
+      the num_comments counter (see counters.py)
+    - has_user_voted: whether user_profile upvoted (liked) the post
+    - is_following: whether user_profile follows the post author. Always False
+      for the user's own posts.
+
+    Both are False when no profile is given.
+
+    Args:
+        posts: A Post queryset (may already be filtered, ordered or distinct)
+        user: The user viewing the feed
+        user_profile: Optional UserProfile of the user in the current experiment
+    """
+    posts = posts.annotate(comment_count=F("num_comments"))
+
+    if not user.is_authenticated or not user_profile:
+        return posts.annotate(has_user_voted=Value(False), is_following=Value(False))
+
+    return posts.annotate(
+        has_user_voted=Exists(
+            Vote.objects.filter(
+                post=OuterRef("pk"),
+                user_profile=user_profile,
+                is_upvote=True,
+            ),
+        ),
+        is_following=Exists(
+            SocialNetwork.objects.filter(
+                source_node=user_profile,
+                target_node=OuterRef("user_profile"),
+            ).exclude(target_node__user=user),
+        ),
+    )
+
+
+def encode_cursor(post):
+    """
+    Encode the feed position of a post as an opaque cursor string.
+    The cursor identifies the post by (created_date, id), so the next page
+    can be fetched without looking the post up again.
+    """
+    position = f"{post.created_date.isoformat()}|{post.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Returns:
+        A (created_date, id) tuple, or None if the cursor is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_date, post_id = position.split("|")
+        return datetime.fromisoformat(created_date), uuid.UUID(post_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
+def paginate_after(posts, cursor):
+    """
+    Restrict posts to those that come after the cursor in feed order
+    (newest first, ties broken by id) and apply that ordering.
+    An invalid or missing cursor returns the first page.
+    """
+    position = decode_cursor(cursor)
+    if position:
+        created_date, post_id = position
+        posts = posts.filter(
+            Q(created_date__lt=created_date)
+            | Q(created_date=created_date, id__lt=post_id),
+        )
+    return posts.order_by("-created_date", "-id")
@@ -0,0 +1,144 @@
+"""
+Shared OpenAI clients for LLM calls.
+
+Creating an openai.OpenAI client per request opens a new HTTP connection
+pool, so every call pays connection and TLS setup again. Clients are kept in
+a registry keyed by (base_url, api_key) instead, so all twins pointing at the
+same LLM endpoint share one connection pool per process. The pool size and
+timeouts are configured with the LLM_POOL_SIZE, LLM_TIMEOUT,
+LLM_CONNECT_TIMEOUT and LLM_MAX_RETRIES settings.
+
+Failed requests are raised as TransientLLMError when retrying later may
+succeed (timeouts, connection errors, 429 and 5xx responses) and as
+PermanentLLMError otherwise, see classify_llm_error.
+"""
+
+import os
+import threading
+
+import httpx
+import openai
+from django.conf import settings
+
+_lock = threading.Lock()
+_clients = {}
+_clients_pid = None
+
+
+class LLMError(Exception):
+    """
+    Raised when an LLM request fails.
+    """
+
+
+class TransientLLMError(LLMError):
+    """
+    An LLM failure that may succeed when retried later.
+    """
+
+
+class PermanentLLMError(LLMError):
+    """
+    An LLM failure that retrying won't fix, e.g. a rejected request.
+    """
+
+
+def classify_llm_error(error):
+    """
+    Wraps an exception raised by an LLM call in TransientLLMError or
+    PermanentLLMError.
+    """
+    if isinstance(error, LLMError):
+        return error
+    transient = isinstance(
+        error,
+        (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError),
+    ) or (isinstance(error, openai.APIStatusError) and error.status_code in (408, 409))
+    error_class = TransientLLMError if transient else PermanentLLMError
+    return error_class(f"{type(error).__name__}: {error!s}")
+
+
+def _client_options():
+    pool_size = getattr(settings, "LLM_POOL_SIZE", 20)
+    timeout = httpx.Timeout(
+        getattr(settings, "LLM_TIMEOUT", 60.0),
+        connect=getattr(settings, "LLM_CONNECT_TIMEOUT", 5.0),
+    )
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+    )
+    return timeout, limits, getattr(settings, "LLM_MAX_RETRIES", 2)
+
+
+def _build_client(base_url, api_key):
+    timeout, limits, max_retries = _client_options()
+    return openai.OpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=httpx.Client(limits=limits, timeout=timeout),
+    )
+
+
+def build_async_llm_client(base_url=None, api_key=None):
+    """
+    Returns a new async client for an LLM endpoint, configured like the shared
+    clients. Async clients are bound to the event loop they are used in, so
+    they are not shared between tasks; close them when the loop is done.
+
+    Args:
+        base_url: Base URL of the OpenAI compatible API (default: OPENAI_BASE_URL)
+        api_key: API key for the endpoint (default: OPENAI_API_KEY)
+    """
+    timeout, limits, max_retries = _client_options()
+    return openai.AsyncOpenAI(
+        base_url=base_url or settings.OPENAI_BASE_URL,
+        api_key=api_key or settings.OPENAI_API_KEY,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+
+
+def get_llm_client(base_url=None, api_key=None):
+    """
+    Returns the shared client for an LLM endpoint, creating it on first use.
+
+    Args:
+        base_url: Base URL of the OpenAI compatible API (default: OPENAI_BASE_URL)
+        api_key: API key for the endpoint (default: OPENAI_API_KEY)
+    """
+    global _clients_pid
+    key = (base_url or settings.OPENAI_BASE_URL, api_key or settings.OPENAI_API_KEY)
+    with _lock:
+        # Connection pools must not be shared with forked worker processes
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if key not in _clients:
+            _clients[key] = _build_client(*key)
+        return _clients[key]
+
+
+def clear_llm_clients():
+    """
+    Closes and forgets all shared clients, e.g. after changing settings.
+    """
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def get_twin_llm_config(twin):
+    """
+    Returns the (base_url, api_key, model) a digital twin uses for LLM calls,
+    falling back to the global settings for anything the twin doesn't set.
+    """
+    return (
+        twin.llm_url or settings.OPENAI_BASE_URL,
+        twin.api_token or settings.OPENAI_API_KEY,
+        twin.llm_model or settings.LLM_MODEL,
+    )
@@ -0,0 +1,262 @@
+"""
+OpenAI compatible stand-in for an LLM endpoint, for load and regression
+testing the digital twin pipeline without a real provider.
+
+The server answers POST .../chat/completions (with or without a /v1 prefix),
+streaming included, with canned responses picked deterministically from the
+request messages, so the same prompt always gets the same answer. Latency
+and error rate are configurable. Content analysis prompts asking for a JSON
+object get a JSON sentiment and keywords answer. Start it with the
+llm_stub_server management command and point OPENAI_BASE_URL or a twin's
+llm_url at it.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESPONSES = [
+    "Interesting point about {keyword}, I hadn't thought of it that way.",
+    "I'm not sure I agree on {keyword}, but it's worth discussing.",
+    "This is exactly why {keyword} matters. #{hashtag}",
+    "Has anyone looked at the data on {keyword}? Curious what it shows.",
+    "Hot take: {keyword} is overrated.",
+    "Thanks for sharing, {keyword} deserves more attention.",
+]
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+_word_re = re.compile(r"[A-Za-z][A-Za-z0-9]+")
+
+
+class StubLLM:
+    """
+    Decides the latency, failures and content of the stub's responses.
+
+    Args:
+        responses: Response templates, formatted with keyword and hashtag
+            taken from the last user message (default: DEFAULT_RESPONSES)
+        latency_ms: Mean response latency in milliseconds
+        latency_spread_ms: Spread of the latency around the mean: the half
+            width for "uniform", the standard deviation for "normal" and
+            "lognormal"
+        distribution: One of LATENCY_DISTRIBUTIONS
+        error_rate: Fraction of requests answered with error_status
+        error_status: HTTP status of failed requests, e.g. 429 or 500
+        seed: Seed for latency and error sampling, for repeatable runs
+    """
+
+    def __init__(
+        self,
+        responses=None,
+        latency_ms=0.0,
+        latency_spread_ms=0.0,
+        distribution="fixed",
+        error_rate=0.0,
+        error_status=500,
+        seed=None,
+    ):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.responses = responses or DEFAULT_RESPONSES
+        self.latency_ms = latency_ms
+        self.latency_spread_ms = latency_spread_ms
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def latency(self):
+        """
+        Returns the latency of the next response in seconds.
+        """
+        mean, spread = self.latency_ms, self.latency_spread_ms
+        with self._lock:
+            if self.distribution == "uniform":
+                ms = self._random.uniform(mean - spread, mean + spread)
+            elif self.distribution == "normal":
+                ms = self._random.gauss(mean, spread)
+            elif self.distribution == "lognormal" and mean > 0:
+                # Parameters of the underlying normal for the given mean and
+                # standard deviation, giving a long tail of slow responses
+                sigma2 = math.log(1 + (spread / mean) ** 2)
+                mu = math.log(mean) - sigma2 / 2
+                ms = self._random.lognormvariate(mu, sigma2**0.5)
+            else:
+                ms = mean
+        return max(ms, 0) / 1000
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def complete(self, messages, max_tokens=None):
+        """
+        Returns the canned response to chat messages. The same messages always
+        get the same response.
+        """
+        system = " ".join(m["content"] for m in messages if m["role"] == "system")
+        user = [m["content"] for m in messages if m["role"] == "user"]
+        text = user[-1] if user else ""
+        words = sorted(set(_word_re.findall(text)), key=lambda w: (-len(w), w))
+
+        if "JSON object" in system:
+            sentiment = ("positive", "negative", "neutral")[_digest(text) % 3]
+            content = json.dumps({"sentiment": sentiment, "keywords": words[:3]})
+        else:
+            index = _digest(json.dumps(messages)) % len(self.responses)
+            template = self.responses[index]
+            keyword = words[0] if words else "this"
+            content = template.format(keyword=keyword, hashtag=keyword.lower())
+
+        if max_tokens:
+            # Roughly four characters per token
+            content = content[: max_tokens * 4]
+        return content
+
+
+def _digest(text):
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the chat completions API of a StubLLM.
+    """
+
+    server_version = "PDSStubLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                200,
+                {"object": "list", "data": [{"id": "stub", "object": "model"}]},
+            )
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.rfile.read(length)
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+            messages = request["messages"]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": {"message": "Invalid request body"}})
+            return
+
+        time.sleep(self.stub.latency())
+        if self.stub.should_fail():
+            self._send_json(
+                self.stub.error_status,
+                {"error": {"message": "Stub error", "type": "stub_error"}},
+            )
+            return
+
+        content = self.stub.complete(messages, request.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "stub")
+        if request.get("stream"):
+            self._stream(completion_id, model, content)
+            return
+
+        prompt_tokens = sum(_count_tokens(m["content"] or "") for m in messages)
+        completion_tokens = _count_tokens(content)
+        self._send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    },
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def _stream(self, completion_id, model, content):
+        """
+        Sends the response as server-sent events, one chunk per word.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason},
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for word in re.findall(r"\S+\s*", content):
+                chunk({"content": word})
+            chunk({}, "stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after enough characters
+            pass
+
+
+def make_server(host, port, stub):
+    """
+    Returns a threaded HTTP server answering with stub. Call serve_forever()
+    to start it; port 0 picks a free port, see server.server_address.
+    """
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.stub = stub
+    return server
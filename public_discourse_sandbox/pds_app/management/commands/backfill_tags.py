@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from public_discourse_sandbox.pds_app.models import Hashtag
+from public_discourse_sandbox.pds_app.models import PostTag
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the hashtags of existing posts from Hashtag rows to the Tag and "
+        "PostTag tables in chunks. Safe to run again, existing links are skipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of Hashtag rows copied per chunk (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        # Walk the hashtags by id so each chunk is an indexed range scan
+        hashtags = Hashtag.objects.order_by("id")
+        batch_size = options["batch_size"]
+        total = 0
+        last_id = None
+        while True:
+            batch = hashtags.filter(id__gt=last_id) if last_id else hashtags
+            rows = list(batch.values_list("id", "post_id", "tag")[:batch_size])
+            if not rows:
+                break
+            post_names = defaultdict(list)
+            for _, post_id, tag in rows:
+                post_names[post_id].append(tag.lower())
+            PostTag.link_names(post_names)
+            total += len(rows)
+            last_id = rows[-1][0]
+            self.stdout.write(f"Copied {total} hashtags")
+
+        self.stdout.write(self.style.SUCCESS(f"Copied {total} hashtags to tags"))
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from public_discourse_sandbox.pds_app.llm_stub import LATENCY_DISTRIBUTIONS
+from public_discourse_sandbox.pds_app.llm_stub import StubLLM
+from public_discourse_sandbox.pds_app.llm_stub import make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Run an OpenAI compatible stub LLM server with canned responses, "
+        "configurable latency and error rate, for offline load testing. "
+        "Point OPENAI_BASE_URL or a twin's llm_url at http://<host>:<port>/v1"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="Interface to listen on (default: 127.0.0.1)",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8001,
+            help="Port to listen on (default: 8001)",
+        )
+        parser.add_argument(
+            "--latency-ms",
+            type=float,
+            default=0.0,
+            help="Mean response latency in milliseconds (default: 0)",
+        )
+        parser.add_argument(
+            "--latency-spread-ms",
+            type=float,
+            default=0.0,
+            help="Half width (uniform) or standard deviation (normal, lognormal) "
+            "of the latency in milliseconds (default: 0)",
+        )
+        parser.add_argument(
+            "--latency-distribution",
+            choices=LATENCY_DISTRIBUTIONS,
+            default="fixed",
+            help="Distribution of the latency (default: fixed)",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of requests that fail, between 0 and 1 (default: 0)",
+        )
+        parser.add_argument(
+            "--error-status",
+            type=int,
+            default=500,
+            help="HTTP status of failed requests, e.g. 429 (default: 500)",
+        )
+        parser.add_argument(
+            "--responses",
+            type=str,
+            help="Optional file with one response template per line; templates "
+            "may use {keyword} and {hashtag} from the prompt",
+            required=False,
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Optional seed for repeatable latency and error sampling",
+            required=False,
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options["error_rate"] <= 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+
+        responses = None
+        if options["responses"]:
+            try:
+                with open(options["responses"]) as f:
+                    responses = [line.strip() for line in f if line.strip()]
+            except OSError as e:
+                raise CommandError(f"Could not read responses: {e!s}")
+
+        stub = StubLLM(
+            responses=responses,
+            latency_ms=options["latency_ms"],
+            latency_spread_ms=options["latency_spread_ms"],
+            distribution=options["latency_distribution"],
+            error_rate=options["error_rate"],
+            error_status=options["error_status"],
+            seed=options["seed"],
+        )
+        server = make_server(options["host"], options["port"], stub)
+        host, port = server.server_address[:2]
+        self.stdout.write(
+            self.style.SUCCESS(f"Stub LLM server listening on http://{host}:{port}/v1"),
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from public_discourse_sandbox.pds_app.counters import reconcile_counters
+from public_discourse_sandbox.pds_app.models import Experiment
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute post and user profile engagement counters from votes, "
+        "replies, reposts and follows"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--experiment",
+            type=str,
+            dest="experiment_identifier",
+            help="Optional experiment identifier to limit reconciliation to",
+            required=False,
+        )
+
+    def handle(self, *args, **options):
+        experiment = None
+        identifier = options.get("experiment_identifier")
+        if identifier:
+            try:
+                experiment = Experiment.objects.get(identifier=identifier)
+            except Experiment.DoesNotExist:
+                output = f'experiment "{identifier}" does not exist'
+                raise CommandError(output)
+
+        num_posts, num_profiles = reconcile_counters(experiment)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciled counters for {num_posts} posts "
+                f"and {num_profiles} user profiles",
+            ),
+        )
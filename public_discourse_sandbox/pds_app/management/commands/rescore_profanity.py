@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from public_discourse_sandbox.pds_app.models import Experiment
+from public_discourse_sandbox.pds_app.models import Post
+from public_discourse_sandbox.pds_app.moderation import screen_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-score every post of an experiment for profanity in batches, "
+        "e.g. after changing the profanity threshold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "experiment_identifier",
+            type=str,
+            help="identifier of the experiment to re-score",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            help="Optional new profanity threshold to store on the experiment first",
+            required=False,
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of posts scored per model call (default: 500)",
+        )
+
+    def handle(self, *args, **options):
+        identifier = options["experiment_identifier"]
+        try:
+            experiment = Experiment.objects.get(identifier=identifier)
+        except Experiment.DoesNotExist:
+            output = f'experiment "{identifier}" does not exist'
+            raise CommandError(output)
+
+        if options["threshold"] is not None:
+            experiment.set_option("profanity_threshold", options["threshold"])
+
+        # Walk the experiment's posts by id so each batch is an indexed range scan
+        posts = Post.all_objects.filter(experiment=experiment).order_by("id")
+        batch_size = options["batch_size"]
+        total = 0
+        last_id = None
+        while True:
+            batch = posts.filter(id__gt=last_id) if last_id else posts
+            batch_ids = list(batch.values_list("id", flat=True)[:batch_size])
+            if not batch_ids:
+                break
+            total += screen_posts(
+                Post.all_objects.filter(id__in=batch_ids),
+                unflag=True,
+            )
+            last_id = batch_ids[-1]
+            self.stdout.write(f"Re-scored {total} posts")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Re-scored {total} posts in experiment {identifier}"),
+        )
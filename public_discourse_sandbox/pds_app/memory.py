@@ -0,0 +1,127 @@
+"""
+Token-bounded working memory of digital twins.
+
+The memory is a deque of text segments, each stored with its token count so
+appending and trimming the oldest segments is O(1) per segment. The twin's
+persona is pinned separately and never trimmed. Token counts come from
+tiktoken when it is installed and its encoding can be loaded, otherwise
+they are estimated from words and punctuation.
+
+Experiments with the "persist_twin_memory" option keep each twin's memory
+in DigitalTwin.memory between tasks, see to_dict() and from_dict().
+"""
+
+import functools
+import logging
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_token_re = re.compile(r"\w+|[^\w\s]")
+
+
+@functools.cache
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.info(f"tiktoken unavailable, estimating token counts: {e!s}")
+        return None
+
+
+def count_tokens(text):
+    """
+    Returns the number of tokens in text.
+    """
+    encoding = _encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return len(_token_re.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """
+    Returns the last max_tokens tokens of text.
+    """
+    encoding = _encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text)[-max_tokens:])
+    matches = list(_token_re.finditer(text))
+    if len(matches) <= max_tokens:
+        return text
+    return text[matches[-max_tokens].start() :]
+
+
+class WorkingMemory:
+    """
+    Rolling conversation memory holding at most max_tokens tokens of segments
+    besides the pinned persona.
+
+    Args:
+        max_tokens: Token budget of the segments
+        persona: Text always sent first, not counted against max_tokens
+    """
+
+    def __init__(self, max_tokens=512, persona=""):
+        self.max_tokens = max_tokens
+        self.segments = deque()
+        self.tokens = 0
+        self.persona = ""
+        self.persona_tokens = 0
+        self.pin(persona)
+
+    def pin(self, persona):
+        """
+        Sets the persona kept at the start of the memory.
+        """
+        if persona != self.persona:
+            self.persona = persona
+            self.persona_tokens = count_tokens(persona) if persona else 0
+
+    def append(self, text, tokens=None):
+        """
+        Adds a segment and drops the oldest segments beyond the token budget.
+        A single segment larger than the budget keeps only its last tokens.
+        """
+        if tokens is None:
+            tokens = count_tokens(text)
+        if tokens > self.max_tokens:
+            text = truncate_tokens(text, self.max_tokens)
+            tokens = count_tokens(text)
+        self.segments.append((text, tokens))
+        self.tokens += tokens
+        while self.tokens > self.max_tokens:
+            _, dropped = self.segments.popleft()
+            self.tokens -= dropped
+
+    def clear(self):
+        self.segments.clear()
+        self.tokens = 0
+
+    def text(self):
+        """
+        Returns the persona followed by the segments, oldest first.
+        """
+        parts = [self.persona] if self.persona else []
+        parts += [text for text, _ in self.segments]
+        return " ".join(parts)
+
+    def __len__(self):
+        return self.persona_tokens + self.tokens
+
+    def to_dict(self):
+        """
+        Returns the segments in a JSON serializable form. The persona is not
+        included, it is pinned again from the twin when the memory is loaded.
+        """
+        return {"segments": [list(segment) for segment in self.segments]}
+
+    @classmethod
+    def from_dict(cls, data, max_tokens=512, persona=""):
+        memory = cls(max_tokens=max_tokens, persona=persona)
+        for text, tokens in (data or {}).get("segments", []):
+            memory.append(text, tokens)
+        return memory
@@ -0,0 +1,93 @@
+"""
+Request-scoped experiment context.
+
+A page request used to look up its experiment and the user's profile in it
+in ExperimentContextMixin, check_banned and each of the context processors.
+The lookups are memoized on the request instead: get_request_experiment()
+and get_request_profile() run each query at most once per request, and
+ExperimentContextMiddleware resolves both for views with an
+experiment_identifier before the view runs.
+
+The helpers work without the middleware too, e.g. for requests built by the
+test RequestFactory, they then resolve on first use.
+"""
+
+from django.utils.deprecation import MiddlewareMixin
+
+from .experiment_cache import get_cached_experiment
+
+_EXPERIMENTS_ATTR = "_pds_experiments"
+_PROFILES_ATTR = "_pds_user_profiles"
+
+
+def get_url_experiment_identifier(request):
+    """
+    Returns the experiment_identifier of the URL of the request, or None.
+    """
+    match = getattr(request, "resolver_match", None)
+    if not match:
+        return None
+    return match.kwargs.get("experiment_identifier")
+
+
+def get_request_experiment(request, identifier=None):
+    """
+    Returns the experiment with an identifier, looked up at most once per
+    request in the cache of experiments (see experiment_cache.py).
+
+    Args:
+        request: The current request
+        identifier: Experiment identifier (default: the one of the URL)
+
+    Returns:
+        Experiment or None if there is no such experiment
+    """
+    identifier = identifier or get_url_experiment_identifier(request)
+    if not identifier:
+        return None
+    experiments = request.__dict__.setdefault(_EXPERIMENTS_ATTR, {})
+    if identifier not in experiments:
+        experiments[identifier] = get_cached_experiment(identifier)
+    return experiments[identifier]
+
+
+def get_request_profile(request, experiment):
+    """
+    Returns the profile of the user of the request in an experiment, looked
+    up at most once per request.
+
+    Args:
+        request: The current request
+        experiment: An Experiment or None
+
+    Returns:
+        UserProfile or None if the user is anonymous or has no profile
+    """
+    if experiment is None or not request.user.is_authenticated:
+        return None
+    profiles = request.__dict__.setdefault(_PROFILES_ATTR, {})
+    if experiment.id not in profiles:
+        profile = request.user.userprofile_set.filter(
+            experiment=experiment,
+        ).first()
+        if profile:
+            # Spare is_experiment_moderator() fetching the experiment again
+            profile.experiment = experiment
+        profiles[experiment.id] = profile
+    return profiles[experiment.id]
+
+
+class ExperimentContextMiddleware(MiddlewareMixin):
+    """
+    Resolves the experiment of the URL and the user's profile in it once,
+    before the view, for the views, decorators and context processors of the
+    request to share.
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        identifier = view_kwargs.get("experiment_identifier")
+        if identifier:
+            experiment = get_request_experiment(request, identifier)
+            get_request_profile(request, experiment)
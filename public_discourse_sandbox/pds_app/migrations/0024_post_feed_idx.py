@@ -0,0 +1,17 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0023_userprofile_is_notifications_enabled'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['experiment', '-created_date', '-id'], name='post_feed_idx'),
+        ),
+    ]
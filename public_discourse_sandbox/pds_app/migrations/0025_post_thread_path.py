@@ -0,0 +1,54 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_thread_paths(apps, schema_editor):
+    """
+    Set thread_root and path on existing posts, parents before their replies.
+    Posts whose parent was removed are treated as the root of their own thread.
+    """
+    Post = apps.get_model("pds_app", "Post")
+    threads = {}
+    batch = []
+    posts = Post._default_manager.order_by("depth", "created_date").only(
+        "id", "parent_post_id", "created_date"
+    )
+    for post in posts.iterator(chunk_size=2000):
+        micros = int(post.created_date.timestamp()) * 1_000_000 + post.created_date.microsecond
+        segment = f"{micros:016d}{post.id.hex[:8]}/"
+        parent = threads.get(post.parent_post_id)
+        if parent:
+            post.thread_root_id, parent_path = parent
+            post.path = parent_path + segment
+        else:
+            post.thread_root_id = post.id
+            post.path = segment
+        threads[post.id] = (post.thread_root_id, post.path)
+        batch.append(post)
+        if len(batch) >= 2000:
+            Post._default_manager.bulk_update(batch, ["thread_root", "path"])
+            batch = []
+    Post._default_manager.bulk_update(batch, ["thread_root", "path"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0024_post_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, max_length=2500),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thread_root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='thread_posts', to='pds_app.post'),
+        ),
+        migrations.RunPython(build_thread_paths, migrations.RunPython.noop),
+    ]
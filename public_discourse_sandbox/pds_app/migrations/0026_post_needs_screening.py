@@ -0,0 +1,22 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0025_post_thread_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='needs_screening',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('needs_screening', True)), fields=['created_date'], name='post_screening_idx'),
+        ),
+    ]
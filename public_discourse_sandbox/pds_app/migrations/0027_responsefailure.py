@@ -0,0 +1,31 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:27
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0026_post_needs_screening'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseFailure',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('last_modified', models.DateTimeField(auto_now=True, null=True)),
+                ('error', models.TextField()),
+                ('is_transient', models.BooleanField(default=False)),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('digital_twin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pds_app.digitaltwin')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='response_failures', to='pds_app.post')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
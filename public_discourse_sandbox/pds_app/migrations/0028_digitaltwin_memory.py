@@ -0,0 +1,18 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0027_responsefailure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digitaltwin',
+            name='memory',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
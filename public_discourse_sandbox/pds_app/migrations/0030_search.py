@@ -0,0 +1,105 @@
+# Generated by Django 5.0.13 on 2026-10-17 03:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations
+
+POST_SEARCH_IDX = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"],
+    name="post_search_idx",
+)
+USERNAME_TRGM = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.indexes.OpClass(
+        django.db.models.functions.text.Upper("username"),
+        name="gin_trgm_ops",
+    ),
+    name="userprofile_username_trgm",
+)
+NAME_TRGM = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.indexes.OpClass(
+        django.db.models.functions.text.Upper("display_name"),
+        name="gin_trgm_ops",
+    ),
+    name="userprofile_name_trgm",
+)
+
+# Keeps search_vector in sync with content on every insert and content update,
+# including bulk_create and queryset update()
+CREATE_TRIGGER = """
+CREATE FUNCTION pds_app_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('pg_catalog.english', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER pds_app_post_search_vector
+BEFORE INSERT OR UPDATE OF content ON pds_app_post
+FOR EACH ROW EXECUTE FUNCTION pds_app_post_search_vector();
+
+UPDATE pds_app_post
+SET search_vector = to_tsvector('pg_catalog.english', coalesce(content, ''));
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS pds_app_post_search_vector ON pds_app_post;
+DROP FUNCTION IF EXISTS pds_app_post_search_vector();
+"""
+
+
+def _has_trigram_extension(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Full-text and trigram search only exist on PostgreSQL; other databases
+    use the in-process fallback of search.py. Servers built without the
+    pg_trgm contrib extension get no trigram indexes, user search still works
+    there without them.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Post = apps.get_model("pds_app", "Post")
+    UserProfile = apps.get_model("pds_app", "UserProfile")
+    schema_editor.execute(CREATE_TRIGGER)
+    schema_editor.add_index(Post, POST_SEARCH_IDX)
+    if _has_trigram_extension(schema_editor):
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.add_index(UserProfile, USERNAME_TRGM)
+        schema_editor.add_index(UserProfile, NAME_TRGM)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Post = apps.get_model("pds_app", "Post")
+    schema_editor.execute(f"DROP INDEX IF EXISTS {NAME_TRGM.name}")
+    schema_editor.execute(f"DROP INDEX IF EXISTS {USERNAME_TRGM.name}")
+    schema_editor.remove_index(Post, POST_SEARCH_IDX)
+    schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pds_app", "0029_tag_posttag"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        # Not part of the model state, so databases other than PostgreSQL,
+        # e.g. SQLite test databases created without migrations, never see them
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
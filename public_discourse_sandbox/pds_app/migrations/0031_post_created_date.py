@@ -0,0 +1,19 @@
+# Generated by Django 5.0.13 on 2026-10-17 04:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0030_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='created_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
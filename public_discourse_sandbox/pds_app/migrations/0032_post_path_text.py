@@ -0,0 +1,18 @@
+# Generated by Django 5.0.13 on 2026-10-17 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pds_app', '0031_post_created_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='path',
+            field=models.TextField(blank=True),
+        ),
+    ]
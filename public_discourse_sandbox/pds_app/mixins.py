@@ -2,6 +2,8 @@ from django.shortcuts import get_object_or_404, redirect
 from django.core.exceptions import PermissionDenied
 from django.urls import reverse
 from .models import Experiment, UserProfile, ExperimentInvitation
+from .middleware import get_request_experiment
+from .middleware import get_request_profile
 
 
 class ExperimentContextMixin:
@@ -83,12 +85,9 @@ class ExperimentContextMixin:
 
             # Try to get experiment from URL
             if "experiment_identifier" in kwargs:
-                try:
-                    self.experiment = Experiment.objects.get(
-                        identifier=kwargs["experiment_identifier"]
-                    )
-                except Experiment.DoesNotExist:
-                    self.experiment = None
+                self.experiment = get_request_experiment(
+                    request, kwargs["experiment_identifier"]
+                )
 
             # If not found, try last_accessed (but only if not deleted)
             if not self.experiment:
@@ -113,12 +112,10 @@ class ExperimentContextMixin:
                 return
 
             # Get user's profile for this experiment
-            self.user_profile = request.user.userprofile_set.filter(
-                experiment=self.experiment
-            ).first()
+            self.user_profile = get_request_profile(request, self.experiment)
 
             # Update user's last_accessed experiment if needed
-            if request.user.last_accessed != self.experiment:
+            if request.user.last_accessed_id != self.experiment.id:
                 request.user.last_accessed = self.experiment
                 request.user.save()
 
@@ -130,7 +127,10 @@ class ExperimentContextMixin:
         if not user.is_authenticated:
             return False
 
-        user_profile = user.userprofile_set.filter(experiment=experiment).first()
+        if user == self.request.user:
+            user_profile = get_request_profile(self.request, experiment)
+        else:
+            user_profile = user.userprofile_set.filter(experiment=experiment).first()
         if not user_profile:
             return False
 
@@ -233,7 +233,10 @@ class ModeratorPermissionMixin:
         if not user.is_authenticated:
             return False
 
-        user_profile = user.userprofile_set.filter(experiment=experiment).first()
+        if user == self.request.user:
+            user_profile = get_request_profile(self.request, experiment)
+        else:
+            user_profile = user.userprofile_set.filter(experiment=experiment).first()
         if not user_profile:
             return False
 
@@ -1,14 +1,22 @@
 import hashlib
+import re
 import secrets
 import uuid
+from collections import Counter
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import DEFERRED
+from django.db.models import F
+from django.utils import timezone
 from django_notification_system.models import NotificationTarget
 from django_notification_system.models import TargetUserRecord
 
+from .utils import PROFANITY_THRESHOLD
 from .utils import check_profanity
+from .utils import profanity_scores
 
 User = get_user_model()
 
@@ -158,6 +166,9 @@ class UserProfile(BaseModel):
 
     class Meta:
         unique_together = ("username", "experiment")
+        # The trigram indexes for handle and name search (see search.py) are
+        # PostgreSQL only, they are created by migration 0030 rather than
+        # declared here
 
     def __str__(self):
         bot_status = " (Digital Twin)" if self.is_digital_twin else ""
@@ -244,6 +255,22 @@ class Post(BaseModel):
         on_delete=models.SET_NULL,
     )
     depth = models.IntegerField(default=0)
+    # Top-level post of the thread this post belongs to (itself for top-level posts)
+    thread_root = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="thread_posts",
+    )
+    # Materialized path of the post within its thread, see build_thread_path.
+    # Grows by a segment per level, so it's unbounded text. Not indexed: thread
+    # queries are narrowed by thread_root, and B-tree entries are limited to
+    # about 2.7 kB, which would cap threads at about 100 levels again.
+    path = models.TextField(blank=True)
+    # Set when the post is instantiated instead of by auto_now_add on insert,
+    # so the thread path can be built from the stored creation time
+    created_date = models.DateTimeField(default=timezone.now, editable=False)
     num_upvotes = models.IntegerField(default=0)
     num_downvotes = models.IntegerField(default=0)
     num_comments = models.IntegerField(default=0)
@@ -252,6 +279,8 @@ class Post(BaseModel):
     is_edited = models.BooleanField(default=False)
     is_pinned = models.BooleanField(default=False)
     is_flagged = models.BooleanField(default=False)
+    # Set when the content still has to be scored by the screen_pending_posts task
+    needs_screening = models.BooleanField(default=False)
     repost_source = models.ForeignKey(
         "self",
         null=True,
@@ -259,6 +288,28 @@ class Post(BaseModel):
         on_delete=models.SET_NULL,
         related_name="reposts",
     )
+    # Hashtags in the content, see parse_hashtags
+    tags = models.ManyToManyField("Tag", through="PostTag", related_name="posts")
+    # Full-text search vector of the content, kept up to date by a database
+    # trigger on PostgreSQL, see search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Feeds are paginated by (created_date, id) within an experiment
+            models.Index(
+                fields=["experiment", "-created_date", "-id"],
+                name="post_feed_idx",
+            ),
+            # Only the few posts waiting to be screened are indexed
+            models.Index(
+                fields=["created_date"],
+                condition=models.Q(needs_screening=True),
+                name="post_screening_idx",
+            ),
+            # The GIN index of search_vector is PostgreSQL only, it is
+            # created by migration 0030 rather than declared here
+        ]
 
     def __str__(self):
         preview = self.content[:50] + "..." if len(self.content) > 50 else self.content
@@ -275,38 +326,186 @@ class Post(BaseModel):
         """
         return Post.objects.filter(parent_post=self).count()
 
-    def parse_hashtags(self):
+    @staticmethod
+    def find_hashtags(content):
         """
-        Returns a list of hashtags for this post.
+        Returns the distinct lowercase hashtags in content, in order of appearance.
         Uses regex to find Twitter-style hashtags that contain only alphanumeric chars and underscores.
         """
-        import re
-
-        if self.content:
-            print("Parsing hashtags for post: ", self.content)
-            # Find all hashtags using regex
-            # Matches # followed by word chars (letters, numbers, underscore)
-            # The (?<!\S) ensures the # has whitespace or start-of-string before it
-            hashtag_pattern = r"(?<!\S)#([a-zA-Z0-9_]+)"
-            matches = re.finditer(hashtag_pattern, self.content)
-
-            for match in matches:
-                hashtag = match.group(1)  # group(1) gets just the tag without the #
-                print("Hashtag: ", hashtag)
-                try:
-                    hashtag, created = Hashtag.objects.get_or_create(
-                        tag=hashtag.lower(),
-                        post=self,
-                    )
-                except Exception as e:
-                    print(f"Error processing hashtag {hashtag}: {e}")
+        if not content:
+            return []
+        # Matches # followed by word chars (letters, numbers, underscore)
+        # The (?<!\S) ensures the # has whitespace or start-of-string before it
+        hashtag_pattern = r"(?<!\S)#([a-zA-Z0-9_]+)"
+        # group(1) gets just the tag without the #
+        tags = (match.group(1).lower() for match in re.finditer(hashtag_pattern, content))
+        return list(dict.fromkeys(tags))
+
+    def parse_hashtags(self):
+        """
+        Links this post to the tags of the hashtags found in its content.
+        """
+        PostTag.link([self])
+
+    def build_thread_path(self):
+        """
+        Sets thread_root and path from the parent post.
+        The path is the parent's path followed by a segment made of the creation
+        time and the start of the id, so ordering a thread by path returns every
+        reply right after its parent, with siblings in created_date order.
+        """
+        if self.created_date is None:
+            self.created_date = timezone.now()
+        created = self.created_date
+        micros = int(created.timestamp()) * 1_000_000 + created.microsecond
+        segment = f"{micros:016d}{self.id.hex[:8]}/"
+        if self.parent_post:
+            self.thread_root_id = self.parent_post.thread_root_id or self.parent_post.id
+            self.path = self.parent_post.path + segment
+        else:
+            self.thread_root_id = self.id
+            self.path = segment
+
+    def get_thread(self):
+        """
+        Returns the replies below this post in display order, in a single query.
+        Deleted posts and posts from banned users are excluded, so their replies
+        are left without a parent in the result.
+        """
+        return (
+            Post.objects.filter(
+                thread_root_id=self.thread_root_id or self.id,
+                path__startswith=self.path,
+            )
+            .exclude(id=self.id)
+            .order_by("path")
+        )
+
+    @classmethod
+    def bulk_create_posts(cls, posts):
+        """
+        Inserts many new posts with one query, doing the work save() and the
+        post_save signal handlers do for a single post: the thread path,
+        profanity screening (scored in one batch), hashtags and the reply and
+        share counters of the parent and source posts.
+
+        Args:
+            posts: List of unsaved Post instances with experiment loaded
+
+        Returns:
+            The list of created posts
+        """
+        screened = []
+        for post in posts:
+            post.build_thread_path()
+            if post.is_flagged:
+                continue
+            if post.experiment.get_option("prepublication_screening", False):
+                screened.append(post)
+            else:
+                post.needs_screening = True
+        scores = profanity_scores([post.content for post in screened])
+        for post, score in zip(screened, scores):
+            threshold = post.experiment.get_option(
+                "profanity_threshold", PROFANITY_THRESHOLD
+            )
+            post.is_flagged = bool(post.content) and score > threshold
+
+        posts = cls.all_objects.bulk_create(posts)
+        for post in posts:
+            post._loaded_content = post.content
+            post._loaded_is_deleted = post.is_deleted
+
+        PostTag.link(posts)
+        for field, parent_field in (
+            ("num_comments", "parent_post_id"),
+            ("num_shares", "repost_source_id"),
+        ):
+            # Only visible posts count, see counters.py
+            counts = Counter(
+                getattr(post, parent_field)
+                for post in posts
+                if not post.is_deleted
+                and not (post.user_profile_id and post.user_profile.is_banned)
+            )
+            counts.pop(None, None)
+            for pk, count in counts.items():
+                cls.all_objects.filter(pk=pk).update(**{field: F(field) + count})
+        return posts
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the content and deletion state as loaded to detect changes
+        # on save
+        instance._loaded_content = instance.__dict__.get("content", DEFERRED)
+        instance._loaded_is_deleted = instance.__dict__.get("is_deleted", DEFERRED)
+        return instance
+
+    def has_content_changed(self, update_fields=None):
+        """
+        Returns whether saving would write new content: always for new posts,
+        otherwise only if content was changed since the post was loaded and is
+        not excluded by update_fields.
+        """
+        if self._state.adding:
+            return True
+        if update_fields is not None and "content" not in update_fields:
+            return False
+        if "content" not in self.__dict__:
+            return False
+        return getattr(self, "_loaded_content", DEFERRED) != self.content
+
+    def has_deletion_changed(self, update_fields=None):
+        """
+        Returns whether saving soft deletes or restores the post, i.e. writes
+        an is_deleted other than the one it was loaded or last saved with.
+        Always False for new posts.
+        """
+        if self._state.adding:
+            return False
+        if update_fields is not None and "is_deleted" not in update_fields:
+            return False
+        loaded = getattr(self, "_loaded_is_deleted", DEFERRED)
+        return loaded is not DEFERRED and loaded != self.is_deleted
 
     def save(self, *args, **kwargs):
+        if self._state.adding and not self.path:
+            self.build_thread_path()
+
+        # Profanity checking and hashtag parsing only depend on the content,
+        # so saves that only change counters or flags skip them
+        update_fields = kwargs.get("update_fields")
+        content_changed = self.has_content_changed(update_fields)
+
         # Check for profanity in content
-        if not self.is_flagged:  # Only check if not already flagged
-            self.is_flagged = check_profanity(self.content)
-        self.parse_hashtags()
+        if content_changed and not self.is_flagged:  # Only check if not already flagged
+            if self.experiment.get_option("prepublication_screening", False):
+                # Screen before the post is published
+                self.is_flagged = check_profanity(
+                    self.content,
+                    self.experiment.get_option(
+                        "profanity_threshold", PROFANITY_THRESHOLD
+                    ),
+                )
+            else:
+                # Screened in batches by the screen_pending_posts task
+                self.needs_screening = True
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "is_flagged",
+                    "needs_screening",
+                }
+
         super().save(*args, **kwargs)
+        self._loaded_content = self.content if "content" in self.__dict__ else DEFERRED
+        if update_fields is None or "is_deleted" in update_fields:
+            self._loaded_is_deleted = self.__dict__.get("is_deleted", DEFERRED)
+
+        # Hashtags reference the post, so they are parsed once it is saved
+        if content_changed:
+            self.parse_hashtags()
 
 
 class Vote(BaseModel):
@@ -355,14 +554,37 @@ class DigitalTwin(BaseModel):
     llm_url = models.CharField(max_length=255, null=True, blank=True)
     llm_model = models.CharField(max_length=255, null=True, blank=True)
     last_post = models.DateTimeField(null=True, blank=True)
+    # Working memory kept between tasks, see memory.WorkingMemory.to_dict
+    memory = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return self.user_profile.username
 
 
+class ResponseFailure(BaseModel):
+    """
+    A digital twin response to a post that could not be generated, recorded
+    instead of a reply post once retrying gave up or the error was permanent.
+    """
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="response_failures",
+    )
+    digital_twin = models.ForeignKey(DigitalTwin, on_delete=models.CASCADE)
+    error = models.TextField()
+    is_transient = models.BooleanField(default=False)
+    attempts = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.digital_twin} on {self.post_id}: {self.error[:50]}"
+
+
 class Hashtag(BaseModel):
     """
-    Hashtag model.
+    Hashtag of a post, one row per post and tag. Replaced by Tag and PostTag;
+    existing rows are copied over with the backfill_tags command.
     """
 
     tag = models.CharField(max_length=255)
@@ -372,6 +594,69 @@ class Hashtag(BaseModel):
         return f"#{self.tag}, {self.post.id}"
 
 
+class Tag(BaseModel):
+    """
+    A hashtag, stored once and linked to its posts through PostTag.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class PostTag(BaseModel):
+    """
+    Link between a post and a tag in its content.
+    """
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            # Also the index of the posts with a tag
+            models.UniqueConstraint(fields=["tag", "post"], name="post_tag_unique"),
+        ]
+
+    def __str__(self):
+        return f"#{self.tag.name}, {self.post_id}"
+
+    @classmethod
+    def link(cls, posts):
+        """
+        Links saved posts to the tags of the hashtags in their content. Existing
+        links are kept, also those of hashtags no longer in the content.
+
+        Args:
+            posts: List of saved Post instances
+        """
+        cls.link_names({post.pk: Post.find_hashtags(post.content) for post in posts})
+
+    @classmethod
+    def link_names(cls, post_names):
+        """
+        Links posts to tags by name, with one insert for missing tags and one
+        for the links, skipping links that already exist.
+
+        Args:
+            post_names: Dict of post ids to lists of tag names
+        """
+        names = sorted({name for names in post_names.values() for name in names})
+        if not names:
+            return
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list("name", "id"))
+        cls.objects.bulk_create(
+            [
+                cls(post_id=post_id, tag_id=tag_ids[name])
+                for post_id, names in post_names.items()
+                for name in names
+            ],
+            ignore_conflicts=True,
+        )
+
+
 class Notification(BaseModel):
     """
     Notification model.
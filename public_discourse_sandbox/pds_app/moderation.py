@@ -0,0 +1,98 @@
+"""
+Batched profanity screening of posts.
+
+New posts are scored asynchronously: Post.save marks them with
+needs_screening and the screen_pending_posts task scores them in batches,
+vectorizing many texts per model call. Experiments with the
+"prepublication_screening" option are screened synchronously in Post.save
+instead. The threshold is taken from the "profanity_threshold" experiment
+option.
+"""
+
+import logging
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from .models import Post
+from .utils import PROFANITY_THRESHOLD
+from .utils import profanity_scores
+
+logger = logging.getLogger(__name__)
+
+
+def _unchanged(posts):
+    """
+    Returns a queryset of the posts whose content is still the one they were
+    scored with.
+    """
+    if not posts:
+        return Post.all_objects.none()
+    return Post.all_objects.filter(
+        reduce(or_, (Q(id=post.id, content=post.content) for post in posts)),
+    )
+
+
+def screen_posts(posts, unflag=False):
+    """
+    Score a batch of posts for profanity and write is_flagged back in bulk.
+    Posts edited in the meantime are left as they are, still queued for
+    screening of their new content.
+
+    Args:
+        posts: A Post queryset, already limited to the batch size
+        unflag: Whether to also clear is_flagged on posts scoring below the
+            threshold, e.g. when re-scoring after the threshold changed
+
+    Returns:
+        The number of posts screened
+    """
+    posts = list(
+        posts.select_related("experiment").only(
+            "id",
+            "content",
+            "experiment__options",
+        ),
+    )
+    if not posts:
+        return 0
+
+    scores = profanity_scores([post.content or "" for post in posts])
+    flagged = []
+    clean = []
+    for post, score in zip(posts, scores):
+        threshold = post.experiment.get_option(
+            "profanity_threshold", PROFANITY_THRESHOLD
+        )
+        if post.content and score > threshold:
+            flagged.append(post)
+        else:
+            clean.append(post)
+
+    _unchanged(flagged).update(is_flagged=True, needs_screening=False)
+    if unflag:
+        _unchanged(clean).update(is_flagged=False, needs_screening=False)
+    else:
+        _unchanged(clean).update(needs_screening=False)
+
+    logger.info(f"Screened {len(posts)} posts, {len(flagged)} flagged")
+    return len(posts)
+
+
+def screen_pending_posts(batch_size=500):
+    """
+    Screen all posts waiting to be screened, oldest first, in batches.
+
+    Returns:
+        The number of posts screened
+    """
+    total = 0
+    while True:
+        pending = Post.all_objects.filter(needs_screening=True).order_by(
+            "created_date",
+        )[:batch_size]
+        screened = screen_posts(pending)
+        total += screened
+        if screened < batch_size:
+            return total
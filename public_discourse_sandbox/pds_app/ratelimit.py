@@ -0,0 +1,275 @@
+"""
+Rate limiting of LLM requests per endpoint and API key.
+
+Each (base_url, api_key) pair has two token buckets refilled continuously:
+one for requests per minute and one for tokens per minute. Budgets are set
+per base_url in the LLM_RATE_LIMITS setting, e.g.
+
+    LLM_RATE_LIMITS = {
+        "default": {"rpm": 500, "tpm": 200000},
+        "http://vllm:8000/v1": {"rpm": 60},
+    }
+
+Endpoints without a budget are not limited. Callers wait for capacity for
+up to LLM_RATE_LIMIT_MAX_WAIT seconds; beyond that RateLimitExceeded is
+raised so Celery tasks can reschedule with retry(countdown=...). The time
+spent waiting and calling is recorded per endpoint, see metrics().
+
+The bucket store is set with the LLM_RATE_LIMITER setting, a dotted path to
+one of the backends below.
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when an LLM request would have to wait longer than allowed.
+    """
+
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit for {key} exceeded, retry in {retry_after:.1f}s")
+
+
+class InMemoryRateLimiter:
+    """
+    Process-local token buckets, used in tests and single-process setups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._metrics = defaultdict(lambda: defaultdict(float))
+
+    def acquire(self, key, budgets, now=None):
+        """
+        Takes the requested amount from every bucket if all have enough.
+
+        Args:
+            key: Rate limit key of the endpoint
+            budgets: List of (name, per minute budget, amount) tuples
+            now: Current time in seconds (default: time.time())
+
+        Returns:
+            0 if acquired, otherwise the seconds until there will be capacity
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            levels = {}
+            wait = 0.0
+            for name, per_minute, amount in budgets:
+                level, updated = self._buckets.get((key, name), (per_minute, now))
+                level = min(per_minute, level + (now - updated) * per_minute / 60)
+                levels[name] = level
+                if level < amount:
+                    wait = max(wait, (amount - level) * 60 / per_minute)
+            if wait:
+                return wait
+            for name, _, amount in budgets:
+                self._buckets[(key, name)] = (levels[name] - amount, now)
+            return 0.0
+
+    def record(self, key, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._metrics[key][name] += value
+
+    def metrics(self, key):
+        with self._lock:
+            return dict(self._metrics.get(key, {}))
+
+
+class RedisRateLimiter:
+    """
+    Token buckets in Redis, shared by all web and Celery worker processes.
+    The check and update run atomically in a Lua script.
+    """
+
+    key_prefix = "pds:ratelimit:"
+    metrics_prefix = "pds:llm-metrics:"
+
+    # KEYS: one hash per bucket. ARGV: now, then per minute budget and amount
+    # for every bucket. Returns 0 if acquired, else the seconds to wait.
+    script = """
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    local wait = 0
+    for i, key in ipairs(KEYS) do
+        local per_minute = tonumber(ARGV[i * 2])
+        local amount = tonumber(ARGV[i * 2 + 1])
+        local state = redis.call("HMGET", key, "level", "updated")
+        local level = tonumber(state[1]) or per_minute
+        local updated = tonumber(state[2]) or now
+        level = math.min(per_minute, level + (now - updated) * per_minute / 60)
+        levels[i] = level
+        if level < amount then
+            wait = math.max(wait, (amount - level) * 60 / per_minute)
+        end
+    end
+    if wait > 0 then
+        return tostring(wait)
+    end
+    for i, key in ipairs(KEYS) do
+        local amount = tonumber(ARGV[i * 2 + 1])
+        redis.call("HSET", key, "level", levels[i] - amount, "updated", now)
+        redis.call("EXPIRE", key, 120)
+    end
+    return "0"
+    """
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+        self._acquire = self.client.register_script(self.script)
+
+    def acquire(self, key, budgets, now=None):
+        now = time.time() if now is None else now
+        keys = [f"{self.key_prefix}{key}:{name}" for name, _, _ in budgets]
+        args = [now]
+        for _, per_minute, amount in budgets:
+            args += [per_minute, amount]
+        return float(self._acquire(keys=keys, args=args))
+
+    def record(self, key, **values):
+        pipe = self.client.pipeline()
+        for name, value in values.items():
+            pipe.hincrbyfloat(f"{self.metrics_prefix}{key}", name, value)
+        pipe.execute()
+
+    def metrics(self, key):
+        values = self.client.hgetall(f"{self.metrics_prefix}{key}")
+        return {name.decode(): float(value) for name, value in values.items()}
+
+
+@functools.cache
+def _load_limiter(path):
+    return import_string(path)()
+
+
+def get_rate_limiter():
+    """
+    Return the configured rate limiter, or None if rate limiting is disabled.
+    """
+    path = getattr(settings, "LLM_RATE_LIMITER", None)
+    return _load_limiter(path) if path else None
+
+
+def rate_limit_key(base_url, api_key):
+    """
+    Returns the rate limit key of an endpoint. The API key is hashed so it
+    isn't stored in Redis.
+    """
+    key_hash = hashlib.sha256((api_key or "").encode()).hexdigest()[:12]
+    return f"{base_url}|{key_hash}"
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    Roughly estimates the tokens a chat completion uses: about four characters
+    per prompt token, plus the completion tokens allowed.
+    """
+    prompt_tokens = sum(len(message["content"] or "") for message in messages) // 4
+    return prompt_tokens + (max_tokens or 256)
+
+
+def metrics(base_url, api_key):
+    """
+    Returns the recorded metrics of an endpoint: calls, throttled requests,
+    and the seconds spent waiting for capacity and calling the LLM.
+    """
+    limiter = get_rate_limiter()
+    return limiter.metrics(rate_limit_key(base_url, api_key)) if limiter else {}
+
+
+class LLMRateLimit:
+    """
+    Context manager wrapping one LLM request. Waits for capacity on entry and
+    records the time spent waiting and calling. Works with `with` and
+    `async with`; the async form sleeps without blocking the event loop.
+
+    Args:
+        base_url: Base URL of the LLM endpoint
+        api_key: API key used for the endpoint
+        tokens: Estimated tokens of the request, see estimate_tokens()
+        max_wait: Seconds to wait at most before raising RateLimitExceeded
+            (default: LLM_RATE_LIMIT_MAX_WAIT)
+    """
+
+    def __init__(self, base_url, api_key, tokens, max_wait=None):
+        self.limiter = get_rate_limiter()
+        self.base_url = base_url
+        self.key = rate_limit_key(base_url, api_key)
+        self.tokens = tokens
+        if max_wait is None:
+            max_wait = getattr(settings, "LLM_RATE_LIMIT_MAX_WAIT", 30)
+        self.max_wait = max_wait
+        self.waited = 0.0
+        self.started = None
+
+    def _budgets(self):
+        limits = getattr(settings, "LLM_RATE_LIMITS", {})
+        budget = limits.get(self.base_url, limits.get("default", {}))
+        budgets = []
+        if budget.get("rpm"):
+            budgets.append(("rpm", budget["rpm"], 1))
+        if budget.get("tpm"):
+            budgets.append(("tpm", budget["tpm"], min(self.tokens, budget["tpm"])))
+        return budgets
+
+    def _next_wait(self):
+        """
+        Returns the seconds to sleep before trying again, 0 once acquired.
+        """
+        budgets = self._budgets() if self.limiter else []
+        if not budgets:
+            return 0
+        wait = self.limiter.acquire(self.key, budgets)
+        if wait and self.waited + wait > self.max_wait:
+            self.limiter.record(self.key, throttled=1, wait_seconds=self.waited)
+            raise RateLimitExceeded(self.key, wait)
+        return wait
+
+    def _start(self):
+        self.started = time.monotonic()
+
+    def _finish(self):
+        if self.limiter:
+            self.limiter.record(
+                self.key,
+                calls=1,
+                wait_seconds=self.waited,
+                call_seconds=time.monotonic() - self.started,
+            )
+
+    def __enter__(self):
+        while wait := self._next_wait():
+            time.sleep(wait)
+            self.waited += wait
+        self._start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._finish()
+
+    async def __aenter__(self):
+        while wait := self._next_wait():
+            await asyncio.sleep(wait)
+            self.waited += wait
+        self._start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._finish()
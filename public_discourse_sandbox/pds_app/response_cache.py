@@ -0,0 +1,186 @@
+"""
+Per-experiment cache of LLM responses.
+
+Replaying a scenario with the same personas, posts and context sends the
+same messages to the LLM again. Experiments with the "llm_response_cache"
+option answer such requests from a cache keyed on (model, base_url,
+messages) instead. Entries expire after the "llm_response_cache_ttl" option
+(in seconds) and the oldest entries are evicted once an experiment has more
+than "llm_response_cache_size" of them. Cache hits are logged with the
+[llm-cache-hit] tag so it stays clear which posts were not freshly generated.
+
+The store is set with the LLM_RESPONSE_CACHE_STORE setting, a dotted path to
+one of the backends below.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryResponseStore:
+    """
+    Process-local response store, used in tests and single-process setups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = defaultdict(OrderedDict)
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries[namespace].get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[namespace][key]
+                return None
+            return value
+
+    def set(self, namespace, key, value, timeout, max_entries):
+        with self._lock:
+            entries = self._entries[namespace]
+            entries[key] = (value, time.time() + timeout)
+            entries.move_to_end(key)
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._entries.pop(namespace, None)
+
+
+class RedisResponseStore:
+    """
+    Response store in Redis. Each entry is a key with an expiry; a sorted set
+    per namespace orders the entries by insertion time for size eviction.
+    """
+
+    key_prefix = "pds:llm-response:"
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+
+    def _index(self, namespace):
+        return f"{self.key_prefix}{namespace}"
+
+    def _key(self, namespace, key):
+        return f"{self.key_prefix}{namespace}:{key}"
+
+    def get(self, namespace, key):
+        value = self.client.get(self._key(namespace, key))
+        return value.decode() if value is not None else None
+
+    def set(self, namespace, key, value, timeout, max_entries):
+        index = self._index(namespace)
+        pipe = self.client.pipeline()
+        pipe.set(self._key(namespace, key), value, ex=int(timeout))
+        pipe.zadd(index, {key: time.time()})
+        pipe.expire(index, int(timeout))
+        pipe.zrange(index, 0, -max_entries - 1)
+        evicted = pipe.execute()[-1]
+        if evicted:
+            pipe = self.client.pipeline()
+            pipe.delete(*(self._key(namespace, k.decode()) for k in evicted))
+            pipe.zrem(index, *evicted)
+            pipe.execute()
+
+    def clear(self, namespace):
+        index = self._index(namespace)
+        keys = self.client.zrange(index, 0, -1)
+        self.client.delete(index, *(self._key(namespace, k.decode()) for k in keys))
+
+
+@functools.cache
+def _load_store(path):
+    return import_string(path)()
+
+
+def _get_store():
+    path = getattr(settings, "LLM_RESPONSE_CACHE_STORE", None)
+    return _load_store(path) if path else None
+
+
+class ResponseCache:
+    """
+    The LLM response cache of one experiment, see get_response_cache().
+    """
+
+    def __init__(self, store, experiment_id, timeout, max_entries):
+        self.store = store
+        self.namespace = str(experiment_id)
+        self.timeout = timeout
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(model, base_url, messages):
+        data = json.dumps([model, base_url, messages], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, model, base_url, messages):
+        """
+        Returns the cached response to messages, or None.
+        """
+        key = self.key(model, base_url, messages)
+        try:
+            response = self.store.get(self.namespace, key)
+        except redis.RedisError as e:
+            logger.warning(f"LLM response cache unavailable: {e!s}")
+            return None
+        if response is not None:
+            logger.info(
+                f"[llm-cache-hit] experiment={self.namespace} model={model} "
+                f"base_url={base_url} key={key[:12]}"
+            )
+        return response
+
+    def set(self, model, base_url, messages, response):
+        if not response:
+            return
+        try:
+            self.store.set(
+                self.namespace,
+                self.key(model, base_url, messages),
+                response,
+                self.timeout,
+                self.max_entries,
+            )
+        except redis.RedisError as e:
+            logger.warning(f"LLM response cache unavailable: {e!s}")
+
+    def clear(self):
+        self.store.clear(self.namespace)
+
+
+def get_response_cache(experiment):
+    """
+    Returns the LLM response cache of an experiment, or None if the
+    experiment doesn't have the "llm_response_cache" option enabled.
+    """
+    store = _get_store()
+    if not store or not experiment:
+        return None
+    if not experiment.get_option("llm_response_cache"):
+        return None
+    return ResponseCache(
+        store,
+        experiment.id,
+        experiment.get_option(
+            "llm_response_cache_ttl", settings.LLM_RESPONSE_CACHE_TTL
+        ),
+        experiment.get_option(
+            "llm_response_cache_size", settings.LLM_RESPONSE_CACHE_SIZE
+        ),
+    )
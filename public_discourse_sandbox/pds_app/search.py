@@ -0,0 +1,213 @@
+"""
+Search of posts and user profiles within an experiment.
+
+On PostgreSQL, posts are matched against Post.search_vector, a tsvector of
+the content kept up to date by a database trigger (see migration 0030) and
+indexed with GIN, and ranked with ts_rank. Hashtags are part of the content,
+so "#sandbox" and "sandbox" find the same posts. User profiles are matched on
+username and display name, which have trigram indexes so substring and
+handle prefix searches don't scan the experiment's profiles.
+
+Other databases, e.g. SQLite in tests, get the same interface from a small
+in-process inverted index of the experiment's posts. Words are reduced to a
+light stem, so plurals match like with PostgreSQL's english configuration.
+The index is kept per process and rebuilt when the experiment's posts change,
+as seen from their number, total content length and latest modification.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from collections import OrderedDict
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.db import connection
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import Max
+from django.db.models import Q
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+from django.db.models.functions import Length
+
+from .models import Post
+from .models import UserProfile
+
+SEARCH_CONFIG = "english"
+# Experiments whose fallback index is kept in each process
+INDEX_CACHE_SIZE = 16
+
+_token_re = re.compile(r"\w+")
+_indexes_lock = threading.Lock()
+_indexes = OrderedDict()
+
+
+def uses_postgres():
+    return connection.vendor == "postgresql"
+
+
+def stem(word):
+    """
+    Reduces an English plural to its singular, e.g. "sandboxes" to
+    "sandbox" and "stories" to "story".
+    """
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """
+    Returns the stemmed lowercase words of text, the terms of the inverted
+    index.
+    """
+    return [stem(word) for word in _token_re.findall((text or "").lower())]
+
+
+class InvertedIndex:
+    """
+    In-process inverted index of documents, ranked by tf-idf. Used in place
+    of PostgreSQL full-text search on other databases.
+
+    Args:
+        documents: Iterable of (id, text) pairs, equally good matches are
+            returned in this order
+    """
+
+    def __init__(self, documents):
+        self.postings = defaultdict(dict)
+        self.order = {}
+        self.size = 0
+        for doc_id, text in documents:
+            self.order[doc_id] = self.size
+            self.size += 1
+            for term, count in Counter(tokenize(text)).items():
+                self.postings[term][doc_id] = count
+
+    def search(self, query):
+        """
+        Returns the ids of the documents containing every term of query,
+        best match first.
+        """
+        terms = set(tokenize(query))
+        if not terms or any(term not in self.postings for term in terms):
+            return []
+        matches = set.intersection(*(set(self.postings[term]) for term in terms))
+        scores = {
+            doc_id: sum(
+                self.postings[term][doc_id]
+                * math.log(1 + self.size / len(self.postings[term]))
+                for term in terms
+            )
+            for doc_id in matches
+        }
+        return sorted(matches, key=lambda doc_id: (-scores[doc_id], self.order[doc_id]))
+
+
+def get_post_index(experiment):
+    """
+    Returns the inverted index of all posts of an experiment, deleted ones
+    included, newest first. Rebuilt only if the posts changed since it was
+    built.
+    """
+    posts = Post.all_objects.filter(experiment=experiment)
+    fingerprint = tuple(
+        posts.aggregate(
+            count=Count("id"),
+            modified=Max("last_modified"),
+            length=Sum(Length("content")),
+        ).values()
+    )
+    with _indexes_lock:
+        cached = _indexes.get(experiment.id)
+        if cached and cached[0] == fingerprint:
+            _indexes.move_to_end(experiment.id)
+            return cached[1]
+    index = InvertedIndex(
+        posts.values_list("id", "content").order_by("-created_date", "-id")
+    )
+    with _indexes_lock:
+        _indexes[experiment.id] = (fingerprint, index)
+        _indexes.move_to_end(experiment.id)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear_post_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def _in_order(queryset, ids):
+    """
+    Filters queryset to ids and orders it like ids.
+    """
+    if not ids:
+        return queryset.none()
+    order = Case(
+        *(When(id=doc_id, then=Value(i)) for i, doc_id in enumerate(ids)),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(id__in=ids).order_by(order)
+
+
+def search_posts(experiment, query, posts=None):
+    """
+    Returns the posts of an experiment matching a search query, best match
+    first, then newest first.
+
+    Args:
+        experiment: The experiment to search in
+        query: Search terms, in web search syntax on PostgreSQL ("quoted
+            phrases", -excluded, or)
+        posts: Optional Post queryset to search, e.g. only top-level posts
+            (default: the visible posts)
+    """
+    if posts is None:
+        posts = Post.objects.all()
+    posts = posts.filter(experiment=experiment)
+    if uses_postgres():
+        search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            posts.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-created_date", "-id")
+        )
+    # The index covers all posts of the experiment, _in_order() keeps those
+    # of posts
+    return _in_order(posts, get_post_index(experiment).search(query))
+
+
+def search_user_profiles(experiment, query):
+    """
+    Returns the user profiles of an experiment whose username or display name
+    contains query, those whose username starts with it first.
+    """
+    query = query.lstrip("@")
+    return (
+        UserProfile.objects.filter(
+            Q(display_name__icontains=query) | Q(username__icontains=query),
+            experiment=experiment,
+        )
+        .annotate(
+            is_prefix=Case(
+                When(username__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            ),
+        )
+        .order_by("is_prefix", "username")
+    )
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from rest_framework import serializers
 
 from public_discourse_sandbox.pds_app.models import Experiment
@@ -60,10 +62,12 @@ class PostSerializer(serializers.ModelSerializer):
         ]
 
     def get_hashtags(self, obj):
-        hashtags = obj.hashtag_set.all()
-        return [{"tag": hashtag.tag} for hashtag in hashtags]
+        return [{"tag": tag.name} for tag in obj.tags.all()]
 
     def get_liked_by_user(self, obj):
+        # Feeds annotate vote status for the whole page (see feed.annotate_feed_state)
+        if hasattr(obj, "has_user_voted"):
+            return obj.has_user_voted
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             user_profile = request.user.userprofile_set.filter(
@@ -78,7 +82,9 @@ class PostSerializer(serializers.ModelSerializer):
         return False
 
     def get_reply_count(self, obj):
-        return obj.get_comment_count()
+        if hasattr(obj, "comment_count"):
+            return obj.comment_count
+        return obj.num_comments
 
 
 class PostCommentsSerializer(serializers.ModelSerializer):
@@ -94,18 +100,30 @@ class PostCommentsSerializer(serializers.ModelSerializer):
         if depth <= 0:
             return []
 
-        qs = (
-            Post.objects.filter(parent_post=obj, is_deleted=False)
-            .select_related("user_profile")
-            .order_by("created_date", "id")
-        )
+        # Load the requested levels of the thread once, for the outermost post,
+        # and share the replies grouped by parent with the nested serializers
+        replies_by_parent = self.context.get("replies_by_parent")
+        if replies_by_parent is None:
+            replies_by_parent = defaultdict(list)
+            for reply in obj.get_thread().filter(
+                depth__lte=obj.depth + depth,
+            ).select_related("user_profile"):
+                replies_by_parent[reply.parent_post_id].append(reply)
+
+        replies = replies_by_parent.get(obj.id, [])
 
         limit = self.context.get("children_limit")
         if isinstance(limit, int) and limit > 0:
-            qs = qs[:limit]
+            replies = replies[:limit]
 
         return PostCommentsSerializer(
-            qs, many=True, context={**self.context, "depth": depth - 1}
+            replies,
+            many=True,
+            context={
+                **self.context,
+                "depth": depth - 1,
+                "replies_by_parent": replies_by_parent,
+            },
         ).data
 
 
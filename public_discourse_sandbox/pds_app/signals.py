@@ -1,9 +1,22 @@
 import random
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Post, DigitalTwin
-from .tasks import process_digital_twin_response
+from .counters import count_reply_and_repost
+from .counters import increment_counter
+from .counters import is_author_banned
+from .counters import is_visible
+from .experiment_cache import invalidate_experiment
+from .models import Post, DigitalTwin, Experiment, SocialNetwork, UserProfile, Vote
+from .tasks import process_digital_twin_responses
+from .timeline import fan_out_post
+from .trending import count_added_hashtags
+from .trending import count_hashtags
+from .twin_profile import PROFILE_FIELDS
+from .twin_profile import invalidate_twin_profile
+from .twin_selection import active_twin_ids
+from .twin_selection import invalidate_active_twin_ids
+from .twin_selection import sample_twin_ids
 
 
 @receiver(post_save, sender=Post)
@@ -21,21 +34,158 @@ def handle_post(sender, instance, created, **kwargs):
     """
     # Only process new posts from human users that are top-level (not replies)
     if created and not instance.user_profile.is_digital_twin and instance.depth == 0:
-        # Get all the active bots for the experiment by filtering through the user_profile relationship
-        active_twins = DigitalTwin.objects.filter(
-            is_active=True, user_profile__experiment=instance.user_profile.experiment
-        )
-        # Get a random list of twins in length of the queryset
-        if len(active_twins) > 0:
-            random_length = random.randint(1, len(active_twins))
-            random_twins = random.sample(list(active_twins), random_length)
+        # Get the ids of all the active bots for the experiment
+        active_twin_count = len(active_twin_ids(instance.experiment_id))
+        # Get a random list of twin ids, between one and all of them
+        if active_twin_count > 0:
+            random_length = random.randint(1, active_twin_count)
+            random_twin_ids = sample_twin_ids(random_length, instance.experiment_id)
         else:
-            random_twins = []
+            random_twin_ids = []
 
-        # Define the task to be executed after transaction commit
+        # Define the task to be executed after transaction commit. All twins
+        # respond in one task that makes their LLM requests concurrently.
         def send_tasks():
-            for twin in random_twins:
-                process_digital_twin_response.delay(str(instance.id), str(twin.id))
+            if random_twin_ids:
+                process_digital_twin_responses.delay(str(instance.id), random_twin_ids)
 
         # Schedule the tasks to run after the transaction is committed
         transaction.on_commit(send_tasks)
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    """
+    Signal handler that pushes new top-level posts to the materialized home
+    timelines of the author and their followers once the post is committed.
+    Does nothing unless a timeline store is configured (see timeline.py).
+    """
+    if created and instance.depth == 0:
+        transaction.on_commit(lambda: fan_out_post(instance))
+
+
+@receiver(post_save, sender=Post)
+def count_reply_and_repost_changes(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """
+    Signal handler that keeps num_comments of the parent post and num_shares
+    of the source post in step with the visibility of replies and reposts:
+    incremented for new visible posts and restored ones, decremented for soft
+    deleted ones. Posts of banned users never count.
+    """
+    if created:
+        if is_visible(instance):
+            count_reply_and_repost(instance)
+    elif instance.has_deletion_changed(update_fields):
+        if not is_author_banned(instance):
+            count_reply_and_repost(instance, -1 if instance.is_deleted else 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_reply_and_repost(sender, instance, **kwargs):
+    """
+    Signal handler that decrements the counters of the parent and source
+    posts when a visible post is deleted for good, e.g. from the admin.
+    """
+    if is_visible(instance):
+        count_reply_and_repost(instance, -1)
+
+
+@receiver(post_save, sender=Post)
+def count_trending_hashtags(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """
+    Signal handler that counts the hashtags of a new post, or those added by
+    an edit, towards the trending hashtags of its experiment.
+    """
+    if created:
+        count_hashtags(instance, Post.find_hashtags(instance.content))
+    elif not instance.is_deleted and instance.has_content_changed(update_fields):
+        # Runs before the post is linked to the tags of the new content
+        count_added_hashtags(instance)
+
+
+@receiver(post_save, sender=Vote)
+def count_vote(sender, instance, created, **kwargs):
+    """
+    Signal handler that increments num_upvotes or num_downvotes of the voted post.
+    """
+    if created:
+        field = "num_upvotes" if instance.is_upvote else "num_downvotes"
+        increment_counter(Post, instance.post_id, field)
+
+
+@receiver(post_delete, sender=Vote)
+def uncount_vote(sender, instance, **kwargs):
+    """
+    Signal handler that decrements num_upvotes or num_downvotes when a vote is removed.
+    """
+    field = "num_upvotes" if instance.is_upvote else "num_downvotes"
+    increment_counter(Post, instance.post_id, field, -1)
+
+
+@receiver(post_save, sender=SocialNetwork)
+def count_follow(sender, instance, created, **kwargs):
+    """
+    Signal handler that updates num_followers and num_following for a new follow.
+    """
+    if created:
+        increment_counter(UserProfile, instance.target_node_id, "num_followers")
+        increment_counter(UserProfile, instance.source_node_id, "num_following")
+
+
+@receiver(post_delete, sender=SocialNetwork)
+def uncount_follow(sender, instance, **kwargs):
+    """
+    Signal handler that updates num_followers and num_following for an unfollow.
+    """
+    increment_counter(UserProfile, instance.target_node_id, "num_followers", -1)
+    increment_counter(UserProfile, instance.source_node_id, "num_following", -1)
+
+
+@receiver(post_save, sender=DigitalTwin)
+@receiver(post_delete, sender=DigitalTwin)
+def invalidate_twin(sender, instance, update_fields=None, **kwargs):
+    """
+    Outdate the memoized profile and the cached active twin ids of the
+    experiment of a twin when it changes. Saves of other fields only, like
+    last_post after every twin post, keep both.
+    """
+    if update_fields is not None and not (
+        update_fields & (PROFILE_FIELDS | {"is_active", "user_profile"})
+    ):
+        return
+    invalidate_twin_profile(instance.user_profile_id)
+    experiment_id = (
+        UserProfile.objects.filter(id=instance.user_profile_id)
+        .values_list("experiment_id", flat=True)
+        .first()
+    )
+    invalidate_active_twin_ids(experiment_id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_twin_user_profile(sender, instance, **kwargs):
+    """
+    Outdate the memoized profile of a twin when its user profile changes, and
+    the cached active twin ids of its experiment.
+    """
+    if instance.is_digital_twin:
+        invalidate_twin_profile(instance.id)
+        invalidate_active_twin_ids(instance.experiment_id)
+
+
+@receiver(post_save, sender=Experiment)
+@receiver(post_delete, sender=Experiment)
+def invalidate_cached_experiment(sender, instance, **kwargs):
+    """
+    Outdate the cached snapshot of an experiment when it changes, soft deletes
+    included. It is outdated again once the transaction commits, in case
+    another request cached the old row in between.
+    """
+    identifier = instance.identifier
+    invalidate_experiment(identifier)
+    transaction.on_commit(lambda: invalidate_experiment(identifier))
@@ -1,60 +1,97 @@
 import logging
-import random
 
 from celery import shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
 from django.core import management
 
 from .dt_service import DTService
+from .llm import LLMError
+from .llm import TransientLLMError
 from .models import DigitalTwin
 from .models import Post
+from .models import ResponseFailure
+from .moderation import screen_pending_posts
+from .ratelimit import RateLimitExceeded
+from .twin_selection import sample_twins
+from .utils import profanity_score_cache
 
 logger = logging.getLogger(__name__)
 
 
 def get_random_digitial_twins(count=1, exclude_twin=None, experiment_id=None):
     """Get random active twins, optionally excluding a specific twin and/or filtering by experiment"""
-    active_twins = DigitalTwin.objects.filter(is_active=True)
-    if exclude_twin:
-        active_twins = active_twins.exclude(id=exclude_twin.id)
+    exclude_ids = [exclude_twin.id] if exclude_twin else []
+    selected_twins = sample_twins(count, experiment_id, exclude_ids)
+    logger.info(f"Selected {len(selected_twins)} eligible active twins")
 
-    # Filter by experiment if provided
-    if experiment_id:
-        active_twins = active_twins.filter(user_profile__experiment_id=experiment_id)
+    for twin in selected_twins:
+        logger.info(f"Selected twin: {twin.user_profile.username} (ID: {twin.id})")
 
-    twin_count = active_twins.count()
-    logger.info(f"Found {twin_count} eligible active twins")
+    return selected_twins
 
-    if twin_count == 0:
-        return []
 
-    # Get exactly the specified number of twins, or all available if less
-    count = min(count, twin_count)
-    selected_twins = random.sample(list(active_twins), count)
+def retry_backoff(attempt):
+    """
+    Seconds to wait before retrying a transient LLM failure: exponential in
+    the number of attempts made so far, with full jitter so retries of many
+    twins don't hit a recovering provider all at once.
+    """
+    return get_exponential_backoff_interval(
+        factor=settings.LLM_RETRY_BACKOFF,
+        retries=attempt - 1,
+        maximum=settings.LLM_RETRY_BACKOFF_MAX,
+        full_jitter=True,
+    )
 
-    for twin in selected_twins:
-        logger.info(f"Selected twin: {twin.user_profile.username} (ID: {twin.id})")
 
-    return selected_twins
+def record_response_failures(post, failures, attempts):
+    """
+    Record digital twin responses that won't be retried instead of posting them.
 
+    Args:
+        post: The post the twins failed to respond to
+        failures: List of (twin, LLMError) pairs
+        attempts: Number of attempts made to respond
+    """
+    ResponseFailure.objects.bulk_create(
+        [
+            ResponseFailure(
+                post=post,
+                digital_twin=twin,
+                error=str(error),
+                is_transient=isinstance(error, TransientLLMError),
+                attempts=attempts,
+            )
+            for twin, error in failures
+        ],
+    )
 
-@shared_task
-def process_digital_twin_response(post_id: str, twin_id: str):
+
+@shared_task(bind=True, max_retries=None)
+def process_digital_twin_response(self, post_id: str, twin_id: str, attempt=1):
     """
     Celery task to process bot response to a post.
+    Retried later if the twin's LLM endpoint is rate limited, and with
+    exponential backoff after transient LLM failures. Permanent failures, and
+    transient ones after LLM_RESPONSE_MAX_ATTEMPTS, are recorded as a
+    ResponseFailure instead of a post.
     Args:
         post_id (str): UUID of the post to respond to
         twin_id (str): UUID of the digital twin that will respond
+        attempt (int): Number of this attempt, counting transient failures
     """
     logger.info(
         f"Starting bot response processing for post {post_id} with twin {twin_id}"
     )
-    print(f"Starting bot response processing for post {post_id} with twin {twin_id}")
 
     try:
         # First fetch the post and twin using their IDs
         try:
             post = Post.objects.get(id=post_id)
-            twin = DigitalTwin.objects.get(id=twin_id)
+            twin = DigitalTwin.objects.select_related(
+                "user_profile__experiment"
+            ).get(id=twin_id)
         except (Post.DoesNotExist, DigitalTwin.DoesNotExist) as e:
             logger.error(f"Post or Twin not found: {e!s}")
             return
@@ -66,14 +103,125 @@ def process_digital_twin_response(post_id: str, twin_id: str):
         response = dt_service.respond_to_post(twin, post)
         logger.info(f"Generated digital twin response to post {post.id}")
 
+    except RateLimitExceeded as e:
+        logger.info(f"{e!s}, rescheduling response to post {post_id}")
+        raise self.retry(countdown=e.retry_after)
+    except LLMError as e:
+        if (
+            isinstance(e, TransientLLMError)
+            and attempt < settings.LLM_RESPONSE_MAX_ATTEMPTS
+        ):
+            countdown = retry_backoff(attempt)
+            logger.warning(
+                f"Response of twin {twin_id} to post {post_id} failed in attempt "
+                f"{attempt}, retrying in {countdown:.1f}s: {e!s}"
+            )
+            raise self.retry(
+                kwargs={"attempt": attempt + 1},
+                countdown=countdown,
+            )
+        logger.exception(
+            f"Response of twin {twin_id} to post {post_id} failed after "
+            f"{attempt} attempts"
+        )
+        record_response_failures(post, [(twin, e)], attempt)
     except Exception as e:
         logger.error(f"Error processing bot response: {e!s}", exc_info=True)
 
 
-@shared_task
-def generate_digital_twin_post(experiment_id=None, force=False):
+@shared_task(bind=True, max_retries=None)
+def process_digital_twin_responses(
+    self, post_id: str, twin_ids: list[str], attempt=1
+):
+    """
+    Celery task to process the responses of several bots to a post at once.
+    The LLM requests of all twins are made concurrently, so one worker slot
+    handles the whole batch. Successful responses are saved right away; twins
+    whose LLM endpoint is rate limited or failed transiently are retried later
+    in separate tasks, the latter with exponential backoff and the former
+    without counting towards LLM_RESPONSE_MAX_ATTEMPTS. Permanent failures,
+    and transient ones after LLM_RESPONSE_MAX_ATTEMPTS, are recorded as
+    ResponseFailures instead of posts.
+    Args:
+        post_id (str): UUID of the post to respond to
+        twin_ids (list[str]): UUIDs of the digital twins that will respond
+        attempt (int): Number of this attempt, counting transient failures
+    """
+    logger.info(f"Starting {len(twin_ids)} bot responses for post {post_id}")
+
+    try:
+        try:
+            post = Post.objects.select_related(
+                "user_profile", "experiment", "repost_source"
+            ).get(id=post_id)
+        except Post.DoesNotExist as e:
+            logger.error(f"Post not found: {e!s}")
+            return
+
+        twins = list(
+            DigitalTwin.objects.filter(id__in=twin_ids).select_related(
+                "user_profile__experiment"
+            ),
+        )
+
+        dt_service = DTService()
+        responses = dt_service.respond_to_post_batch(twins, post)
+        logger.info(f"Generated {len(responses)} digital twin responses to post {post.id}")
+
+    except Exception as e:
+        logger.error(f"Error processing bot responses: {e!s}", exc_info=True)
+        return
+
+    retry_twins = []
+    failures = []
+    for twin, error in dt_service.failures:
+        if (
+            isinstance(error, TransientLLMError)
+            and attempt < settings.LLM_RESPONSE_MAX_ATTEMPTS
+        ):
+            retry_twins.append(twin)
+        else:
+            logger.warning(
+                f"Response of twin {twin.id} to post {post_id} failed after "
+                f"{attempt} attempts: {error!s}"
+            )
+            failures.append((twin, error))
+    record_response_failures(post, failures, attempt)
+
+    # Rate limited twins didn't fail, so they keep their attempt count like
+    # in process_digital_twin_response, while the failed twins use up one
+    retries = []
+    if dt_service.deferred_twins:
+        retries.append(
+            (dt_service.deferred_twins, attempt, dt_service.retry_after),
+        )
+    if retry_twins:
+        retries.append((retry_twins, attempt + 1, retry_backoff(attempt)))
+    for index, (twins, next_attempt, countdown) in enumerate(retries):
+        retry_ids = [str(twin.id) for twin in twins]
+        logger.info(
+            f"Rescheduling {len(retry_ids)} responses to post {post_id} "
+            f"in {countdown:.1f}s"
+        )
+        if index < len(retries) - 1:
+            process_digital_twin_responses.apply_async(
+                args=[post_id, retry_ids],
+                kwargs={"attempt": next_attempt},
+                countdown=countdown,
+            )
+        else:
+            raise self.retry(
+                args=[post_id, retry_ids],
+                kwargs={"attempt": next_attempt},
+                countdown=countdown,
+            )
+
+
+@shared_task(bind=True, max_retries=None)
+def generate_digital_twin_post(self, experiment_id=None, force=False):
     """
     Celery task to make a DigitalTwin generate a new original post (not a reply).
+    Retried later if the twin's LLM endpoint is rate limited.
 
     Args:
         experiment_id (str, optional): UUID of the experiment to filter twins by.
@@ -105,11 +253,119 @@ def generate_digital_twin_post(experiment_id=None, force=False):
 
         return post_id
 
+    except RateLimitExceeded as e:
+        logger.info(f"{e!s}, rescheduling digital twin post")
+        raise self.retry(countdown=e.retry_after)
     except Exception as e:
         logger.error(f"Error generating digital twin post: {e!s}", exc_info=True)
         return None
 
 
+@shared_task
+def schedule_digital_twin_posts(experiment_ids=None, batch_size=None):
+    """
+    Periodic Celery task deciding which digital twins post organically, for
+    all experiments in one pass. The recent activity window of each
+    experiment is loaded once, should_twin_post() is evaluated in memory for
+    every active twin, and the twins that post are dispatched to
+    generate_digital_twin_posts in batches. Runs hourly from
+    CELERY_BEAT_SCHEDULE, in place of one generate_digital_twin_post periodic
+    task per experiment.
+
+    Args:
+        experiment_ids (list, optional): UUIDs of the experiments to schedule,
+            all experiments if None
+        batch_size (int, optional): Twins per generate_digital_twin_posts task
+            (default: settings.TWIN_POST_BATCH_SIZE)
+
+    Returns:
+        int: Number of twins dispatched to post
+    """
+    batch_size = batch_size or settings.TWIN_POST_BATCH_SIZE
+    twins = (
+        DigitalTwin.objects.filter(
+            is_active=True, user_profile__experiment__is_deleted=False
+        )
+        .select_related("user_profile")
+        .defer("persona", "memory")
+    )
+    if experiment_ids:
+        twins = twins.filter(user_profile__experiment_id__in=experiment_ids)
+
+    dt_service = DTService()
+    posting_ids = [str(twin.id) for twin in twins if dt_service.should_twin_post(twin)]
+    for start in range(0, len(posting_ids), batch_size):
+        generate_digital_twin_posts.delay(posting_ids[start : start + batch_size])
+
+    logger.info(
+        f"Scheduled {len(posting_ids)} digital twin posts across "
+        f"{len(dt_service.recent_activity)} experiments"
+    )
+    return len(posting_ids)
+
+
+@shared_task(bind=True, max_retries=None)
+def generate_digital_twin_posts(self, twin_ids):
+    """
+    Celery task making each of the given digital twins generate an original
+    post, bypassing the should_post check already made by
+    schedule_digital_twin_posts. Twins of the same experiment share its
+    recent activity window. Twins whose LLM endpoint is rate limited are
+    retried later.
+
+    Args:
+        twin_ids (list): UUIDs of the twins that post
+
+    Returns:
+        list: IDs of the created posts
+    """
+    twins = DigitalTwin.objects.filter(id__in=twin_ids, is_active=True).select_related(
+        "user_profile__experiment"
+    )
+    recent_activity = {}
+    post_ids = []
+    deferred_ids = []
+    retry_after = 0
+    for twin in twins:
+        dt_service = DTService()
+        dt_service.recent_activity = recent_activity
+        try:
+            post_id = dt_service.create_original_post(twin, force=True)
+        except RateLimitExceeded as e:
+            deferred_ids.append(str(twin.id))
+            retry_after = max(retry_after, e.retry_after)
+            continue
+        if post_id:
+            post_ids.append(post_id)
+
+    if deferred_ids:
+        logger.info(
+            f"Rate limited, rescheduling posts of {len(deferred_ids)} twins "
+            f"in {retry_after:.1f}s"
+        )
+        raise self.retry(args=[deferred_ids], countdown=retry_after)
+    return post_ids
+
+
+@shared_task
+def screen_new_posts(batch_size=500):
+    """
+    Celery task to score the profanity of posts waiting to be screened,
+    many posts per model call.
+
+    Args:
+        batch_size (int, optional): Number of posts scored per model call
+    """
+    try:
+        screened = screen_pending_posts(batch_size=batch_size)
+        if screened:
+            logger.info(f"Profanity score cache: {profanity_score_cache.info()}")
+        return screened
+    except Exception as e:
+        logger.error(f"Error screening posts: {e!s}", exc_info=True)
+        return 0
+
+
 @shared_task
 def process_email_notifications():
     try:
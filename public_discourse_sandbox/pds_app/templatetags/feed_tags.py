@@ -0,0 +1,14 @@
+from django import template
+
+from public_discourse_sandbox.pds_app.feed import encode_cursor
+
+register = template.Library()
+
+
+@register.filter
+def feed_cursor(post):
+    """
+    Returns the pagination cursor for a post, used by the "load more" request
+    of the post list to fetch the posts that come after it.
+    """
+    return encode_cursor(post)
@@ -1,11 +1,119 @@
-from django.test import TestCase, Client, override_settings
+import asyncio
+import re
+import threading
+import uuid
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import httpx
+import openai
+from celery.exceptions import Retry
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from public_discourse_sandbox.pds_app.models import Experiment, UserProfile, Post
+from public_discourse_sandbox.pds_app.dt_service import DTService
+from public_discourse_sandbox.pds_app.experiment_cache import clear_experiment_cache
+from public_discourse_sandbox.pds_app.experiment_cache import get_cached_experiment
+from public_discourse_sandbox.pds_app.feed import encode_cursor
+from public_discourse_sandbox.pds_app.llm import clear_llm_clients
+from public_discourse_sandbox.pds_app.llm import PermanentLLMError
+from public_discourse_sandbox.pds_app.llm import TransientLLMError
+from public_discourse_sandbox.pds_app.llm import classify_llm_error
+from public_discourse_sandbox.pds_app.llm import get_llm_client
+from public_discourse_sandbox.pds_app.llm_stub import StubLLM
+from public_discourse_sandbox.pds_app.memory import WorkingMemory
+from public_discourse_sandbox.pds_app.llm_stub import make_server
+from public_discourse_sandbox.pds_app.ratelimit import InMemoryRateLimiter
+from public_discourse_sandbox.pds_app.ratelimit import LLMRateLimit
+from public_discourse_sandbox.pds_app.ratelimit import RateLimitExceeded
+from public_discourse_sandbox.pds_app.ratelimit import _load_limiter
+from public_discourse_sandbox.pds_app.ratelimit import metrics
+from public_discourse_sandbox.pds_app.models import (
+    AuthApiToken,
+    DigitalTwin,
+    Experiment,
+    Hashtag,
+    Notification,
+    UserProfile,
+    Post,
+    ResponseFailure,
+    SocialNetwork,
+    Tag,
+    Vote,
+)
+from public_discourse_sandbox.pds_app.response_cache import InMemoryResponseStore
+from public_discourse_sandbox.pds_app.response_cache import ResponseCache
+from public_discourse_sandbox.pds_app.response_cache import _load_store as _load_response_store
+from public_discourse_sandbox.pds_app.search import clear_post_indexes
+from public_discourse_sandbox.pds_app.search import search_posts
+from public_discourse_sandbox.pds_app.search import tokenize
+from public_discourse_sandbox.pds_app.serializers import PostCommentsSerializer
+from public_discourse_sandbox.pds_app.tasks import process_digital_twin_response
+from public_discourse_sandbox.pds_app.tasks import process_digital_twin_responses
+from public_discourse_sandbox.pds_app.tasks import generate_digital_twin_posts
+from public_discourse_sandbox.pds_app.tasks import schedule_digital_twin_posts
+from public_discourse_sandbox.pds_app.tasks import screen_new_posts
+from public_discourse_sandbox.pds_app.timeline import get_timeline_store
+from public_discourse_sandbox.pds_app.trending import _load_store as _load_trending_store
+from public_discourse_sandbox.pds_app.trending import compute_trending
+from public_discourse_sandbox.pds_app.trending import get_trending_hashtags
+from public_discourse_sandbox.pds_app.trending import invalidate_trending
+from public_discourse_sandbox.pds_app.trending import uncount_post
+from public_discourse_sandbox.pds_app.twin_profile import clear_twin_profiles
+from public_discourse_sandbox.pds_app.twin_profile import get_twin_profile
+from public_discourse_sandbox.pds_app.twin_profile import TwinProfile
+from public_discourse_sandbox.pds_app.twin_selection import active_twin_ids
+from public_discourse_sandbox.pds_app.twin_selection import sample_twins
+from public_discourse_sandbox.pds_app.utils import check_profanity
+from public_discourse_sandbox.pds_app.utils import profanity_score_cache
+from public_discourse_sandbox.pds_app.utils import profanity_scores
+from public_discourse_sandbox.pds_app.timeline import _load_store
+from public_discourse_sandbox.pds_app.views import get_active_posts
+from public_discourse_sandbox.pds_app.views import get_home_feed_posts
 from django.core.exceptions import PermissionDenied
 
 User = get_user_model()
 
+
+class FakeStream:
+    """A streamed chat completion of content, one chunk per word."""
+
+    def __init__(self, content):
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=w))])
+            for w in re.findall(r"\S+\s*", content)
+        ]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncFakeStream(FakeStream):
+    """The async counterpart of FakeStream."""
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
 """
 docker compose -f docker-compose.local.yml run --rm django python manage.py test pds_app
 """
@@ -22,6 +130,7 @@ docker compose -f docker-compose.local.yml run --rm django python manage.py test
         "django.middleware.common.CommonMiddleware",
         "django.middleware.csrf.CsrfViewMiddleware",
         "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "public_discourse_sandbox.pds_app.middleware.ExperimentContextMiddleware",
         "django.contrib.messages.middleware.MessageMiddleware",
         "django.middleware.clickjacking.XFrameOptionsMiddleware",
         "allauth.account.middleware.AccountMiddleware",
@@ -642,3 +751,1838 @@ class URLPatternTests(PDSTestCase):
         """Test 404 error handling."""
         self.client.force_login(self.user)
         # TODO: Implement test for 404 handling
+
+
+class FeedTestCase(PDSTestCase):
+    """Base test class with an experiment, a viewer and a post author."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.experiment = Experiment.objects.create(
+            name="Test Experiment", description="Test Description"
+        )
+        self.user = User.objects.create_user(
+            email="test@example.com", password="testpass123"
+        )
+        self.author = User.objects.create_user(
+            email="author@example.com", password="testpass123"
+        )
+        self.profile = UserProfile.objects.create(
+            user=self.user,
+            experiment=self.experiment,
+            username="testuser",
+            display_name="Test User",
+        )
+        self.author_profile = UserProfile.objects.create(
+            user=self.author,
+            experiment=self.experiment,
+            username="author",
+            display_name="Author",
+        )
+        self.factory = RequestFactory()
+
+    def _create_post(self, profile, content="Test post content", parent=None):
+        return Post.objects.create(
+            user_profile=profile,
+            experiment=self.experiment,
+            content=content,
+            parent_post=parent,
+            depth=parent.depth + 1 if parent else 0,
+        )
+
+    def _get_page(self):
+        request = self.factory.get("/")
+        request.user = self.user
+        return list(get_active_posts(request, experiment=self.experiment))
+
+
+class FeedAnnotationTests(FeedTestCase):
+    """Test cases for the feed decoration layer."""
+
+    def test_feed_state_values(self):
+        """Test that comment count, vote status and follow state are annotated."""
+        followed_post = self._create_post(self.author_profile)
+        own_post = self._create_post(self.profile)
+        self._create_post(self.profile, content="Reply", parent=followed_post)
+        deleted_reply = self._create_post(
+            self.profile, content="Deleted", parent=followed_post
+        )
+        deleted_reply.is_deleted = True
+        deleted_reply.save()
+        Vote.objects.create(user_profile=self.profile, post=followed_post)
+        # Downvotes aren't likes
+        Vote.objects.create(user_profile=self.profile, post=own_post, is_upvote=False)
+        SocialNetwork.objects.create(
+            source_node=self.profile, target_node=self.author_profile
+        )
+
+        posts = {post.id: post for post in self._get_page()}
+
+        self.assertEqual(posts[followed_post.id].comment_count, 1)
+        self.assertTrue(posts[followed_post.id].has_user_voted)
+        self.assertTrue(posts[followed_post.id].is_following)
+        self.assertEqual(posts[own_post.id].comment_count, 0)
+        self.assertFalse(posts[own_post.id].has_user_voted)
+        self.assertFalse(posts[own_post.id].is_following)
+
+    def test_feed_query_count_is_constant(self):
+        """Test that decorating a page does not issue queries per post."""
+        for _ in range(2):
+            self._create_post(self.author_profile)
+        with CaptureQueriesContext(connection) as small_page:
+            self._get_page()
+
+        for _ in range(6):
+            post = self._create_post(self.author_profile)
+            self._create_post(self.profile, content="Reply", parent=post)
+        with CaptureQueriesContext(connection) as large_page:
+            self._get_page()
+
+        self.assertEqual(len(small_page), len(large_page))
+
+
+class FeedPaginationTests(FeedTestCase):
+    """Test cases for cursor pagination of feeds."""
+
+    def test_cursor_pages_through_posts_with_same_timestamp(self):
+        """Test that posts sharing a created_date are neither skipped nor repeated."""
+        posts = [self._create_post(self.author_profile) for _ in range(5)]
+        Post.all_objects.update(created_date=posts[0].created_date)
+
+        request = self.factory.get("/")
+        request.user = self.user
+        seen = []
+        cursor = None
+        while True:
+            page = list(
+                get_active_posts(
+                    request, experiment=self.experiment, cursor=cursor, page_size=2
+                )
+            )
+            if not page:
+                break
+            seen.extend(post.id for post in page)
+            cursor = encode_cursor(page[-1])
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), {post.id for post in posts})
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Test that an invalid cursor starts from the newest post."""
+        post = self._create_post(self.author_profile)
+        request = self.factory.get("/")
+        request.user = self.user
+        page = list(
+            get_active_posts(request, experiment=self.experiment, cursor="not-valid")
+        )
+        self.assertEqual([p.id for p in page], [post.id])
+
+    def test_api_home_timeline_next_link(self):
+        """Test that the API home timeline can be paged through with its next link."""
+        posts = [self._create_post(self.profile) for _ in range(3)]
+        token = AuthApiToken.objects.create(user=self.user)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+
+        url = reverse(
+            "api_home_timeline", kwargs={"experiment_id": self.experiment.identifier}
+        )
+        seen = []
+        response = client.get(url, {"page_size": 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen.extend(post["id"] for post in data["results"])
+            if not data["next"]:
+                break
+            response = client.get(data["next"])
+
+        self.assertEqual(seen, [str(post.id) for post in reversed(posts)])
+
+    def test_profile_page_load_more(self):
+        """Test that the profile page of the users app pages with the cursor."""
+        posts = [self._create_post(self.author_profile) for _ in range(3)]
+        self.client.force_login(self.user)
+        url = reverse(
+            "users:detail_with_experiment",
+            kwargs={
+                "experiment_identifier": self.experiment.identifier,
+                "pk": self.author.id,
+            },
+        )
+
+        first = self.client.get(url, {"page_size": 2}, HTTP_HX_REQUEST="true")
+        self.assertEqual(list(first.context["posts"]), posts[:0:-1])
+        second = self.client.get(
+            url,
+            {"page_size": 2, "cursor": encode_cursor(posts[1])},
+            HTTP_HX_REQUEST="true",
+        )
+        self.assertEqual(list(second.context["posts"]), [posts[0]])
+
+
+@override_settings(
+    TIMELINE_STORE="public_discourse_sandbox.pds_app.timeline.InMemoryTimelineStore"
+)
+class HomeTimelineTests(FeedTestCase):
+    """Test cases for the materialized home timelines."""
+
+    def setUp(self):
+        """Set up test data with an empty timeline store."""
+        super().setUp()
+        _load_store.cache_clear()
+        self.store = get_timeline_store()
+
+    def _get_home_page(self):
+        request = self.factory.get("/")
+        request.user = self.user
+        return [
+            post.id
+            for post in get_home_feed_posts(request, experiment=self.experiment)
+        ]
+
+    def _create_committed_post(self, profile):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._create_post(profile)
+
+    def _follow(self):
+        self.client.force_login(self.user)
+        url = reverse(
+            "follow_user", kwargs={"user_profile_id": self.author_profile.id}
+        )
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["is_following"]
+
+    def test_cold_timeline_falls_back_and_warms(self):
+        """Test that a cold timeline is served from the database and then filled."""
+        post = self._create_committed_post(self.profile)
+        self.assertFalse(self.store.is_warm(self.profile.id))
+
+        self.assertEqual(self._get_home_page(), [post.id])
+        self.assertEqual(self.store.read(self.profile.id), [str(post.id)])
+
+    def test_new_posts_fan_out_to_followers(self):
+        """Test that new posts are pushed to the timelines of followers."""
+        SocialNetwork.objects.create(
+            source_node=self.profile, target_node=self.author_profile
+        )
+        own_post = self._create_committed_post(self.profile)
+        self._get_home_page()
+
+        post = self._create_committed_post(self.author_profile)
+        self.assertEqual(
+            self.store.read(self.profile.id), [str(post.id), str(own_post.id)]
+        )
+        self.assertEqual(self._get_home_page(), [post.id, own_post.id])
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Test that following and unfollowing update a warm timeline."""
+        own_post = self._create_committed_post(self.profile)
+        post = self._create_committed_post(self.author_profile)
+        self.assertEqual(self._get_home_page(), [own_post.id])
+
+        self.assertTrue(self._follow())
+        self.assertEqual(self._get_home_page(), [post.id, own_post.id])
+
+        self.assertFalse(self._follow())
+        self.assertEqual(self._get_home_page(), [own_post.id])
+
+    def test_empty_timeline_stays_warm(self):
+        """Test that an empty feed warms the timeline instead of querying every time."""
+        self.assertEqual(self._get_home_page(), [])
+        self.assertTrue(self.store.is_warm(self.profile.id))
+
+        request = self.factory.get("/")
+        request.user = self.user
+        with patch(
+            "public_discourse_sandbox.pds_app.views.fill_timeline"
+        ) as fill_timeline:
+            list(get_home_feed_posts(request, experiment=self.experiment))
+        fill_timeline.assert_not_called()
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_pages_past_the_timeline_come_from_the_database(self):
+        """Test that the feed continues past the oldest post of a full timeline."""
+        posts = [self._create_committed_post(self.profile) for _ in range(5)]
+        request = self.factory.get("/")
+        request.user = self.user
+        seen = []
+        cursor = None
+        while True:
+            page = list(
+                get_home_feed_posts(
+                    request, experiment=self.experiment, cursor=cursor, page_size=2
+                )
+            )
+            if not page:
+                break
+            seen.extend(post.id for post in page)
+            cursor = encode_cursor(page[-1])
+        self.assertEqual(len(self.store.read(self.profile.id)), 2)
+        self.assertEqual(seen, [post.id for post in reversed(posts)])
+
+
+class ThreadTests(FeedTestCase):
+    """Test cases for loading reply threads along the materialized path."""
+
+    def setUp(self):
+        """Set up a thread with nested, deleted and orphaned replies."""
+        super().setUp()
+        self.root = self._create_post(self.profile, "Root")
+        self.first = self._create_post(self.author_profile, "First", self.root)
+        self.second = self._create_post(self.profile, "Second", self.root)
+        self.nested = self._create_post(self.profile, "Nested", self.first)
+        self.deleted = self._create_post(self.author_profile, "Deleted", self.second)
+        self.orphan = self._create_post(self.profile, "Orphan", self.deleted)
+        self.deleted.is_deleted = True
+        self.deleted.save()
+
+    def test_thread_path(self):
+        """Test that replies share the thread root and sort after their parent."""
+        self.assertEqual(self.nested.thread_root, self.root)
+        self.assertTrue(self.nested.path.startswith(self.first.path))
+        self.assertEqual(
+            list(self.root.get_thread()),
+            [self.first, self.nested, self.second, self.orphan],
+        )
+
+    def test_get_post_replies(self):
+        """Test that the reply tree is built from one thread query."""
+        self.client.force_login(self.user)
+        url = reverse("get_replies", kwargs={"post_id": self.root.id})
+        # The request's savepoint and its release, session, user, the post,
+        # the user's groups and one query for the whole thread
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        replies = response.json()["replies"]
+
+        self.assertEqual(
+            [reply["id"] for reply in replies],
+            [str(self.second.id), str(self.first.id)],
+        )
+        self.assertEqual(replies[0]["replies"], [])
+        self.assertEqual(replies[1]["replies"][0]["id"], str(self.nested.id))
+
+    def test_path_follows_created_date(self):
+        """Test that thread paths are built from the stored creation time."""
+        post = Post.objects.get(id=self.nested.id)
+        micros = int(post.created_date.timestamp()) * 1_000_000
+        micros += post.created_date.microsecond
+        self.assertTrue(post.path.endswith(f"{micros:016d}{post.id.hex[:8]}/"))
+
+    def test_deep_threads(self):
+        """Test that replies can be nested deeper than 100 levels."""
+        parent = self.nested
+        for _ in range(110):
+            parent = self._create_post(self.profile, "Deeper", parent)
+        self.assertGreater(len(parent.path), 2500)
+        self.assertEqual(list(self.first.get_thread())[-1], parent)
+
+    def test_get_post_replies_with_experiment(self):
+        """Test that the experiment scoped replies URL resolves."""
+        self.client.force_login(self.user)
+        url = reverse(
+            "get_replies_with_experiment",
+            kwargs={
+                "experiment_identifier": self.experiment.identifier,
+                "post_id": self.root.id,
+            },
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.json()["status"], "success")
+
+    def test_post_comments_serializer(self):
+        """Test that nested comments are serialized from a single thread query."""
+        with CaptureQueriesContext(connection) as queries:
+            data = PostCommentsSerializer(self.root, context={"depth": 1}).data
+        self.assertEqual(
+            [comment["id"] for comment in data["comments"]],
+            [str(self.first.id), str(self.second.id)],
+        )
+        self.assertEqual(data["comments"][0]["comments"], [])
+        self.assertEqual(len(queries), 1)
+
+        data = PostCommentsSerializer(self.root, context={"depth": 5}).data
+        self.assertEqual(data["comments"][0]["comments"][0]["id"], str(self.nested.id))
+        self.assertEqual(data["comments"][1]["comments"], [])
+
+
+class EngagementCounterTests(FeedTestCase):
+    """Test cases for the engagement counters on posts and user profiles."""
+
+    def test_like_and_unlike(self):
+        """Test that liking and unliking update num_upvotes."""
+        post = self._create_post(self.author_profile)
+        self.client.force_login(self.user)
+        url = reverse("like_post", kwargs={"post_id": post.id})
+
+        self.assertEqual(self.client.post(url).json()["upvotes"], 1)
+        self.assertEqual(self.client.post(url).json()["upvotes"], 0)
+
+    def test_api_like_post(self):
+        """Test that the external API like endpoint updates num_upvotes."""
+        post = self._create_post(self.author_profile)
+        token = AuthApiToken.objects.create(user=self.user)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+        url = reverse("api_post_like", kwargs={"post_id": post.id})
+
+        self.assertEqual(client.post(url).json()["data"]["like_count"], 1)
+        self.assertEqual(client.post(url).json()["data"]["like_count"], 0)
+
+    def test_reply_follow_and_delete(self):
+        """Test that replies, follows and deletions keep counters in sync."""
+        post = self._create_post(self.author_profile)
+        reply = self._create_post(self.profile, parent=post)
+        follow = SocialNetwork.objects.create(
+            source_node=self.profile, target_node=self.author_profile
+        )
+        post.refresh_from_db()
+        self.author_profile.refresh_from_db()
+        self.profile.refresh_from_db()
+        self.assertEqual(post.num_comments, 1)
+        self.assertEqual(self.author_profile.num_followers, 1)
+        self.assertEqual(self.profile.num_following, 1)
+
+        self.client.force_login(self.user)
+        self.client.delete(reverse("delete_post", kwargs={"post_id": reply.id}))
+        self.client.delete(reverse("delete_post", kwargs={"post_id": reply.id}))
+        follow.delete()
+        post.refresh_from_db()
+        self.author_profile.refresh_from_db()
+        self.assertEqual(post.num_comments, 0)
+        self.assertEqual(self.author_profile.num_followers, 0)
+
+    def test_reply_counter_follows_visibility(self):
+        """Test that num_comments counts the same replies as get_comment_count."""
+        post = self._create_post(self.author_profile)
+        self._create_post(self.profile, parent=post)
+        banned_reply = self._create_post(self.profile, parent=post)
+        self.client.force_login(self.author)
+        self.experiment.creator = self.author
+        self.experiment.save()
+
+        url = reverse("ban_user", kwargs={"user_profile_id": self.profile.id})
+        self.assertEqual(self.client.post(url).status_code, 200)
+        post.refresh_from_db()
+        self.assertEqual(post.num_comments, post.get_comment_count())
+        self.assertEqual(post.num_comments, 0)
+
+        # Replies of banned users never counted, so deleting them changes nothing
+        self.client.delete(reverse("delete_post", kwargs={"post_id": banned_reply.id}))
+        self.profile.refresh_from_db()
+        self._create_post(self.profile, parent=post)
+        post.refresh_from_db()
+        self.assertEqual(post.num_comments, 0)
+
+        url = reverse("unban_user", kwargs={"user_profile_id": self.profile.id})
+        self.assertEqual(self.client.post(url).status_code, 200)
+        post.refresh_from_db()
+        self.assertEqual(post.num_comments, post.get_comment_count())
+        self.assertEqual(post.num_comments, 2)
+
+        Post.all_objects.filter(parent_post=post).first().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.num_comments, post.get_comment_count())
+
+    def test_reconcile_counters(self):
+        """Test that the reconcile command recomputes drifted counters."""
+        post = self._create_post(self.author_profile)
+        self._create_post(self.profile, parent=post)
+        Vote.objects.create(user_profile=self.profile, post=post)
+        SocialNetwork.objects.create(
+            source_node=self.profile, target_node=self.author_profile
+        )
+        Post.all_objects.update(num_upvotes=7, num_comments=7)
+        UserProfile.objects.update(num_followers=7, num_following=7)
+
+        call_command(
+            "reconcile_counters",
+            experiment=self.experiment.identifier,
+            stdout=StringIO(),
+        )
+
+        post.refresh_from_db()
+        self.author_profile.refresh_from_db()
+        self.assertEqual((post.num_upvotes, post.num_comments), (1, 1))
+        self.assertEqual(
+            (self.author_profile.num_followers, self.author_profile.num_following),
+            (1, 0),
+        )
+
+
+class PostContentProcessingTests(FeedTestCase):
+    """Test cases for running content-derived processing only when content changes."""
+
+    def test_new_post_is_processed_once(self):
+        """Test that a new post is checked and its hashtags parsed on create."""
+        self.experiment.set_option("prepublication_screening", True)
+        with patch(
+            "public_discourse_sandbox.pds_app.models.check_profanity",
+            return_value=True,
+        ) as check:
+            post = self._create_post(self.profile, "Hello #Sandbox")
+        check.assert_called_once_with("Hello #Sandbox", 0.75)
+        self.assertTrue(post.is_flagged)
+        self.assertEqual(
+            list(post.tags.values_list("name", flat=True)),
+            ["sandbox"],
+        )
+
+    def test_non_content_saves_skip_processing(self):
+        """Test that saves that don't change content skip processing."""
+        post = self._create_post(self.profile, "Hello #Sandbox")
+        with patch(
+            "public_discourse_sandbox.pds_app.models.check_profanity"
+        ) as check:
+            post.is_deleted = True
+            post.save(update_fields=["is_deleted"])
+            post = Post.all_objects.get(id=post.id)
+            post.is_pinned = True
+            post.save()
+            post.content = "Edited"
+            post.save(update_fields=["is_pinned"])
+        check.assert_not_called()
+
+    def test_content_edit_is_processed(self):
+        """Test that changed content is checked and parsed again."""
+        self.experiment.set_option("prepublication_screening", True)
+        post = Post.objects.get(id=self._create_post(self.profile, "Hello").id)
+        with patch(
+            "public_discourse_sandbox.pds_app.models.check_profanity",
+            return_value=True,
+        ) as check:
+            post.content = "Hello #edited"
+            post.save(update_fields=["content"])
+        check.assert_called_once_with("Hello #edited", 0.75)
+        post.refresh_from_db()
+        self.assertTrue(post.is_flagged)
+        self.assertTrue(post.tags.filter(name="edited").exists())
+
+
+class TagTests(FeedTestCase):
+    """Test cases for the normalized hashtag vocabulary."""
+
+    def test_tags_are_shared_and_linked_in_bulk(self):
+        """Test that tags are stored once and linked with two inserts."""
+        self._create_post(self.profile, "#shared first")
+        post = Post(
+            user_profile=self.profile,
+            experiment=self.experiment,
+            content="#shared #new #Shared",
+        )
+        post.save()
+        with self.assertNumQueries(3):
+            post.parse_hashtags()
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(
+            sorted(post.tags.values_list("name", flat=True)), ["new", "shared"]
+        )
+
+    def test_hashtag_filter(self):
+        """Test that filtering by hashtag finds top-level posts and replies."""
+        tagged = self._create_post(self.profile, "#topic")
+        parent = self._create_post(self.author_profile, "No tags")
+        reply = self._create_post(self.profile, "Reply on #Topic", parent=parent)
+        self._create_post(self.profile, "#other")
+        deleted = self._create_post(self.author_profile, "Gone")
+        self._create_post(self.profile, "Orphan #topic", parent=deleted)
+        Post.objects.filter(id=deleted.id).update(is_deleted=True)
+
+        request = self.factory.get("/")
+        request.user = self.user
+        posts = get_active_posts(request, experiment=self.experiment, hashtag="TOPIC")
+        self.assertEqual({post.id for post in posts}, {tagged.id, reply.id})
+
+    def test_backfill_tags(self):
+        """Test that existing Hashtag rows are copied in chunks, idempotently."""
+        posts = [self._create_post(self.profile, "Untagged") for _ in range(3)]
+        Hashtag.objects.bulk_create(
+            [Hashtag(post=post, tag="legacy") for post in posts]
+            + [Hashtag(post=posts[0], tag="old")],
+        )
+        out = StringIO()
+        call_command("backfill_tags", batch_size=2, stdout=out)
+        call_command("backfill_tags", stdout=StringIO())
+        self.assertIn("Copied 4 hashtags", out.getvalue())
+        self.assertEqual(Tag.objects.get(name="legacy").posts.count(), 3)
+        self.assertEqual(posts[0].tags.count(), 2)
+
+
+class SearchTests(FeedTestCase):
+    """Test cases for the full-text search of posts and user profiles."""
+
+    def setUp(self):
+        """Set up posts to search, some of which must not be found."""
+        super().setUp()
+        self.best = self._create_post(self.author_profile, "Reform #voting reform now")
+        self.other = self._create_post(self.profile, "Voting reform matters")
+        self._create_post(self.profile, "Unrelated thoughts")
+        deleted = self._create_post(self.profile, "Deleted voting reform")
+        Post.objects.filter(id=deleted.id).update(is_deleted=True)
+        elsewhere = Experiment.objects.create(name="Other", description="Other")
+        Post.objects.create(
+            user_profile=self.profile, experiment=elsewhere, content="Voting reform"
+        )
+
+    def _assert_ranked_and_scoped(self):
+        self.assertEqual(
+            list(search_posts(self.experiment, "reform")), [self.best, self.other]
+        )
+        self.assertEqual(
+            set(search_posts(self.experiment, "#voting")), {self.best, self.other}
+        )
+        self.assertEqual(list(search_posts(self.experiment, "reform unrelated")), [])
+
+    def test_posts_are_ranked_and_scoped(self):
+        """Test that search ranks visible posts of the experiment only."""
+        self._assert_ranked_and_scoped()
+
+    def test_search_follows_content_updates(self):
+        """Test that the search vector follows content changed with update()."""
+        Post.objects.filter(id=self.other.id).update(content="Sandboxes")
+        self.assertEqual(list(search_posts(self.experiment, "sandbox")), [self.other])
+
+    def test_inverted_index_fallback(self):
+        """Test that other databases get the same results from the fallback."""
+        clear_post_indexes()
+        with patch(
+            "public_discourse_sandbox.pds_app.search.uses_postgres", return_value=False
+        ):
+            self._assert_ranked_and_scoped()
+            # The index is reused until the posts change
+            with self.assertNumQueries(2):
+                list(search_posts(self.experiment, "reform"))
+            self.test_search_follows_content_updates()
+
+    def test_stemming(self):
+        """Test that the fallback stems plurals like PostgreSQL does."""
+        self.assertEqual(
+            tokenize("Sandboxes stories #votes"), ["sandbox", "story", "vote"]
+        )
+        self.assertEqual(tokenize("class status"), ["class", "status"])
+
+    def test_api_search_posts(self):
+        """Test that the external search endpoint returns ranked pages."""
+        token = AuthApiToken.objects.create(user=self.user)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+        url = reverse(
+            "api_search_posts", kwargs={"experiment_id": self.experiment.identifier}
+        )
+        data = client.get(url, {"query": "reform", "page_size": 1}).json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual([post["id"] for post in data["results"]], [str(self.best.id)])
+
+    def test_search_user(self):
+        """Test that handle prefix matches come first and results are paged."""
+        self.client.force_login(self.user)
+        url = reverse(
+            "search_user", kwargs={"experiment_identifier": self.experiment.identifier}
+        )
+        data = self.client.get(url, {"q": "@auth"}).json()
+        self.assertEqual([user["username"] for user in data["data"]], ["author"])
+
+        data = self.client.get(url, {"q": "u", "page_size": 1}).json()
+        self.assertEqual([user["username"] for user in data["data"]], ["author"])
+        self.assertTrue(data["has_next"])
+        data = self.client.get(url, {"q": "u", "page_size": 1, "page": 2}).json()
+        self.assertEqual([user["username"] for user in data["data"]], ["testuser"])
+        self.assertFalse(data["has_next"])
+
+
+class TrendingHashtagTests(FeedTestCase):
+    """Test cases for the sliding-window trending hashtags."""
+
+    def setUp(self):
+        """Start every test with a cold cache and store."""
+        super().setUp()
+        cache.clear()
+        _load_trending_store.cache_clear()
+        self.addCleanup(_load_trending_store.cache_clear)
+
+    def _create_posts(self):
+        self._create_post(self.profile, "#alpha #beta")
+        self._create_post(self.profile, "#alpha")
+        old = self._create_post(self.profile, "#old")
+        Post.objects.filter(id=old.id).update(
+            created_date=timezone.now() - timezone.timedelta(days=2)
+        )
+        deleted = self._create_post(self.profile, "#deleted")
+        Post.objects.filter(id=deleted.id).update(is_deleted=True)
+        self.author_profile.is_banned = True
+        self.author_profile.save()
+        self._create_post(self.author_profile, "#banned")
+
+    def test_window_excludes_old_deleted_and_banned(self):
+        """Test that only recent visible posts count towards trending."""
+        self._create_posts()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                compute_trending(self.experiment.id),
+                [{"tag": "alpha", "count": 2}, {"tag": "beta", "count": 1}],
+            )
+
+    def test_trending_is_not_invalidated_per_write(self):
+        """Test that the top hashtags are cached until the next refresh."""
+        self._create_post(self.profile, "#alpha")
+        self.assertEqual(len(get_trending_hashtags(self.experiment.id)), 1)
+        self._create_post(self.profile, "#beta")
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_trending_hashtags(self.experiment.id)), 1)
+        cache.clear()
+        self.assertEqual(len(get_trending_hashtags(self.experiment.id)), 2)
+
+    @override_settings(
+        TRENDING_STORE="public_discourse_sandbox.pds_app.trending.InMemoryTrendingStore",
+    )
+    def test_counters_are_maintained_incrementally(self):
+        """Test that counters follow new, deleted and banned posts."""
+        self._create_posts()
+        self.assertEqual(compute_trending(self.experiment.id)[0]["count"], 2)
+
+        post = self._create_post(self.profile, "#beta #gamma")
+        with self.assertNumQueries(0):
+            trending = compute_trending(self.experiment.id)
+        self.assertEqual(
+            trending,
+            [
+                {"tag": "alpha", "count": 2},
+                {"tag": "beta", "count": 2},
+                {"tag": "gamma", "count": 1},
+            ],
+        )
+
+        # Edits count the hashtags they add, deleting the post uncounts them
+        post.content = "#gamma #delta"
+        post.save()
+        self.assertIn({"tag": "delta", "count": 1}, compute_trending(self.experiment.id))
+        uncount_post(post)
+        self.assertEqual(len(compute_trending(self.experiment.id)), 2)
+
+        self.author_profile.is_banned = False
+        self.author_profile.save()
+        invalidate_trending(self.experiment.id)
+        self.assertIn(
+            {"tag": "banned", "count": 1}, compute_trending(self.experiment.id)
+        )
+
+
+class ProfanityScreeningTests(FeedTestCase):
+    """Test cases for the batched profanity screening pipeline."""
+
+    def setUp(self):
+        """Set up test data with empty profanity score caches."""
+        super().setUp()
+        cache.clear()
+        profanity_score_cache.clear()
+
+    def test_new_posts_are_screened_in_one_batch(self):
+        """Test that pending posts are scored with a single model call."""
+        posts = [self._create_post(self.profile, f"Post {i}") for i in range(3)]
+        self.assertTrue(all(post.needs_screening for post in posts))
+        self.assertFalse(any(post.is_flagged for post in posts))
+
+        with patch(
+            "public_discourse_sandbox.pds_app.utils.predict_prob",
+            return_value=[0.1, 0.9, 0.2],
+        ) as predict:
+            self.assertEqual(screen_new_posts(), 3)
+        predict.assert_called_once_with(["Post 0", "Post 1", "Post 2"])
+
+        flags = dict(Post.all_objects.values_list("content", "is_flagged"))
+        self.assertEqual(flags, {"Post 0": False, "Post 1": True, "Post 2": False})
+        self.assertFalse(Post.all_objects.filter(needs_screening=True).exists())
+
+    def test_posts_edited_while_scored_stay_queued(self):
+        """Test that a post edited during screening is screened again."""
+        post = self._create_post(self.profile, "Nice post")
+
+        def edit(texts):
+            Post.all_objects.filter(id=post.id).update(content="Edited post")
+            return [0.9]
+
+        with patch(
+            "public_discourse_sandbox.pds_app.utils.predict_prob",
+            side_effect=edit,
+        ):
+            self.assertEqual(screen_new_posts(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.needs_screening)
+        self.assertFalse(post.is_flagged)
+
+    def test_prepublication_screening(self):
+        """Test that experiments can require screening before publishing."""
+        self.experiment.set_option("prepublication_screening", True)
+        self.experiment.set_option("profanity_threshold", 0.5)
+        with patch(
+            "public_discourse_sandbox.pds_app.utils.predict_prob",
+            return_value=[0.6],
+        ):
+            post = self._create_post(self.profile)
+        self.assertTrue(post.is_flagged)
+        self.assertFalse(post.needs_screening)
+
+    def test_rescore_command(self):
+        """Test that re-scoring with a new threshold flags and unflags posts."""
+        flagged = self._create_post(self.profile, "Flagged")
+        clean = self._create_post(self.profile, "Clean")
+        Post.all_objects.filter(id=flagged.id).update(is_flagged=True)
+
+        with patch(
+            "public_discourse_sandbox.pds_app.utils.predict_prob",
+            side_effect=lambda texts: [
+                0.5 if text == "Clean" else 0.1 for text in texts
+            ],
+        ):
+            call_command(
+                "rescore_profanity",
+                self.experiment.identifier,
+                threshold=0.4,
+                batch_size=1,
+                stdout=StringIO(),
+            )
+
+        flagged.refresh_from_db()
+        clean.refresh_from_db()
+        self.assertFalse(flagged.is_flagged)
+        self.assertTrue(clean.is_flagged)
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.get_option("profanity_threshold"), 0.4)
+
+    def test_scores_are_cached_by_normalized_content(self):
+        """Test that texts differing in case or whitespace are scored once."""
+        with patch(
+            "public_discourse_sandbox.pds_app.utils.predict_prob",
+            return_value=[0.9],
+        ) as predict:
+            self.assertTrue(check_profanity("Some  TEXT"))
+            self.assertEqual(profanity_scores(["some text", " Some text "]), [0.9, 0.9])
+        predict.assert_called_once_with(["Some  TEXT"])
+        self.assertEqual(
+            profanity_score_cache.info(),
+            {"local_hits": 2, "shared_hits": 0, "misses": 1, "size": 1},
+        )
+
+        # Other processes find the score in the shared cache
+        profanity_score_cache.clear()
+        with patch("public_discourse_sandbox.pds_app.utils.predict_prob") as predict:
+            self.assertTrue(check_profanity("some text"))
+        predict.assert_not_called()
+        self.assertEqual(profanity_score_cache.info()["shared_hits"], 1)
+
+
+@override_settings(LLM_POOL_SIZE=3, LLM_TIMEOUT=7.0, LLM_MAX_RETRIES=1)
+class LLMClientRegistryTests(TestCase):
+    """Test cases for the shared LLM client registry."""
+
+    def setUp(self):
+        """Start with an empty registry."""
+        clear_llm_clients()
+        self.addCleanup(clear_llm_clients)
+
+    def test_clients_are_shared_per_endpoint(self):
+        """Test that clients are reused per (base_url, api_key)."""
+        client = get_llm_client("http://llm-a/v1", "key")
+        self.assertIs(get_llm_client("http://llm-a/v1", "key"), client)
+        self.assertIsNot(get_llm_client("http://llm-b/v1", "key"), client)
+        self.assertIsNot(get_llm_client("http://llm-a/v1", "other"), client)
+
+    def test_client_settings(self):
+        """Test that timeouts and retries come from settings."""
+        client = get_llm_client("http://llm-a/v1", "key")
+        self.assertEqual(client.timeout.read, 7.0)
+        self.assertEqual(client.max_retries, 1)
+
+
+class PostAnalysisTests(FeedTestCase):
+    """Test cases for the shared sentiment and keyword analysis of posts."""
+
+    def setUp(self):
+        """Set up a post and a digital twin with its own LLM endpoint."""
+        super().setUp()
+        cache.clear()
+        self.post = self._create_post(self.author_profile, "I love #sandboxes")
+        self.twin = DigitalTwin.objects.create(
+            user_profile=self.profile,
+            persona="A friendly researcher",
+            llm_url="http://twin-llm/v1",
+            llm_model="twin-model",
+        )
+
+    def _completion(self, content):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        )
+
+    def test_analysis_is_computed_once_per_post(self):
+        """Test that twins share one structured analysis call per post."""
+        client = MagicMock()
+        client.chat.completions.create.return_value = self._completion(
+            'Sure: {"sentiment": "Positive", "keywords": ["love", "sandboxes"]}'
+        )
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ) as get_client:
+            first = DTService().analyze_context(self.post, self.twin)
+            second = DTService().analyze_context(self.post, self.twin)
+
+        self.assertEqual(first["sentiment"], "positive")
+        self.assertEqual(second["keywords"], ["love", "sandboxes"])
+        client.chat.completions.create.assert_called_once()
+        self.assertEqual(
+            client.chat.completions.create.call_args.kwargs["model"], "twin-model"
+        )
+        self.assertEqual(get_client.call_args.args[0], "http://twin-llm/v1")
+
+    def test_unparseable_analysis_falls_back_to_neutral(self):
+        """Test that an invalid analysis response gives uncached neutral defaults."""
+        self.assertIsNone(DTService._parse_analysis("neutral, sandbox"))
+        client = MagicMock()
+        client.chat.completions.create.return_value = self._completion(
+            "neutral, sandbox"
+        )
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ):
+            analysis = DTService().analyze_post_content(self.post, "hi", self.twin)
+        self.assertEqual(analysis, {"sentiment": "neutral", "keywords": []})
+        self.assertIsNone(cache.get(f"pds:post-analysis:{self.post.id}"))
+
+    def test_failed_analysis_is_not_cached(self):
+        """Test that a failed analysis call is retried by the next twin."""
+        client = MagicMock()
+        client.chat.completions.create.side_effect = [
+            TimeoutError("timed out"),
+            self._completion('{"sentiment": "negative", "keywords": ["x"]}'),
+        ]
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ):
+            first = DTService().analyze_post_content(self.post, "hi", self.twin)
+            second = DTService().analyze_post_content(self.post, "hi", self.twin)
+            third = DTService().analyze_post_content(self.post, "hi", self.twin)
+        self.assertEqual(first["sentiment"], "neutral")
+        self.assertEqual(second["sentiment"], "negative")
+        self.assertEqual(third, second)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+
+    def test_twins_wait_for_a_running_analysis(self):
+        """Test that only the twin holding the lock calls the LLM."""
+        key = f"pds:post-analysis:{self.post.id}"
+        cache.add(f"{key}:lock", True)
+        client = MagicMock()
+
+        def finish(seconds):
+            # The twin holding the lock stores its result while others poll
+            cache.set(key, {"sentiment": "positive", "keywords": ["x"]})
+
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch(
+            "public_discourse_sandbox.pds_app.dt_service.time.sleep",
+            side_effect=finish,
+        ):
+            analysis = DTService().analyze_post_content(self.post, "hi", self.twin)
+        self.assertEqual(analysis["sentiment"], "positive")
+        client.chat.completions.create.assert_not_called()
+
+        # The lock holder failed: defaults, without an analysis call either
+        cache.clear()
+        cache.add(f"{key}:lock", True)
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch(
+            "public_discourse_sandbox.pds_app.dt_service.time.sleep",
+            side_effect=lambda seconds: cache.delete(f"{key}:lock"),
+        ):
+            analysis = DTService().analyze_post_content(self.post, "hi", self.twin)
+        self.assertEqual(analysis, {"sentiment": "neutral", "keywords": []})
+        client.chat.completions.create.assert_not_called()
+
+
+class TwinTestCase(FeedTestCase):
+    """Base test class with a human post and digital twins to respond to it."""
+
+    def setUp(self):
+        """Set up a human post and three digital twins on two endpoints."""
+        super().setUp()
+        cache.clear()
+        self.post = self._create_post(self.profile, "What do you think?")
+        self.twins = []
+        for i in range(3):
+            user = User.objects.create_user(
+                email=f"twin{i}@example.com", password="testpass123"
+            )
+            profile = UserProfile.objects.create(
+                user=user,
+                experiment=self.experiment,
+                username=f"twin{i}",
+                display_name=f"Twin {i}",
+                is_digital_twin=True,
+            )
+            self.twins.append(
+                DigitalTwin.objects.create(
+                    user_profile=profile,
+                    persona="A friendly researcher",
+                    llm_url=f"http://llm-{i % 2}/v1",
+                ),
+            )
+
+
+class BatchedTwinResponseTests(TwinTestCase):
+    """Test cases for generating the responses of several twins at once."""
+
+    def test_respond_to_post_batch(self):
+        """Test that replies and notifications are created for successful twins."""
+
+        async def create(model, messages, **kwargs):
+            return AsyncFakeStream('"Nice #idea"')
+
+        def build_client(base_url, api_key):
+            client = MagicMock()
+            client.chat.completions.create = create
+            client.close = AsyncMock()
+            return client
+
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.build_async_llm_client",
+            side_effect=build_client,
+        ) as build, patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ) as analyze:
+            dt_service = DTService()
+            comments = dt_service.respond_to_post_batch(self.twins, self.post)
+
+        analyze.assert_called_once()
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(len(comments), 3)
+        self.assertEqual(dt_service.failures, [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.num_comments, 3)
+        replies = Post.objects.filter(parent_post=self.post)
+        self.assertEqual({reply.content for reply in replies}, {"Nice #idea"})
+        self.assertTrue(all(reply.thread_root_id == self.post.id for reply in replies))
+        self.assertEqual(Tag.objects.get(name="idea").posts.count(), 3)
+        self.assertEqual(
+            Notification.objects.filter(
+                user_profile=self.profile, event="post_replied"
+            ).count(),
+            3,
+        )
+
+    @override_settings(
+        LLM_RATE_LIMITER="public_discourse_sandbox.pds_app.ratelimit.InMemoryRateLimiter",
+        LLM_RATE_LIMITS={"http://llm-0/v1": {"rpm": 1}},
+        LLM_RATE_LIMIT_MAX_WAIT=0,
+    )
+    def test_rate_limited_twins_are_deferred(self):
+        """Test that twins over their endpoint's budget are left for a retry."""
+        _load_limiter.cache_clear()
+        self.addCleanup(_load_limiter.cache_clear)
+
+        async def create(model, messages, **kwargs):
+            return AsyncFakeStream("Agreed")
+
+        def build_client(base_url, api_key):
+            client = MagicMock()
+            client.chat.completions.create = create
+            client.close = AsyncMock()
+            return client
+
+        dt_service = DTService()
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.build_async_llm_client",
+            side_effect=build_client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ):
+            comments = dt_service.respond_to_post_batch(self.twins, self.post)
+
+        # twin0 and twin2 share llm-0, which allows one request per minute
+        self.assertEqual(len(comments), 2)
+        self.assertEqual(len(dt_service.deferred_twins), 1)
+        self.assertIn(dt_service.deferred_twins[0], [self.twins[0], self.twins[2]])
+        self.assertAlmostEqual(dt_service.retry_after, 60, delta=1)
+
+
+class TwinSelectionTests(TwinTestCase):
+    """Test cases for the random selection of active digital twins."""
+
+    def test_only_chosen_twins_are_loaded(self):
+        """Test that sampling loads ids, then the chosen twins in one query."""
+        active_twin_ids(self.experiment.id)
+        with CaptureQueriesContext(connection) as queries:
+            twins = sample_twins(2, self.experiment.id)
+            for twin in twins:
+                twin.user_profile.experiment
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(twins), 2)
+        self.assertTrue(set(twins) <= set(self.twins))
+
+        excluded = sample_twins(5, self.experiment.id, [self.twins[0].id])
+        self.assertEqual(set(excluded), set(self.twins[1:]))
+
+    def test_twin_changes_refresh_cached_ids(self):
+        """Test that new and deactivated twins update the cached ids."""
+        self.assertEqual(len(active_twin_ids(self.experiment.id)), 3)
+        self.twins[0].is_active = False
+        self.twins[0].save()
+        self.assertEqual(
+            set(active_twin_ids(self.experiment.id)),
+            {str(twin.id) for twin in self.twins[1:]},
+        )
+        self.assertEqual(len(active_twin_ids()), 2)
+
+    def test_new_posts_are_sent_to_sampled_twin_ids(self):
+        """Test that a human post schedules responses from sampled twin ids."""
+        with patch(
+            "public_discourse_sandbox.pds_app.signals.process_digital_twin_responses"
+        ) as task, self.captureOnCommitCallbacks(execute=True):
+            post = self._create_post(self.profile, "Any takers?")
+        post_id, twin_ids = task.delay.call_args.args
+        self.assertEqual(post_id, str(post.id))
+        self.assertTrue(1 <= len(twin_ids) <= 3)
+        self.assertTrue(set(twin_ids) <= {str(twin.id) for twin in self.twins})
+
+
+class TwinPostSchedulerTests(TwinTestCase):
+    """Test cases for scheduling organic twin posts across experiments."""
+
+    def test_schedule_evaluates_twins_in_one_pass(self):
+        """Test that the activity window is loaded once for all twins."""
+        with patch(
+            "public_discourse_sandbox.pds_app.tasks.generate_digital_twin_posts"
+        ) as task, patch(
+            "public_discourse_sandbox.pds_app.dt_service.random.random",
+            return_value=0.99,
+        ), CaptureQueriesContext(connection) as queries:
+            scheduled = schedule_digital_twin_posts(batch_size=2)
+
+        # One query for the twins, one for the experiment's recent posts
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(scheduled, 3)
+        batches = [call.args[0] for call in task.delay.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(
+            {twin_id for batch in batches for twin_id in batch},
+            {str(twin.id) for twin in self.twins},
+        )
+
+    def test_recently_active_twins_are_skipped(self):
+        """Test that twins that just posted are less likely to post again."""
+        self.twins[0].last_post = timezone.now()
+        self.twins[0].save()
+        with patch(
+            "public_discourse_sandbox.pds_app.tasks.generate_digital_twin_posts"
+        ) as task, patch(
+            "public_discourse_sandbox.pds_app.dt_service.random.random",
+            return_value=0.5,
+        ):
+            schedule_digital_twin_posts()
+        self.assertEqual(
+            set(task.delay.call_args.args[0]),
+            {str(twin.id) for twin in self.twins[1:]},
+        )
+
+    def test_generate_posts_for_scheduled_twins(self):
+        """Test that each scheduled twin posts, sharing the activity window."""
+        with patch.object(
+            DTService, "generate_original_post_content", return_value="Hello"
+        ) as generate:
+            post_ids = generate_digital_twin_posts.apply(
+                args=[[str(twin.id) for twin in self.twins]]
+            ).get()
+
+        self.assertEqual(len(post_ids), 3)
+        # The context of every twin comes from the same window
+        contexts = [call.args[1] for call in generate.call_args_list]
+        self.assertEqual(len(contexts), 3)
+        self.assertTrue(all(len(context) == 1 for context in contexts))
+        posts = Post.objects.filter(id__in=post_ids)
+        self.assertEqual(
+            {post.user_profile_id for post in posts},
+            {twin.user_profile_id for twin in self.twins},
+        )
+        self.assertFalse(DigitalTwin.objects.filter(last_post=None).exists())
+
+
+class StreamingResponseTests(TwinTestCase):
+    """Test cases for streaming twin responses up to the post length limit."""
+
+    def _respond(self, stream):
+        client = MagicMock()
+        client.chat.completions.create.return_value = stream
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ):
+            response = DTService().generate_llm_response(
+                self.post, {"user": "testuser"}, self.twins[0]
+            )
+        return response, client.chat.completions.create.call_args.kwargs
+
+    def test_long_responses_stop_streaming_at_limit(self):
+        """Test that an overlong response is cut off and its stream closed."""
+        stream = FakeStream("word " * 200)
+        response, kwargs = self._respond(stream)
+        self.assertEqual(len(response), 280)
+        self.assertTrue(response.endswith("..."))
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.read, len(stream.chunks))
+        self.assertTrue(kwargs["stream"])
+        self.assertEqual(kwargs["max_tokens"], 156)
+
+    def test_max_response_tokens_option(self):
+        """Test that experiments can set the max_tokens of responses."""
+        self.experiment.set_option("max_response_tokens", 60)
+        stream = FakeStream("Short and sweet")
+        response, kwargs = self._respond(stream)
+        self.assertEqual(response, "Short and sweet")
+        self.assertEqual(stream.read, len(stream.chunks))
+        self.assertTrue(stream.closed)
+        self.assertEqual(kwargs["max_tokens"], 60)
+
+    def test_async_streams_stop_at_limit(self):
+        """Test that async streams are also closed once over the limit."""
+        stream = AsyncFakeStream("word " * 200)
+        output = asyncio.run(DTService().aread_stream(stream))
+        self.assertGreater(len(output), 280)
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.read, len(stream.chunks))
+
+
+class RateLimiterTests(TestCase):
+    """Test cases for the token bucket rate limiting of LLM requests."""
+
+    def setUp(self):
+        """Use a fresh in-memory limiter for every test."""
+        _load_limiter.cache_clear()
+        self.addCleanup(_load_limiter.cache_clear)
+
+    def test_buckets_refill_over_time(self):
+        """Test that requests wait once a bucket is empty until it refills."""
+        limiter = InMemoryRateLimiter()
+        budgets = [("rpm", 2, 1), ("tpm", 1000, 400)]
+        self.assertEqual(limiter.acquire("key", budgets, now=0), 0)
+        self.assertEqual(limiter.acquire("key", budgets, now=0), 0)
+        # Both requests used up the rpm bucket, one refills every 30 seconds
+        self.assertAlmostEqual(limiter.acquire("key", budgets, now=0), 30)
+        self.assertAlmostEqual(limiter.acquire("key", budgets, now=20), 10)
+        # The tpm bucket refills 1000 tokens per minute, 200 are left at 0s
+        self.assertAlmostEqual(limiter.acquire("key", budgets, now=30), 0)
+        self.assertEqual(limiter.acquire("other", budgets, now=30), 0)
+
+    @override_settings(
+        LLM_RATE_LIMITER="public_discourse_sandbox.pds_app.ratelimit.InMemoryRateLimiter",
+        LLM_RATE_LIMITS={"default": {"rpm": 1, "tpm": 10000}},
+    )
+    def test_rate_limit_exceeded_and_metrics(self):
+        """Test that waiting too long raises and that calls are recorded."""
+        with LLMRateLimit("http://llm/v1", "key", tokens=100, max_wait=0):
+            pass
+        with self.assertRaises(RateLimitExceeded) as raised:
+            with LLMRateLimit("http://llm/v1", "key", tokens=100, max_wait=0):
+                pass
+        self.assertAlmostEqual(raised.exception.retry_after, 60, delta=1)
+
+        recorded = metrics("http://llm/v1", "key")
+        self.assertEqual(recorded["calls"], 1)
+        self.assertEqual(recorded["throttled"], 1)
+        self.assertIn("call_seconds", recorded)
+        self.assertEqual(metrics("http://llm/v1", "other-key"), {})
+
+    def test_unlimited_without_limiter(self):
+        """Test that requests are not limited when no limiter is configured."""
+        for _ in range(3):
+            with LLMRateLimit("http://llm/v1", "key", tokens=100, max_wait=0):
+                pass
+        self.assertEqual(metrics("http://llm/v1", "key"), {})
+
+
+class ResponseFailureTests(TwinTestCase):
+    """Test cases for retrying and recording failed twin responses."""
+
+    def _connection_error(self):
+        return openai.APIConnectionError(
+            request=httpx.Request("POST", "http://llm/v1/chat/completions"),
+        )
+
+    def test_classify_llm_error(self):
+        """Test that only errors that may go away are transient."""
+        request = httpx.Request("POST", "http://llm/v1/chat/completions")
+        self.assertIsInstance(
+            classify_llm_error(self._connection_error()), TransientLLMError
+        )
+        for status_code, api_error_class, error_class in [
+            (500, openai.InternalServerError, TransientLLMError),
+            (429, openai.RateLimitError, TransientLLMError),
+            (400, openai.BadRequestError, PermanentLLMError),
+            (401, openai.AuthenticationError, PermanentLLMError),
+        ]:
+            response = httpx.Response(status_code, request=request)
+            error = api_error_class("error", response=response, body=None)
+            self.assertIsInstance(classify_llm_error(error), error_class)
+        self.assertIsInstance(classify_llm_error(ValueError()), PermanentLLMError)
+
+    @override_settings(LLM_RESPONSE_MAX_ATTEMPTS=3)
+    def test_transient_failures_are_retried_then_recorded(self):
+        """Test that no post is created when the LLM keeps failing."""
+        client = MagicMock()
+        client.chat.completions.create.side_effect = self._connection_error()
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ), self.assertLogs("public_discourse_sandbox.pds_app.tasks") as logs:
+            # Eager tasks run their retries right away
+            process_digital_twin_response.apply(
+                args=[str(self.post.id), str(self.twins[0].id)]
+            )
+
+        levels = [record.levelname for record in logs.records]
+        self.assertEqual(levels.count("WARNING"), 2)
+        self.assertEqual(levels.count("ERROR"), 1)
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+        self.assertFalse(Post.objects.filter(parent_post=self.post).exists())
+        self.assertFalse(Notification.objects.exists())
+        failure = ResponseFailure.objects.get()
+        self.assertEqual(failure.digital_twin, self.twins[0])
+        self.assertTrue(failure.is_transient)
+        self.assertEqual(failure.attempts, 3)
+
+    def test_permanent_failures_are_not_retried(self):
+        """Test that permanent errors are recorded after a single attempt."""
+        client = MagicMock()
+        client.chat.completions.create.side_effect = lambda **kwargs: FakeStream("")
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ):
+            process_digital_twin_response.apply(
+                args=[str(self.post.id), str(self.twins[0].id)]
+            )
+
+        failure = ResponseFailure.objects.get()
+        self.assertFalse(failure.is_transient)
+        self.assertEqual(failure.attempts, 1)
+        self.assertFalse(Post.objects.filter(parent_post=self.post).exists())
+
+    @override_settings(LLM_RESPONSE_MAX_ATTEMPTS=2)
+    def test_batch_retries_only_failed_twins(self):
+        """Test that a batch saves successful replies and retries the rest."""
+        calls = []
+
+        async def create(model, messages, **kwargs):
+            calls.append(messages)
+            if "twin2" in messages[1]["content"]:
+                raise self._connection_error()
+            return AsyncFakeStream("Agreed")
+
+        def build_client(base_url, api_key):
+            client = MagicMock()
+            client.chat.completions.create = create
+            client.close = AsyncMock()
+            return client
+
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.build_async_llm_client",
+            side_effect=build_client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ):
+            process_digital_twin_responses.apply(
+                args=[str(self.post.id), [str(twin.id) for twin in self.twins]]
+            )
+
+        # twin0 and twin1 answer once, twin2 is tried in both attempts
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(Post.objects.filter(parent_post=self.post).count(), 2)
+        failure = ResponseFailure.objects.get()
+        self.assertEqual(failure.digital_twin, self.twins[2])
+        self.assertEqual(failure.attempts, 2)
+
+    @override_settings(LLM_RESPONSE_MAX_ATTEMPTS=3)
+    def test_rate_limited_twins_keep_their_attempt(self):
+        """Test that deferred twins are retried apart from failed ones."""
+
+        def respond_to_post_batch(dt_service, twins, post):
+            dt_service.deferred_twins = [self.twins[0]]
+            dt_service.retry_after = 60
+            dt_service.failures = [(self.twins[1], TransientLLMError())]
+            return []
+
+        with patch.object(
+            DTService,
+            "respond_to_post_batch",
+            autospec=True,
+            side_effect=respond_to_post_batch,
+        ), patch(
+            "public_discourse_sandbox.pds_app.tasks.retry_backoff",
+            return_value=5,
+        ), patch.object(
+            process_digital_twin_responses, "apply_async"
+        ) as apply_async, patch.object(
+            process_digital_twin_responses, "retry", return_value=Retry()
+        ) as retry:
+            process_digital_twin_responses.apply(
+                args=[str(self.post.id), [str(twin.id) for twin in self.twins]],
+                kwargs={"attempt": 2},
+            )
+
+        apply_async.assert_called_once_with(
+            args=[str(self.post.id), [str(self.twins[0].id)]],
+            kwargs={"attempt": 2},
+            countdown=60,
+        )
+        retry.assert_called_once_with(
+            args=[str(self.post.id), [str(self.twins[1].id)]],
+            kwargs={"attempt": 3},
+            countdown=5,
+        )
+        self.assertFalse(ResponseFailure.objects.exists())
+
+
+class LLMStubServerTests(TestCase):
+    """Test cases for the OpenAI compatible stub LLM server."""
+
+    def _start(self, **kwargs):
+        server = make_server("127.0.0.1", 0, StubLLM(**kwargs))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _client(self, base_url):
+        client = openai.OpenAI(base_url=base_url, api_key="x", max_retries=0)
+        self.addCleanup(client.close)
+        return client
+
+    def test_responses_are_deterministic(self):
+        """Test that the same messages always get the same canned response."""
+        client = self._client(self._start(latency_ms=5, distribution="normal"))
+        messages = [{"role": "user", "content": "Thoughts on sandboxes?"}]
+        first = client.chat.completions.create(model="m", messages=messages)
+        second = client.chat.completions.create(model="m", messages=messages)
+        content = first.choices[0].message.content
+        self.assertIn("sandboxes", content)
+        self.assertEqual(second.choices[0].message.content, content)
+        self.assertGreater(first.usage.total_tokens, 0)
+
+        stream = client.chat.completions.create(
+            model="m", messages=messages, stream=True
+        )
+        streamed = "".join(chunk.choices[0].delta.content or "" for chunk in stream)
+        self.assertEqual(streamed, content)
+
+    def test_templates_and_errors(self):
+        """Test custom templates, truncation and the error rate."""
+        base_url = self._start(responses=["More about {keyword}!"], seed=1)
+        response = self._client(base_url).chat.completions.create(
+            model="m",
+            messages=[{"role": "user", "content": "a post on democracy"}],
+        )
+        self.assertEqual(response.choices[0].message.content, "More about democracy!")
+        self.assertEqual(
+            len(StubLLM().complete([{"role": "user", "content": "hi"}], max_tokens=2)),
+            8,
+        )
+
+        client = self._client(self._start(error_rate=1.0, error_status=429))
+        with self.assertRaises(openai.RateLimitError):
+            client.chat.completions.create(
+                model="m", messages=[{"role": "user", "content": "hi"}]
+            )
+
+    def test_streams_are_cancelled_at_limit(self):
+        """Test that DTService stops reading a long streamed stub response."""
+        client = self._client(self._start(responses=["{keyword} " * 100]))
+        stream = client.chat.completions.create(
+            model="m",
+            messages=[{"role": "user", "content": "a post on democracy"}],
+            stream=True,
+        )
+        output = DTService().read_stream(stream)
+        self.assertGreater(len(output), 280)
+        self.assertLess(len(output), len("democracy " * 100))
+
+    def test_content_analysis_against_stub(self):
+        """Test that DTService can run its content analysis against the stub."""
+        base_url = self._start()
+        profile = TwinProfile(
+            twin_id=uuid.uuid4(),
+            user_profile_id=uuid.uuid4(),
+            experiment_id=uuid.uuid4(),
+            username="twin",
+            persona="",
+            llm_url=base_url,
+            api_token="x",
+            llm_model="stub",
+            version="",
+        )
+        twin = SimpleNamespace(id=profile.twin_id)
+        clear_llm_clients()
+        self.addCleanup(clear_llm_clients)
+        dt_service = DTService()
+        dt_service.profiles[twin.id] = profile
+        analysis = dt_service._analyze_content("Voting reform matters", twin)
+        self.assertIn(analysis["sentiment"], ("positive", "negative", "neutral"))
+        self.assertEqual(analysis["keywords"], ["matters", "Voting", "reform"])
+
+
+@override_settings(
+    LLM_RESPONSE_CACHE_STORE=(
+        "public_discourse_sandbox.pds_app.response_cache.InMemoryResponseStore"
+    ),
+)
+class ResponseCacheTests(TwinTestCase):
+    """Test cases for the per-experiment LLM response cache."""
+
+    def setUp(self):
+        """Use a fresh in-memory store for every test."""
+        super().setUp()
+        _load_response_store.cache_clear()
+        self.addCleanup(_load_response_store.cache_clear)
+
+    def _respond(self, client):
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ):
+            return DTService().generate_llm_response(
+                self.post, {"user": "testuser"}, self.twins[0]
+            )
+
+    def _client(self):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = lambda **kwargs: FakeStream(
+            "Fresh take"
+        )
+        return client
+
+    def test_replayed_prompts_are_answered_from_cache(self):
+        """Test that identical messages hit the LLM only once when enabled."""
+        self.experiment.set_option("llm_response_cache", True)
+        client = self._client()
+        with self.assertLogs(
+            "public_discourse_sandbox.pds_app.response_cache", "INFO"
+        ) as logs:
+            self.assertEqual(self._respond(client), "Fresh take")
+            self.assertEqual(self._respond(client), "Fresh take")
+        client.chat.completions.create.assert_called_once()
+        self.assertIn("[llm-cache-hit]", logs.output[0])
+
+    def test_replayed_original_posts_are_answered_from_cache(self):
+        """Test that the nth post of a twin gets the same prompt in a replay."""
+        self.experiment.set_option("llm_response_cache", True)
+        client = self._client()
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ):
+            for _ in range(2):
+                self.assertEqual(
+                    DTService().generate_original_post_content(self.twins[0], []),
+                    "Fresh take",
+                )
+        client.chat.completions.create.assert_called_once()
+
+    def test_cache_is_opt_in(self):
+        """Test that experiments without the option always call the LLM."""
+        client = self._client()
+        self._respond(client)
+        self._respond(client)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+
+    def test_expiry_and_size_eviction(self):
+        """Test that entries expire and the oldest are evicted."""
+        url = "http://llm/v1"
+        cache = ResponseCache(InMemoryResponseStore(), "e", 60, 2)
+        for i in range(3):
+            cache.set("m", url, [{"role": "user", "content": str(i)}], f"r{i}")
+        self.assertIsNone(cache.get("m", url, [{"role": "user", "content": "0"}]))
+        self.assertEqual(cache.get("m", url, [{"role": "user", "content": "2"}]), "r2")
+
+        messages = [{"role": "user", "content": "hi"}]
+        expired = ResponseCache(InMemoryResponseStore(), "e", 0, 10)
+        expired.set("m", url, messages, "r")
+        self.assertIsNone(expired.get("m", url, messages))
+        # The model and endpoint are part of the key
+        self.assertNotEqual(
+            ResponseCache.key("m", "http://a/v1", messages),
+            ResponseCache.key("m", "http://b/v1", messages),
+        )
+
+
+class WorkingMemoryTests(TwinTestCase):
+    """Test cases for the token-bounded working memory of twins."""
+
+    def test_oldest_segments_are_dropped(self):
+        """Test that the memory stays within budget and keeps the persona."""
+        memory = WorkingMemory(max_tokens=6, persona="You are twin0.")
+        memory.append("one two three", tokens=3)
+        memory.append("four five", tokens=2)
+        memory.append("six seven", tokens=2)
+        self.assertEqual(memory.text(), "You are twin0. four five six seven")
+        self.assertEqual(memory.tokens, 4)
+
+        memory.append(" ".join(f"w{i}" for i in range(10)))
+        self.assertEqual(memory.text(), "You are twin0. w4 w5 w6 w7 w8 w9")
+
+        restored = WorkingMemory.from_dict(memory.to_dict(), max_tokens=6)
+        self.assertEqual(restored.tokens, memory.tokens)
+        self.assertEqual(list(restored.segments), list(memory.segments))
+
+    def _reply(self, content):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = lambda **kwargs: FakeStream(
+            content
+        )
+        with patch(
+            "public_discourse_sandbox.pds_app.dt_service.get_llm_client",
+            return_value=client,
+        ), patch.object(
+            DTService, "analyze_context", return_value={"user": "testuser"}
+        ):
+            DTService().respond_to_post(self.twins[0], self.post)
+        return client.chat.completions.create.call_args.kwargs["messages"]
+
+    def test_memory_persists_across_tasks_when_enabled(self):
+        """Test that a twin remembers its earlier replies with the option."""
+        self.experiment.set_option("persist_twin_memory", True)
+        first = self._reply("First reply")
+        self.assertTrue(first[1]["content"].startswith("You are twin0."))
+        self.twins[0].refresh_from_db()
+        second = self._reply("Second reply")
+        self.assertIn("First reply", second[1]["content"])
+        self.assertEqual(second[1]["content"].count("You are twin0."), 1)
+
+    def test_memory_is_discarded_by_default(self):
+        """Test that each task starts from an empty memory without the option."""
+        self._reply("First reply")
+        second = self._reply("Second reply")
+        self.assertNotIn("First reply", second[1]["content"])
+        self.twins[0].refresh_from_db()
+        self.assertEqual(self.twins[0].memory, {})
+
+
+class TwinProfileTests(TwinTestCase):
+    """Test cases for the memoized, versioned digital twin profiles."""
+
+    def setUp(self):
+        """Start with no memoized profiles."""
+        super().setUp()
+        clear_twin_profiles()
+        self.addCleanup(clear_twin_profiles)
+
+    def test_profile_is_built_once(self):
+        """Test that templates don't query once the profile is built."""
+        twin = DigitalTwin.objects.get(id=self.twins[0].id)
+        dt_service = DTService()
+        with self.assertNumQueries(1):
+            profile = dt_service.twin_profile(twin)
+        self.assertEqual(profile.objective, "You are twin0. A friendly researcher")
+        with self.assertNumQueries(0):
+            self.assertEqual(dt_service.template("RESPOND", "hi", twin), "hi")
+            self.assertEqual(
+                dt_service.get_twin_config(twin)["AgentCode"]["name"], "twin0"
+            )
+            # Other service instances reuse the memoized profile
+            DTService().template("ANALYZE", "hi", twin)
+        with self.assertRaises(ValueError):
+            dt_service.template("UNKNOWN", "hi", twin)
+
+    def test_profile_is_rebuilt_after_changes(self):
+        """Test that saving the twin or its user profile outdates the profile."""
+        twin = self.twins[0]
+        get_twin_profile(twin)
+
+        twin.persona = "A grumpy critic"
+        twin.save()
+        self.assertEqual(get_twin_profile(twin).persona, "A grumpy critic")
+
+        twin.user_profile.username = "renamed"
+        twin.user_profile.save()
+        profile = get_twin_profile(twin)
+        self.assertEqual(profile.objective, "You are renamed. A grumpy critic")
+        with self.assertNumQueries(0):
+            self.assertIs(get_twin_profile(twin), profile)
+
+    def test_profile_is_kept_after_other_changes(self):
+        """Test that saving fields outside the profile keeps it."""
+        twin = DigitalTwin.objects.select_related("user_profile").get(
+            id=self.twins[0].id
+        )
+        with self.assertNumQueries(0):
+            profile = get_twin_profile(twin)
+        self.assertEqual(profile.llm_config()[0], twin.llm_url)
+
+        twin.last_post = timezone.now()
+        twin.save(update_fields=["last_post", "last_modified"])
+        with self.assertNumQueries(0):
+            self.assertIs(get_twin_profile(twin), profile)
+
+        twin.llm_model = "other-model"
+        twin.save(update_fields=["llm_model", "last_modified"])
+        self.assertEqual(get_twin_profile(twin).llm_config()[2], "other-model")
+
+
+class RequestContextTests(FeedTestCase):
+    """Test cases for the request-scoped experiment and profile lookups."""
+
+    def _lookups(self, queries, table):
+        return [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith("SELECT") and f'FROM "{table}"' in q["sql"]
+        ]
+
+    def test_page_resolves_experiment_and_profile_once(self):
+        """Test that the view, check_banned and context processors share the lookups."""
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse(
+                    "home_with_experiment",
+                    kwargs={"experiment_identifier": self.experiment.identifier},
+                )
+            )
+        self.assertEqual(response.status_code, 200)
+        experiment_lookups = [
+            sql
+            for sql in self._lookups(queries.captured_queries, "pds_app_experiment")
+            if '"pds_app_experiment"."identifier" =' in sql
+        ]
+        self.assertEqual(len(experiment_lookups), 1)
+        profile_lookups = [
+            sql
+            for sql in self._lookups(queries.captured_queries, "pds_app_userprofile")
+            if '"pds_app_userprofile"."user_id" =' in sql
+        ]
+        self.assertEqual(len(profile_lookups), 1)
+
+    def test_context_processors_share_lookups(self):
+        """Test that the context processors resolve the experiment once without the middleware."""
+        from public_discourse_sandbox.pds_app import context_processors
+
+        request = self.factory.get("/")
+        request.user = self.user
+        request.resolver_match = SimpleNamespace(
+            kwargs={"experiment_identifier": self.experiment.identifier}
+        )
+        cache.set(f"trending_hashtags_{self.experiment.id}", [])
+        # Experiment, profile and the unread notification count
+        with self.assertNumQueries(3):
+            self.assertFalse(context_processors.is_moderator(request)["is_moderator"])
+            context_processors.active_bots(request)
+            self.assertEqual(
+                context_processors.unread_notifications(request)[
+                    "unread_notifications_count"
+                ],
+                0,
+            )
+            context_processors.trending_hashtags(request)
+
+    def test_unknown_experiment(self):
+        """Test that an unknown experiment identifier is resolved to None."""
+        from public_discourse_sandbox.pds_app.middleware import get_request_experiment
+        from public_discourse_sandbox.pds_app.middleware import get_request_profile
+
+        request = self.factory.get("/")
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_request_experiment(request, "nope"))
+            self.assertIsNone(get_request_experiment(request, "nope"))
+            self.assertIsNone(get_request_profile(request, None))
+
+
+class ExperimentCacheTests(PDSTestCase):
+    """Test cases for the cache of experiment lookups by identifier."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.experiment = Experiment.objects.create(
+            name="Test Experiment",
+            description="Test Description",
+            options={"llm_model": "gpt-4o-mini"},
+        )
+        cache.clear()
+        clear_experiment_cache()
+
+    def test_lookups_are_cached(self):
+        """Test that only the first lookup of an identifier queries the database."""
+        with self.assertNumQueries(2):
+            experiment = get_cached_experiment(self.experiment.identifier)
+            self.assertIsNone(get_cached_experiment("nope"))
+        with self.assertNumQueries(0):
+            cached = get_cached_experiment(self.experiment.identifier)
+            self.assertIsNone(get_cached_experiment("nope"))
+        self.assertEqual(cached.id, self.experiment.id)
+        self.assertEqual(cached.options, {"llm_model": "gpt-4o-mini"})
+        self.assertFalse(cached._state.adding)
+        # Every lookup gets its own instance
+        self.assertIsNot(cached, experiment)
+        cached.options["llm_model"] = "changed"
+        self.assertEqual(
+            get_cached_experiment(self.experiment.identifier).options,
+            {"llm_model": "gpt-4o-mini"},
+        )
+
+    def test_other_processes_use_shared_snapshot(self):
+        """Test that an empty process cache is filled from the shared cache."""
+        get_cached_experiment(self.experiment.identifier)
+        clear_experiment_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_cached_experiment(self.experiment.identifier).name,
+                "Test Experiment",
+            )
+
+    def test_save_and_soft_delete_invalidate(self):
+        """Test that saving or soft deleting an experiment outdates its snapshot."""
+        identifier = self.experiment.identifier
+        get_cached_experiment(identifier)
+
+        self.experiment.name = "Renamed"
+        self.experiment.save()
+        self.assertEqual(get_cached_experiment(identifier).name, "Renamed")
+
+        self.experiment.is_deleted = True
+        self.experiment.save()
+        self.assertIsNone(get_cached_experiment(identifier))
+
+    def test_api_uses_cache(self):
+        """Test that the external API resolves experiments from the cache."""
+        user = User.objects.create_user(
+            email="api@example.com", password="testpass123"
+        )
+        UserProfile.objects.create(
+            user=user,
+            experiment=self.experiment,
+            username="apiuser",
+            display_name="API User",
+        )
+        token = AuthApiToken.objects.create(user=user)
+        get_cached_experiment(self.experiment.identifier)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+        url = reverse(
+            "api_search_posts", kwargs={"experiment_id": self.experiment.identifier}
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, {"query": "hi"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any(
+                '"pds_app_experiment"."identifier" =' in q["sql"]
+                for q in queries.captured_queries
+            )
+        )
@@ -0,0 +1,263 @@
+"""
+Materialized home timelines.
+
+Each profile's home timeline is kept as a capped list of post ids scored by
+creation time. New top-level posts are pushed to the timelines of the author
+and their followers when they are created (fan-out on write), so the home
+feed can be read without joining against the follow graph.
+
+The store is optional and enabled with the TIMELINE_STORE setting, a dotted
+path to one of the backends below. A timeline is only used once it is warm;
+until then the home feed falls back to querying the follow graph and fills
+the timeline from the result. A timeline filled with no posts is still warm,
+so empty feeds don't repeat the query on every request. Timelines only hold
+the newest TIMELINE_MAX_LENGTH posts, pages older than that are read from the
+database as well.
+"""
+
+import functools
+import threading
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Post
+from .models import SocialNetwork
+
+
+def _max_length():
+    return getattr(settings, "TIMELINE_MAX_LENGTH", 800)
+
+
+class InMemoryTimelineStore:
+    """
+    Process-local timeline store, used in tests and single-process setups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timelines = defaultdict(dict)
+
+    def is_warm(self, profile_id):
+        return str(profile_id) in self._timelines
+
+    def add(self, profile_id, entries):
+        """
+        Add (post_id, score) entries to a timeline, marking it warm, even if
+        there are no entries.
+        """
+        with self._lock:
+            timeline = self._timelines[str(profile_id)]
+            timeline.update((str(post_id), score) for post_id, score in entries)
+            if len(timeline) > _max_length():
+                newest = sorted(timeline.items(), key=lambda e: e[1], reverse=True)
+                self._timelines[str(profile_id)] = dict(newest[: _max_length()])
+
+    def push(self, profile_ids, post_id, score):
+        """
+        Add a post to every warm timeline in profile_ids. Cold timelines are
+        skipped, they are filled from the database on their next read.
+        """
+        for profile_id in profile_ids:
+            if self.is_warm(profile_id):
+                self.add(profile_id, [(post_id, score)])
+
+    def remove(self, profile_id, post_ids):
+        with self._lock:
+            timeline = self._timelines.get(str(profile_id), {})
+            for post_id in post_ids:
+                timeline.pop(str(post_id), None)
+
+    def read(self, profile_id, max_score=None):
+        """
+        Return post ids in the timeline, newest first, optionally only those
+        scored at or below max_score.
+        """
+        timeline = self._timelines.get(str(profile_id), {})
+        entries = sorted(timeline.items(), key=lambda e: e[1], reverse=True)
+        return [
+            post_id
+            for post_id, score in entries
+            if max_score is None or score <= max_score
+        ]
+
+    def oldest_score(self, profile_id):
+        """
+        Return the score of the oldest post in the timeline, or None if it
+        is empty.
+        """
+        timeline = self._timelines.get(str(profile_id), {})
+        return min(timeline.values(), default=None)
+
+
+class RedisTimelineStore:
+    """
+    Timeline store keeping one sorted set per profile in Redis.
+    """
+
+    key_prefix = "pds:timeline:"
+    # Sorted sets can't be empty, timelines without posts hold only this
+    # member scored -inf so they stay warm
+    empty_marker = ""
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+
+    def _key(self, profile_id):
+        return f"{self.key_prefix}{profile_id}"
+
+    def is_warm(self, profile_id):
+        return bool(self.client.exists(self._key(profile_id)))
+
+    def add(self, profile_id, entries):
+        mapping = {str(post_id): score for post_id, score in entries}
+        if not mapping:
+            mapping = {self.empty_marker: "-inf"}
+        key = self._key(profile_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, mapping)
+        pipe.zremrangebyrank(key, 0, -_max_length() - 1)
+        pipe.execute()
+
+    def push(self, profile_ids, post_id, score):
+        keys = [self._key(profile_id) for profile_id in profile_ids]
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.exists(key)
+        warm_keys = [key for key, exists in zip(keys, pipe.execute()) if exists]
+
+        pipe = self.client.pipeline()
+        for key in warm_keys:
+            pipe.zadd(key, {str(post_id): score})
+            pipe.zremrangebyrank(key, 0, -_max_length() - 1)
+        pipe.execute()
+
+    def remove(self, profile_id, post_ids):
+        post_ids = [str(post_id) for post_id in post_ids]
+        if post_ids:
+            self.client.zrem(self._key(profile_id), *post_ids)
+
+    def read(self, profile_id, max_score=None):
+        post_ids = self.client.zrevrangebyscore(
+            self._key(profile_id),
+            "+inf" if max_score is None else max_score,
+            "(-inf",
+        )
+        return [post_id.decode() for post_id in post_ids]
+
+    def oldest_score(self, profile_id):
+        oldest = self.client.zrangebyscore(
+            self._key(profile_id),
+            "(-inf",
+            "+inf",
+            start=0,
+            num=1,
+            withscores=True,
+        )
+        return oldest[0][1] if oldest else None
+
+
+@functools.cache
+def _load_store(path):
+    return import_string(path)()
+
+
+def get_timeline_store():
+    """
+    Return the configured timeline store, or None if timelines are disabled.
+    """
+    path = getattr(settings, "TIMELINE_STORE", None)
+    return _load_store(path) if path else None
+
+
+def _entries(posts):
+    return [
+        (post_id, created_date.timestamp())
+        for post_id, created_date in posts.values_list("id", "created_date")
+    ]
+
+
+def _recent_posts_by(profile_ids):
+    return Post.objects.filter(
+        user_profile__in=profile_ids,
+        parent_post__isnull=True,
+    ).order_by("-created_date")[: _max_length()]
+
+
+def fan_out_post(post):
+    """
+    Push a new top-level post to the timelines of its author and their followers.
+    """
+    store = get_timeline_store()
+    if not store or post.parent_post_id:
+        return
+    follower_ids = SocialNetwork.objects.filter(
+        target_node=post.user_profile_id,
+    ).values_list("source_node", flat=True)
+    store.push(
+        [*follower_ids, post.user_profile_id],
+        post.id,
+        post.created_date.timestamp(),
+    )
+
+
+def fill_timeline(profile_id, profile_ids):
+    """
+    Fill a cold timeline with the most recent posts by profile_ids. The
+    timeline is warm afterwards even if there are no posts.
+    """
+    store = get_timeline_store()
+    if store:
+        store.add(profile_id, _entries(_recent_posts_by(profile_ids)))
+
+
+def backfill_follow(source_profile, target_profile):
+    """
+    Add the recent posts of a newly followed profile to the follower's timeline.
+    """
+    store = get_timeline_store()
+    if store and store.is_warm(source_profile.id):
+        store.add(source_profile.id, _entries(_recent_posts_by([target_profile.id])))
+
+
+def prune_unfollow(source_profile, target_profile):
+    """
+    Remove the posts of an unfollowed profile from the former follower's timeline.
+    """
+    store = get_timeline_store()
+    if store and store.is_warm(source_profile.id):
+        post_ids = (
+            Post.all_objects.filter(
+                user_profile=target_profile,
+                parent_post__isnull=True,
+            )
+            .order_by("-created_date")
+            .values_list("id", flat=True)[: _max_length()]
+        )
+        store.remove(source_profile.id, post_ids)
+
+
+def read_timeline(profile_id, cursor_position=None):
+    """
+    Return the post ids in a profile's timeline from the cursor position on,
+    or None if the timeline is cold or the cursor is past its oldest post,
+    where the feed continues from the database.
+
+    Args:
+        profile_id: The id of the profile whose home timeline is read
+        cursor_position: Optional (created_date, id) tuple from feed.decode_cursor
+    """
+    store = get_timeline_store()
+    if not store or not store.is_warm(profile_id):
+        return None
+    if not cursor_position:
+        return store.read(profile_id)
+    max_score = cursor_position[0].timestamp()
+    oldest = store.oldest_score(profile_id)
+    # Posts as old as the oldest cached one may have been cut off the
+    # timeline, so those pages come from the database
+    if oldest is not None and max_score <= oldest:
+        return None
+    return store.read(profile_id, max_score)
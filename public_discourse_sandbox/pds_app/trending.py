@@ -0,0 +1,316 @@
+"""
+Trending hashtags of experiments.
+
+The trending hashtags of an experiment are its most used hashtags over the
+last TRENDING_WINDOW seconds, not counting deleted posts and posts of banned
+users. The top hashtags are recomputed at most every TRENDING_REFRESH
+seconds and cached in between, rather than invalidated on every new hashtag.
+
+With the TRENDING_STORE setting, a dotted path to one of the backends below,
+the counts are kept incrementally as per-experiment counters in time buckets
+of TRENDING_BUCKET seconds, so recomputing only sums the buckets of the
+window. Hashtags are counted when their post is created or an edit adds them
+to it, and uncounted when their post is deleted, so the counters always count
+the tags linked to the posts. Counters are rebuilt from the database when they are cold:
+before first use, after a user of the experiment is banned or unbanned, and
+once per window to reconcile any drift. Without a store, the counts are
+aggregated from the database over the window.
+"""
+
+import datetime
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Post
+from .models import PostTag
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "trending_hashtags_"
+
+
+class InMemoryTrendingStore:
+    """
+    Process-local counter store, used in tests and single-process setups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = defaultdict(dict)
+        self._warm_until = {}
+
+    def is_warm(self, experiment_id):
+        return self._warm_until.get(str(experiment_id), 0) > time.time()
+
+    def incr(self, experiment_id, bucket, counts, timeout):
+        with self._lock:
+            counter = self._buckets[str(experiment_id)].setdefault(bucket, Counter())
+            counter.update(counts)
+
+    def replace(self, experiment_id, buckets, first, last, timeout):
+        """
+        Replaces the counters of the buckets first to last and marks the
+        counters of the experiment warm for timeout seconds.
+        """
+        with self._lock:
+            self._buckets[str(experiment_id)] = {
+                bucket: Counter(counts)
+                for bucket, counts in buckets.items()
+                if first <= bucket <= last
+            }
+            self._warm_until[str(experiment_id)] = time.time() + timeout
+
+    def totals(self, experiment_id, first, last):
+        """
+        Returns the counts of the buckets first to last added up.
+        """
+        totals = Counter()
+        with self._lock:
+            buckets = self._buckets[str(experiment_id)]
+            for bucket in list(buckets):
+                if bucket < first:
+                    del buckets[bucket]
+                elif bucket <= last:
+                    totals.update(buckets[bucket])
+        return totals
+
+    def clear(self, experiment_id):
+        with self._lock:
+            self._warm_until.pop(str(experiment_id), None)
+
+
+class RedisTrendingStore:
+    """
+    Counter store keeping a sorted set of tag counts per experiment and
+    bucket in Redis. Buckets expire once they leave the window.
+    """
+
+    key_prefix = "pds:trending:"
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+
+    def _key(self, experiment_id, bucket):
+        return f"{self.key_prefix}{experiment_id}:{bucket}"
+
+    def _warm_key(self, experiment_id):
+        return f"{self.key_prefix}{experiment_id}:warm"
+
+    def is_warm(self, experiment_id):
+        return bool(self.client.exists(self._warm_key(experiment_id)))
+
+    def incr(self, experiment_id, bucket, counts, timeout):
+        key = self._key(experiment_id, bucket)
+        pipe = self.client.pipeline()
+        for tag, delta in counts.items():
+            pipe.zincrby(key, delta, tag)
+        pipe.expire(key, int(timeout))
+        pipe.execute()
+
+    def replace(self, experiment_id, buckets, first, last, timeout):
+        pipe = self.client.pipeline()
+        pipe.delete(*(self._key(experiment_id, b) for b in range(first, last + 1)))
+        for bucket, counts in buckets.items():
+            if counts and first <= bucket <= last:
+                key = self._key(experiment_id, bucket)
+                pipe.zadd(key, dict(counts))
+                pipe.expire(key, int(timeout))
+        pipe.set(self._warm_key(experiment_id), 1, ex=int(timeout))
+        pipe.execute()
+
+    def totals(self, experiment_id, first, last):
+        pipe = self.client.pipeline()
+        for bucket in range(first, last + 1):
+            pipe.zrange(self._key(experiment_id, bucket), 0, -1, withscores=True)
+        totals = Counter()
+        for entries in pipe.execute():
+            totals.update({tag.decode(): int(count) for tag, count in entries})
+        return totals
+
+    def clear(self, experiment_id):
+        self.client.delete(self._warm_key(experiment_id))
+
+
+@functools.cache
+def _load_store(path):
+    return import_string(path)()
+
+
+def get_trending_store():
+    """
+    Returns the configured counter store, or None if counts are aggregated
+    from the database.
+    """
+    path = getattr(settings, "TRENDING_STORE", None)
+    return _load_store(path) if path else None
+
+
+def _bucket(dt):
+    return int(dt.timestamp()) // settings.TRENDING_BUCKET
+
+
+def _window():
+    """
+    Returns the first and last bucket of the trending window.
+    """
+    last = _bucket(timezone.now())
+    return last - settings.TRENDING_WINDOW // settings.TRENDING_BUCKET, last
+
+
+def _window_post_tags(experiment_id):
+    """
+    Links between the visible posts of an experiment within the window and
+    their tags.
+    """
+    first, _ = _window()
+    since = datetime.datetime.fromtimestamp(
+        first * settings.TRENDING_BUCKET, tz=datetime.timezone.utc
+    )
+    return PostTag.objects.filter(
+        post__experiment_id=experiment_id,
+        post__created_date__gte=since,
+        post__is_deleted=False,
+    ).exclude(post__user_profile__is_banned=True)
+
+
+def rebuild_trending(experiment_id):
+    """
+    Recomputes the bucket counters of an experiment from the database.
+    """
+    store = get_trending_store()
+    if not store:
+        return
+    buckets = defaultdict(Counter)
+    post_tags = _window_post_tags(experiment_id).values_list(
+        "tag__name",
+        "post__created_date",
+    )
+    for tag, created_date in post_tags:
+        buckets[_bucket(created_date)][tag] += 1
+    first, last = _window()
+    store.replace(
+        experiment_id,
+        buckets,
+        first,
+        last,
+        settings.TRENDING_WINDOW + settings.TRENDING_BUCKET,
+    )
+
+
+def count_hashtags(post, tags, delta=1):
+    """
+    Adds delta to the counters of the hashtags of a post. Does nothing
+    while the counters of the post's experiment are cold, they are rebuilt
+    from the database before they are used.
+    """
+    store = get_trending_store()
+    if not store or not tags:
+        return
+    try:
+        if store.is_warm(post.experiment_id):
+            store.incr(
+                post.experiment_id,
+                _bucket(post.created_date),
+                Counter({tag: delta for tag in tags}),
+                settings.TRENDING_WINDOW + settings.TRENDING_BUCKET,
+            )
+    except redis.RedisError as e:
+        logger.warning(f"Trending store unavailable: {e!s}")
+
+
+def count_posts(posts):
+    """
+    Counts the hashtags of posts created without the post_save signal of
+    Post, see Post.bulk_create_posts.
+    """
+    for post in posts:
+        count_hashtags(post, Post.find_hashtags(post.content))
+
+
+def count_added_hashtags(post):
+    """
+    Counts the hashtags an edit adds to a post, those it isn't linked to yet.
+    Must be called before the post is linked to the tags of its new content.
+    """
+    if not get_trending_store():
+        return
+    linked = set(post.tags.values_list("name", flat=True))
+    added = [tag for tag in Post.find_hashtags(post.content) if tag not in linked]
+    count_hashtags(post, added)
+
+
+def uncount_post(post):
+    """
+    Removes the hashtags of a deleted post from the counters: the tags it is
+    linked to, which are those counted when it was created or edited.
+    """
+    count_hashtags(post, list(post.tags.values_list("name", flat=True)), -1)
+
+
+def invalidate_trending(experiment_id):
+    """
+    Marks the counters of an experiment cold, e.g. after a user was banned,
+    so they are rebuilt without (or with) the user's posts, and drops the
+    cached top hashtags.
+    """
+    cache.delete(f"{CACHE_PREFIX}{experiment_id}")
+    store = get_trending_store()
+    if not store:
+        return
+    try:
+        store.clear(experiment_id)
+    except redis.RedisError as e:
+        logger.warning(f"Trending store unavailable: {e!s}")
+
+
+def compute_trending(experiment_id, limit=5):
+    """
+    Returns the top hashtags of an experiment in the window as a list of
+    {"tag": ..., "count": ...} dictionaries, most used first.
+    """
+    store = get_trending_store()
+    if store:
+        try:
+            if not store.is_warm(experiment_id):
+                rebuild_trending(experiment_id)
+            counts = store.totals(experiment_id, *_window())
+        except redis.RedisError as e:
+            logger.warning(f"Trending store unavailable: {e!s}")
+            store = None
+    if not store:
+        top = (
+            _window_post_tags(experiment_id)
+            .values("tag__name")
+            .annotate(count=Count("id"))
+            .order_by("-count", "tag__name")[:limit]
+        )
+        return [{"tag": row["tag__name"], "count": row["count"]} for row in top]
+    top = sorted(
+        ((tag, count) for tag, count in counts.items() if count > 0),
+        key=lambda item: (-item[1], item[0]),
+    )[:limit]
+    return [{"tag": tag, "count": count} for tag, count in top]
+
+
+def get_trending_hashtags(experiment_id, limit=5):
+    """
+    Returns the top hashtags of an experiment, recomputed at most every
+    TRENDING_REFRESH seconds.
+    """
+    cache_key = f"{CACHE_PREFIX}{experiment_id}"
+    trending = cache.get(cache_key)
+    if trending is None:
+        trending = compute_trending(experiment_id, limit)
+        cache.set(cache_key, trending, settings.TRENDING_REFRESH)
+    return trending
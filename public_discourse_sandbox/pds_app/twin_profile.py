@@ -0,0 +1,172 @@
+"""
+Compiled digital twin profiles.
+
+Building a reply prompt needs the twin's persona, username and LLM settings
+several times. A TwinProfile holds them, together with the formatted
+objective and the phase templates, so they are computed once, from the twin
+as passed in if its user profile is loaded, otherwise from a single query.
+
+Profiles are memoized per process and versioned: every save or delete of a
+DigitalTwin or its UserProfile stores a new version in the shared cache (see
+signals.py), except for saves limited to fields outside the profile, and a
+memoized profile is only used while its version is current.
+"""
+
+import threading
+import uuid
+from dataclasses import dataclass
+from dataclasses import field
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm import get_twin_llm_config
+from .models import DigitalTwin
+
+VERSION_CACHE_PREFIX = "pds:twin-profile-version:"
+
+# Fields of DigitalTwin a profile is built from. Saves that only update other
+# fields, e.g. last_post after each post, keep the profile (see signals.py).
+PROFILE_FIELDS = frozenset(["persona", "llm_url", "api_token", "llm_model"])
+
+_lock = threading.Lock()
+_profiles = {}
+
+
+@dataclass(frozen=True)
+class TwinProfile:
+    """
+    The parts of a digital twin used to generate its posts.
+    """
+
+    twin_id: uuid.UUID
+    user_profile_id: uuid.UUID
+    experiment_id: uuid.UUID
+    username: str
+    persona: str
+    llm_url: str
+    api_token: str
+    llm_model: str
+    version: str
+    objective: str = field(init=False)
+    phases: dict = field(init=False)
+
+    def __post_init__(self):
+        objective = f"You are {self.username}. {self.persona}"
+        object.__setattr__(self, "objective", objective)
+        object.__setattr__(
+            self,
+            "phases",
+            {
+                "ANALYZE": "Analyze this post: {0}",
+                "RESPOND": "{0}",
+            },
+        )
+
+    def template(self, phase, input_data):
+        """
+        Formats input_data with the template of a phase.
+        """
+        if phase not in self.phases:
+            raise ValueError(f"Undefined phase: {phase}")
+        return self.phases[phase].format(input_data)
+
+    def llm_config(self):
+        """
+        Returns the (base_url, api_key, model) of the twin, see
+        get_twin_llm_config().
+        """
+        return get_twin_llm_config(self)
+
+    def config(self):
+        """
+        Returns the twin's configuration in the dict form of
+        DTService.get_twin_config().
+        """
+        return {
+            "AgentCode": {
+                "name": self.username,
+                "objective": self.objective,
+                "control_flow": {
+                    "BEGIN": "ANALYZE",
+                    "ANALYZE": "RESPOND",
+                    "RESPOND": "END",
+                },
+                **self.phases,
+            },
+            "LLM": {
+                "prompt_model": "openai/gpt-3.5-turbo",
+                "action_model": "openai/gpt-3.5-turbo",
+                "api_key": settings.OPENAI_API_KEY,
+                "functions": [],
+                "system_message": self.persona,
+                "max_retries": 3,
+            },
+        }
+
+
+def _version_key(user_profile_id):
+    return f"{VERSION_CACHE_PREFIX}{user_profile_id}"
+
+
+def invalidate_twin_profile(user_profile_id):
+    """
+    Marks the memoized profile of the twin of a user profile as outdated in
+    every process.
+    """
+    cache.set(_version_key(user_profile_id), uuid.uuid4().hex, None)
+
+
+def _current_version(user_profile_id):
+    key = _version_key(user_profile_id)
+    version = cache.get(key)
+    if version is None:
+        # Start a new version, so a profile memoized under a version that was
+        # evicted from the cache isn't mistaken for a current one
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def _build_profile(twin, version):
+    # Twins loaded with their user profile and all of the fields used are
+    # taken as they are, others are fetched again
+    if not DigitalTwin.user_profile.is_cached(twin) or (
+        PROFILE_FIELDS & twin.get_deferred_fields()
+    ):
+        twin = DigitalTwin.objects.select_related("user_profile").get(id=twin.id)
+    return TwinProfile(
+        twin_id=twin.id,
+        user_profile_id=twin.user_profile_id,
+        experiment_id=twin.user_profile.experiment_id,
+        username=twin.user_profile.username,
+        persona=twin.persona,
+        llm_url=twin.llm_url,
+        api_token=twin.api_token,
+        llm_model=twin.llm_model,
+        version=version,
+    )
+
+
+def get_twin_profile(twin):
+    """
+    Returns the current profile of a digital twin, building it only if the
+    twin or its user profile changed since it was last built.
+
+    Args:
+        twin: A DigitalTwin, its fields and user profile are used to build the
+            profile if they are loaded
+    """
+    version = _current_version(twin.user_profile_id)
+    with _lock:
+        profile = _profiles.get(twin.id)
+    if profile is None or profile.version != version:
+        profile = _build_profile(twin, version)
+        with _lock:
+            _profiles[twin.id] = profile
+    return profile
+
+
+def clear_twin_profiles():
+    with _lock:
+        _profiles.clear()
@@ -0,0 +1,79 @@
+"""
+Random selection of active digital twins.
+
+Picking a few twins used to load every active twin of an experiment, persona
+text included. The ids of the active twins are cached per experiment in the
+shared cache instead (see signals.py for the invalidation on twin changes),
+sampled in Python, and only the chosen twins are fetched, together with their
+profiles, in one query.
+"""
+
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import DigitalTwin
+
+logger = logging.getLogger(__name__)
+
+IDS_CACHE_PREFIX = "pds:active-twin-ids:"
+
+
+def _ids_key(experiment_id):
+    return f"{IDS_CACHE_PREFIX}{experiment_id or 'all'}"
+
+
+def active_twin_ids(experiment_id=None):
+    """
+    Returns the ids of the active twins of an experiment, or of all
+    experiments if experiment_id is None.
+    """
+    key = _ids_key(experiment_id)
+    ids = cache.get(key)
+    if ids is None:
+        twins = DigitalTwin.objects.filter(is_active=True)
+        if experiment_id:
+            twins = twins.filter(user_profile__experiment_id=experiment_id)
+        ids = [str(twin_id) for twin_id in twins.values_list("id", flat=True)]
+        cache.set(key, ids, settings.ACTIVE_TWIN_IDS_CACHE_TIMEOUT)
+    return ids
+
+
+def invalidate_active_twin_ids(experiment_id):
+    """
+    Drops the cached active twin ids of an experiment and of all experiments.
+    """
+    cache.delete_many([_ids_key(experiment_id), _ids_key(None)])
+
+
+def sample_twin_ids(count, experiment_id=None, exclude_ids=()):
+    """
+    Returns up to count random active twin ids.
+
+    Args:
+        count: Number of twins to pick, fewer if there aren't enough
+        experiment_id: Optional experiment to pick the twins from
+        exclude_ids: Ids of twins not to pick
+    """
+    exclude_ids = {str(twin_id) for twin_id in exclude_ids}
+    ids = [i for i in active_twin_ids(experiment_id) if i not in exclude_ids]
+    return random.sample(ids, min(count, len(ids)))
+
+
+def sample_twins(count, experiment_id=None, exclude_ids=()):
+    """
+    Returns up to count random active twins with their user profiles and
+    experiments, see sample_twin_ids().
+    """
+    ids = sample_twin_ids(count, experiment_id, exclude_ids)
+    if not ids:
+        return []
+    twins = DigitalTwin.objects.filter(id__in=ids, is_active=True).select_related(
+        "user_profile__experiment"
+    )
+    twins = {str(twin.id): twin for twin in twins}
+    # Keep the sampled order; twins deactivated since their ids were cached
+    # are skipped
+    return [twins[twin_id] for twin_id in ids if twin_id in twins]
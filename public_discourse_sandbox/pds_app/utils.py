@@ -1,5 +1,10 @@
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 
+from django.conf import settings
+from django.core.cache import cache
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django_notification_system.models import Notification as DjNotification
@@ -9,7 +14,106 @@ from profanity_check import predict_prob
 logger = logging.getLogger(__name__)
 
 
-def check_profanity(text, threshold=0.75):
+PROFANITY_THRESHOLD = 0.75
+
+
+class ProfanityScoreCache:
+    """
+    Two level cache of profanity scores keyed on a hash of the normalized text:
+    a bounded in-process LRU in front of the shared Django cache (Redis in
+    production). Scores rather than flags are cached so a changed threshold
+    still applies. Hit and miss counts are kept per process, see info().
+    """
+
+    key_prefix = "pds:profanity:"
+
+    def __init__(self, maxsize=None, timeout=None):
+        self.maxsize = maxsize or getattr(settings, "PROFANITY_CACHE_SIZE", 10000)
+        self.timeout = timeout or getattr(settings, "PROFANITY_CACHE_TIMEOUT", 86400)
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Returns the hit and miss counters and current size of the local cache.
+        """
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "size": len(self._scores),
+        }
+
+    @staticmethod
+    def key(text):
+        """
+        Returns the cache key of a text. Case and whitespace are normalized
+        since they don't change the score.
+        """
+        normalized = " ".join(text.lower().split())
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _remember(self, key, score):
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)
+
+    def get_many(self, texts):
+        """
+        Returns a {key: score} dict of the cached scores of texts.
+        """
+        keys = [self.key(text) for text in texts]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        local_hits = sum(key in scores for key in keys)
+
+        missing = {self.key_prefix + key for key in keys if key not in scores}
+        shared = {}
+        if missing:
+            shared = {
+                key.removeprefix(self.key_prefix): score
+                for key, score in cache.get_many(missing).items()
+            }
+            scores.update(shared)
+
+        with self._lock:
+            for key, score in shared.items():
+                self._remember(key, score)
+            self.local_hits += local_hits
+            self.shared_hits += sum(key in shared for key in keys)
+            self.misses += sum(key not in scores for key in keys)
+        return scores
+
+    def set_many(self, scores):
+        """
+        Stores a {key: score} dict in both cache levels.
+        """
+        with self._lock:
+            for key, score in scores.items():
+                self._remember(key, score)
+        cache.set_many(
+            {self.key_prefix + key: score for key, score in scores.items()},
+            self.timeout,
+        )
+
+
+profanity_score_cache = ProfanityScoreCache()
+
+
+def check_profanity(text, threshold=PROFANITY_THRESHOLD):
     """
     Checks if the provided text contains profanity using alt-profanity-check.
 
@@ -23,13 +127,48 @@ def check_profanity(text, threshold=0.75):
     if not text:
         return False
 
-    # Get profanity probability from the model
-    probability = predict_prob([text])[0]
+    # Get profanity probability from the model (or the score cache)
+    probability = profanity_scores([text])[0]
 
     # Return True if probability is above threshold
     return probability > threshold
 
 
+def profanity_scores(texts):
+    """
+    Scores many texts for profanity with a single call to the model, which is
+    much cheaper per text than scoring them one by one. Texts already in the
+    profanity score cache are not scored again.
+
+    Args:
+        texts: List of texts to score
+
+    Returns:
+        List of profanity probabilities, in the same order as texts
+    """
+    if not texts:
+        return []
+
+    scores = profanity_score_cache.get_many(texts)
+    unscored = {}
+    for text in texts:
+        key = profanity_score_cache.key(text)
+        if key not in scores:
+            unscored.setdefault(key, text)
+
+    if unscored:
+        new_scores = dict(
+            zip(
+                unscored,
+                (float(p) for p in predict_prob(list(unscored.values()))),
+            ),
+        )
+        profanity_score_cache.set_many(new_scores)
+        scores.update(new_scores)
+
+    return [scores[profanity_score_cache.key(text)] for text in texts]
+
+
 def send_notification_to_user(
     user_profile,
     title: str,
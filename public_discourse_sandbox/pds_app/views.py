@@ -25,10 +25,14 @@ from django.views.generic import TemplateView
 from django.views.generic import View
 
 from .decorators import check_banned
+from .feed import annotate_feed_state
+from .feed import decode_cursor
+from .feed import paginate_after
 from .forms import EnrollDigitalTwinForm
 from .forms import ExperimentForm
 from .forms import PostForm
 from .forms import UserProfileForm
+from .middleware import get_request_profile
 from .mixins import ExperimentContextMixin
 from .mixins import ProfileRequiredMixin
 from .models import AuthApiToken
@@ -37,8 +41,13 @@ from .models import Experiment
 from .models import ExperimentInvitation
 from .models import Notification
 from .models import Post
+from .models import PostTag
 from .models import SocialNetwork
 from .models import UserProfile
+from .timeline import backfill_follow
+from .timeline import fill_timeline
+from .timeline import prune_unfollow
+from .timeline import read_timeline
 from .utils import send_notification_to_user
 
 User = get_user_model()
@@ -50,7 +59,8 @@ def get_active_posts(
     experiment=None,
     hashtag=None,
     profile_ids=None,
-    previous_post_id=None,
+    post_ids=None,
+    cursor=None,
     page_size=10,
 ):
     """
@@ -64,24 +74,25 @@ def get_active_posts(
             - Have the hashtag directly, OR
             - Have replies containing the hashtag
         profile_ids: Optional list of profile IDs to filter by
-        previous_post_id: Optional ID of the last post from previous page to paginate from
+        post_ids: Optional list of post IDs to filter by
+        cursor: Optional cursor (see feed.encode_cursor) of the last post from the
+            previous page to paginate from
         page_size: Number of posts to return per page (default: 20)
     """
 
     # Filter by hashtag if provided - look for posts that either have the hashtag directly
     # or have replies containing the hashtag
     if hashtag:
+        # Posts with the tag, from the (tag, post) index of PostTag
+        tagged = PostTag.objects.filter(tag__name=hashtag.lower()).values("post_id")
         posts = Post.objects.filter(
-            models.Q(
-                hashtag__tag=hashtag.lower(),
-                parent_post__isnull=True,
-            )  # Top-level posts with hashtag
+            models.Q(parent_post__isnull=True)  # Top-level posts with hashtag
             | models.Q(  # Replies with hashtag where parent exists and isn't deleted
-                hashtag__tag=hashtag.lower(),
                 parent_post__isnull=False,
                 parent_post__is_deleted=False,
             ),
-        ).distinct()  # Use distinct to avoid duplicate posts
+            id__in=tagged,
+        )
     else:
         posts = Post.objects.filter(
             parent_post__isnull=True,  # Only show top-level posts, not replies
@@ -96,58 +107,37 @@ def get_active_posts(
     if profile_ids:
         posts = posts.filter(user_profile__in=profile_ids)
 
-        # Determine next page of posts based on previous_post_id's created_date
-    if previous_post_id:
-        try:
-            previous_post = Post.objects.get(id=previous_post_id)
-            posts = posts.filter(created_date__lt=previous_post.created_date)
-        except Post.DoesNotExist:
-            # If previous_post_id is not found, start at current time. Case is when user first loads the page.
-            pass
-
-    # Select related data for efficiency
-    posts = (
+    # Filter by post IDs if provided, e.g. from a materialized timeline
+    if post_ids is not None:
+        posts = posts.filter(id__in=post_ids)
+
+    # Get current user's profile for follow state checks
+    current_user_profile = None
+    if request.user.is_authenticated and experiment:
+        current_user_profile = get_request_profile(request, experiment)
+
+    # Select related data and add comment count, vote status and follow state
+    # for the whole page in the same query
+    posts = annotate_feed_state(
         posts.select_related(
             "user_profile",
             "user_profile__user",
-        )
-        .prefetch_related(
-            "vote_set",  # Prefetch votes to avoid N+1 queries
-        )
-        .order_by("-created_date")
+        ),
+        request.user,
+        current_user_profile,
     )
 
+    # Determine next page of posts from the cursor's (created_date, id) position.
+    # If there is no cursor, start at current time. Case is when user first loads the page.
+    posts = paginate_after(posts, cursor)
+
     # Limit results to page_size
     posts = posts[: int(page_size)]
 
-    # Get current user's profile for follow state checks
-    current_user_profile = None
-    if request.user.is_authenticated and experiment:
-        current_user_profile = request.user.userprofile_set.filter(
-            experiment=experiment,
-        ).first()
-
-    # Add comment count, vote status, and follow state using the get_comment_count method
-    for post in posts:
-        post.comment_count = post.get_comment_count()
-        # Add whether the current user has voted
-        post.has_user_voted = post.vote_set.filter(
-            user_profile__user=request.user,
-        ).exists()
-
-        # Add follow state for each post
-        if current_user_profile and post.user_profile.user != request.user:
-            post.is_following = SocialNetwork.objects.filter(
-                source_node=current_user_profile,
-                target_node=post.user_profile,
-            ).exists()
-        else:
-            post.is_following = False
-
     return posts
 
 
-def get_home_feed_posts(request, experiment=None, previous_post_id=None, page_size=10):
+def get_home_feed_posts(request, experiment=None, cursor=None, page_size=10):
     """
     Helper function to get posts for the home feed.
     Only returns posts from the current user and users they follow.
@@ -157,11 +147,22 @@ def get_home_feed_posts(request, experiment=None, previous_post_id=None, page_si
         experiment: Optional experiment to filter by
     """
     # Get the user's profile for this experiment
-    user_profile = request.user.userprofile_set.filter(experiment=experiment).first()
+    user_profile = get_request_profile(request, experiment)
 
     if not user_profile:
         return Post.objects.none()  # Return empty queryset if no profile
 
+    # Read the materialized timeline if the timeline store has it
+    post_ids = read_timeline(user_profile.id, decode_cursor(cursor))
+    if post_ids is not None:
+        return get_active_posts(
+            request,
+            experiment,
+            post_ids=post_ids,
+            cursor=cursor,
+            page_size=page_size,
+        )
+
     # Get IDs of users the current user follows
     following_ids = SocialNetwork.objects.filter(
         source_node=user_profile,
@@ -170,12 +171,15 @@ def get_home_feed_posts(request, experiment=None, previous_post_id=None, page_si
     # Add the user's own profile to the list
     profile_ids = list(following_ids) + [user_profile.id]
 
+    # Warm the timeline so the next request can read from it
+    fill_timeline(user_profile.id, profile_ids)
+
     # Get all active posts with filtering by profile IDs from the beginning
     return get_active_posts(
         request,
         experiment,
         profile_ids=profile_ids,
-        previous_post_id=previous_post_id,
+        cursor=cursor,
         page_size=page_size,
     )
 
@@ -283,7 +287,7 @@ class HomeView(
     context_object_name = "posts"
 
     def get_queryset(self):
-        previous_post_id = self.request.GET.get("previous_post_id", None)
+        cursor = self.request.GET.get("cursor", None)
         page_size = self.request.GET.get("page_size", None)
 
         # Only pass pagination params if they were provided
@@ -291,8 +295,8 @@ class HomeView(
             "request": self.request,
             "experiment": self.experiment,
         }
-        if previous_post_id is not None:
-            kwargs["previous_post_id"] = previous_post_id
+        if cursor is not None:
+            kwargs["cursor"] = cursor
         if page_size is not None:
             kwargs["page_size"] = page_size
 
@@ -323,9 +327,7 @@ class HomeView(
 
         # Add flag for empty home feed to show guidance message
         if not context["posts"] and not self.request.headers.get("HX-Request"):
-            user_profile = self.request.user.userprofile_set.filter(
-                experiment=self.experiment,
-            ).first()
+            user_profile = get_request_profile(self.request, self.experiment)
             if user_profile:
                 # Check if user follows anyone
                 follows_anyone = SocialNetwork.objects.filter(
@@ -354,9 +356,7 @@ class HomeView(
     def post(self, request, *args, **kwargs):
         """Handle post creation."""
         # Get the user's profile for this experiment
-        user_profile = request.user.userprofile_set.filter(
-            experiment=self.experiment,
-        ).first()
+        user_profile = get_request_profile(request, self.experiment)
         if not user_profile:
             raise PermissionDenied("You do not have a profile in this experiment")
 
@@ -414,7 +414,7 @@ class ExploreView(
     def get_queryset(self):
         # Get hashtag from query parameters
         hashtag = self.request.GET.get("hashtag")
-        previous_post_id = self.request.GET.get("previous_post_id", None)
+        cursor = self.request.GET.get("cursor", None)
         page_size = self.request.GET.get("page_size", None)
 
         # Only pass pagination params if they were provided
@@ -423,8 +423,8 @@ class ExploreView(
             "experiment": self.experiment,
             "hashtag": hashtag,
         }
-        if previous_post_id is not None:
-            kwargs["previous_post_id"] = previous_post_id
+        if cursor is not None:
+            kwargs["cursor"] = cursor
         if page_size is not None:
             kwargs["page_size"] = page_size
 
@@ -653,6 +653,7 @@ class FollowView(LoginRequiredMixin, View):
             if existing_follow:
                 # Unfollow
                 existing_follow.delete()
+                prune_unfollow(user_profile, target_profile)
                 is_following = False
             else:
                 # Follow
@@ -660,6 +661,7 @@ class FollowView(LoginRequiredMixin, View):
                     source_node=user_profile,
                     target_node=target_profile,
                 )
+                backfill_follow(user_profile, target_profile)
                 is_following = True
                 # Create a notification for the target user
                 Notification.objects.create(
@@ -673,6 +675,7 @@ class FollowView(LoginRequiredMixin, View):
                     body=f"@{user_profile.username} followed you!",
                 )
 
+            target_profile.refresh_from_db(fields=["num_followers"])
             return JsonResponse(
                 {
                     "status": "success",
@@ -1345,7 +1348,7 @@ class UserProfileDetailView(
         # )
 
         # Get pagination parameters
-        previous_post_id = self.request.GET.get("previous_post_id", None)
+        cursor = self.request.GET.get("cursor", None)
         page_size = self.request.GET.get(
             "page_size",
             10,
@@ -1355,17 +1358,24 @@ class UserProfileDetailView(
             False,
         )  # New param to optionally show replies only
 
-        # Get all posts by this user (not deleted, ordered by newest first)
-        all_posts = (
-            Post.all_objects.filter(user_profile=self.object, is_deleted=False)
-            .select_related(
+        current_user_profile = context.get("current_user_profile")
+
+        # Get all posts by this user (not deleted, ordered by newest first),
+        # annotated with comment count, vote status, and follow state for
+        # template compatibility
+        all_posts = annotate_feed_state(
+            Post.all_objects.filter(
+                user_profile=self.object,
+                is_deleted=False,
+            ).select_related(
                 "user_profile",
                 "user_profile__user",
                 "parent_post",
                 "parent_post__user_profile",
                 "parent_post__user_profile__user",
-            )
-            .prefetch_related("vote_set")
+            ),
+            self.request.user,
+            current_user_profile,
         )
 
         # Separate original posts and replies
@@ -1375,22 +1385,13 @@ class UserProfileDetailView(
             parent_post__is_deleted=False,
         )
 
-        # If previous_post_id provided, paginate from that post
-        if previous_post_id:
-            try:
-                previous_post = Post.objects.get(id=previous_post_id)
-                original_posts = original_posts.filter(
-                    created_date__lt=previous_post.created_date,
-                )
-                replies = replies.filter(created_date__lt=previous_post.created_date)
-            except Post.DoesNotExist:
-                pass
+        # If a cursor is provided, paginate from that post. Ordered by newest first
+        original_posts = paginate_after(original_posts, cursor)
+        replies = paginate_after(replies, cursor)
 
-        # Order by newest first and limit to page size
-        context["user_original_posts"] = original_posts.order_by("-created_date")[
-            : int(page_size)
-        ]
-        context["user_replies"] = replies.order_by("-created_date")[: int(page_size)]
+        # Limit to page size
+        context["user_original_posts"] = original_posts[: int(page_size)]
+        context["user_replies"] = replies[: int(page_size)]
 
         # Add counts for the tabs
         context["original_posts_count"] = original_posts.count()
@@ -1399,34 +1400,9 @@ class UserProfileDetailView(
         # Keep the original user_posts for backward compatibility (all posts)
         # If replies_only is True, show only replies, otherwise show only original posts
         if replies_only:
-            context["user_posts"] = replies.order_by("-created_date")[: int(page_size)]
+            context["user_posts"] = replies[: int(page_size)]
         else:
-            context["user_posts"] = original_posts.order_by("-created_date")[
-                : int(page_size)
-            ]
-
-        # Annotate each post with comment_count and has_user_voted for template compatibility
-        current_user = self.request.user
-        current_user_profile = context.get("current_user_profile")
-        for post_list in [
-            context["user_original_posts"],
-            context["user_replies"],
-            context["user_posts"],
-        ]:
-            for post in post_list:
-                post.comment_count = post.get_comment_count()
-                post.has_user_voted = post.vote_set.filter(
-                    user_profile__user=current_user,
-                ).exists()
-
-                # Add follow state for each post
-                if current_user_profile and post.user_profile.user != current_user:
-                    post.is_following = SocialNetwork.objects.filter(
-                        source_node=current_user_profile,
-                        target_node=post.user_profile,
-                    ).exists()
-                else:
-                    post.is_following = False
+            context["user_posts"] = original_posts[: int(page_size)]
 
         # If HTMX request, map user_posts to posts for template compatibility
         if self.request.headers.get("HX-Request"):
@@ -1497,17 +1473,20 @@ class CommentDetailView(
     slug_url_kwarg = "post_id"
 
     def get_queryset(self):
-        """Filter posts by experiment and ensure they're not deleted."""
-        return (
+        """
+        Filter posts by experiment and ensure they're not deleted.
+        Annotates comment count, vote status and follow state for the main post.
+        """
+        return annotate_feed_state(
             Post.objects.filter(
                 experiment=self.experiment,
                 is_deleted=False,
-            )
-            .select_related(
+            ).select_related(
                 "user_profile",
                 "user_profile__user",
-            )
-            .prefetch_related("vote_set")
+            ),
+            self.request.user,
+            self.user_profile,
         )
 
     def get_context_data(self, **kwargs):
@@ -1515,56 +1494,24 @@ class CommentDetailView(
         context = super().get_context_data(**kwargs)
         post = self.object
 
-        # Get current user's profile for follow state checks
-        current_user_profile = context.get("current_user_profile")
-
-        # Add comment count and vote status for the main post
-        post.comment_count = post.get_comment_count()
-        post.has_user_voted = post.vote_set.filter(
-            user_profile__user=self.request.user,
-        ).exists()
-
-        # Add follow state for the main post
-        if current_user_profile and post.user_profile.user != self.request.user:
-            post.is_following = SocialNetwork.objects.filter(
-                source_node=current_user_profile,
-                target_node=post.user_profile,
-            ).exists()
-        else:
-            post.is_following = False
-
-        # Get replies for this post
-        replies = (
+        # Get replies for this post with comment count, vote status, and follow state
+        replies = annotate_feed_state(
             Post.objects.filter(
                 parent_post=post,
                 is_deleted=False,
-            )
-            .select_related(
+            ).select_related(
                 "user_profile",
                 "user_profile__user",
-            )
-            .prefetch_related("vote_set")
-            .order_by("created_date")
-        )
+            ),
+            self.request.user,
+            self.user_profile,
+        ).order_by("created_date")
 
-        # Add comment count, vote status, and follow state for each reply
+        # Add permission flags for template
+        is_moderator = self.is_moderator(self.request.user, self.experiment)
         for reply in replies:
-            reply.comment_count = reply.get_comment_count()
-            reply.has_user_voted = reply.vote_set.filter(
-                user_profile__user=self.request.user,
-            ).exists()
-            # Add permission flags for template
             reply.is_author = reply.user_profile.user == self.request.user
-            reply.is_moderator = self.is_moderator(self.request.user, self.experiment)
-
-            # Add follow state for each reply
-            if current_user_profile and reply.user_profile.user != self.request.user:
-                reply.is_following = SocialNetwork.objects.filter(
-                    source_node=current_user_profile,
-                    target_node=reply.user_profile,
-                ).exists()
-            else:
-                reply.is_following = False
+            reply.is_moderator = is_moderator
 
         context["replies"] = replies
 
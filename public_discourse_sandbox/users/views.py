@@ -20,6 +20,7 @@ from django.views.generic import RedirectView
 from django.views.generic import UpdateView
 
 from public_discourse_sandbox.pds_app.decorators import check_banned
+from public_discourse_sandbox.pds_app.feed import paginate_after
 from public_discourse_sandbox.pds_app.mixins import ExperimentContextMixin
 from public_discourse_sandbox.pds_app.models import Experiment
 from public_discourse_sandbox.pds_app.models import ExperimentInvitation
@@ -121,7 +122,7 @@ class UserProfileDetailView(LoginRequiredMixin, ExperimentContextMixin, DetailVi
         ).count()
 
         # Get pagination parameters
-        previous_post_id = self.request.GET.get("previous_post_id", None)
+        cursor = self.request.GET.get("cursor", None)
         page_size = self.request.GET.get(
             "page_size", 10
         )  # Default to 10 posts per page
@@ -144,49 +145,41 @@ class UserProfileDetailView(LoginRequiredMixin, ExperimentContextMixin, DetailVi
         original_posts = all_posts.filter(parent_post__isnull=True)
         replies = all_posts.filter(parent_post__isnull=False)
 
-        # If previous_post_id provided, paginate from that post
-        if previous_post_id:
-            try:
-                previous_post = Post.objects.get(id=previous_post_id)
-                original_posts = original_posts.filter(
-                    created_date__lt=previous_post.created_date
-                )
-                replies = replies.filter(created_date__lt=previous_post.created_date)
-            except Post.DoesNotExist:
-                pass
+        # If a cursor is provided, paginate from that post. Ordered by newest first
+        original_posts = paginate_after(original_posts, cursor)
+        replies = paginate_after(replies, cursor)
 
-        # Order by newest first and limit to page size
-        context["user_original_posts"] = original_posts.order_by("-created_date")[
-            : int(page_size)
-        ]
-        context["user_replies"] = replies.order_by("-created_date")[: int(page_size)]
+        # Limit to page size
+        context["user_original_posts"] = original_posts[: int(page_size)]
+        context["user_replies"] = replies[: int(page_size)]
 
         # Add counts for the tabs
         context["original_posts_count"] = original_posts.count()
         context["replies_count"] = replies.count()
 
         # Keep the original user_posts for backward compatibility (all posts)
-        context["user_posts"] = all_posts.order_by("-created_date")[: int(page_size)]
+        context["user_posts"] = paginate_after(all_posts, cursor)[: int(page_size)]
 
-        # Annotate each post with comment_count and has_user_voted for template compatibility
-        current_user = self.request.user
+        # Annotate each post with comment_count and has_user_voted for template
+        # compatibility, the latter from the prefetched votes
+        current_user_profile = context.get("current_user_profile")
         for post_list in [
             context["user_original_posts"],
             context["user_replies"],
             context["user_posts"],
         ]:
             for post in post_list:
-                post.comment_count = post.get_comment_count()
-                post.has_user_voted = post.vote_set.filter(
-                    user_profile__user=current_user
-                ).exists()
+                post.comment_count = post.num_comments
+                post.has_user_voted = current_user_profile is not None and any(
+                    vote.user_profile_id == current_user_profile.id and vote.is_upvote
+                    for vote in post.vote_set.all()
+                )
 
         # If HTMX request, map user_posts to posts for template compatibility
         if self.request.headers.get("HX-Request"):
             context["posts"] = context["user_posts"]
 
         # Add whether the current user is following the viewed profile
-        current_user_profile = context.get("current_user_profile")
         if current_user_profile:
             context["is_following_viewed_profile"] = SocialNetwork.objects.filter(
                 source_node=current_user_profile, target_node=self.object